@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from books_service.cache import bump_catalog_version
+from books_service.models import Book
+from books_service.search import get_search_backend
+from books_service.serializers import BookImportSerializer
+
+FIELDS = ("id", "title", "author", "cover", "inventory", "daily_fee")
+UPDATE_FIELDS = ["title", "author", "cover", "inventory", "daily_fee"]
+FORMATS = ("csv", "jsonl")
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors_total: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line: int, detail) -> None:
+        self.errors_total += 1
+        if len(self.errors) < settings.BOOK_IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "errors": detail})
+
+
+def detect_format(name: str | None, default: str = "csv") -> str:
+    if name and name.lower().endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return default
+
+
+def read_rows(stream, file_format: str):
+    """Yield (line number, row) from a binary stream one line at a time,
+    rows that can not be parsed are yielded as ValidationError"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, ValidationError({"non_field_errors": [str(exc)]})
+            continue
+        if not isinstance(row, dict):
+            row = ValidationError({"non_field_errors": ["Expected a JSON object"]})
+        yield line_number, row
+
+
+def validate_batch(rows, result: ImportResult) -> list[Book]:
+    serializer = BookImportSerializer()
+    books = []
+    for line_number, row in rows:
+        if isinstance(row, ValidationError):
+            result.add_error(line_number, row.detail)
+            continue
+        if row.get("id") in ("", None):
+            row.pop("id", None)
+        try:
+            books.append(Book(**serializer.run_validation(row)))
+        except ValidationError as exc:
+            result.add_error(line_number, exc.detail)
+    return books
+
+
+def upsert_books(books: list[Book], result: ImportResult) -> None:
+    """Insert new books and update the ones with existing id using one
+    INSERT ... ON CONFLICT per batch"""
+    if not books:
+        return
+    # one statement can not update a row twice, the last row of an id wins
+    by_id = {book.id: book for book in books if book.id}
+    books = [book for book in books if not book.id] + list(by_id.values())
+    with transaction.atomic():
+        existing = set(Book.objects.filter(id__in=by_id).values_list("id", flat=True))
+        Book.objects.bulk_create(
+            books,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=UPDATE_FIELDS,
+        )
+        if by_id.keys() - existing:
+            # rows inserted with their own id (e.g. an export loaded into
+            # an empty database) leave the PostgreSQL id sequence behind
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Book]):
+                    cursor.execute(sql)
+        # bulk_create skips post_save, so search index follows here
+        if all(book.id for book in books):
+            get_search_backend().index_books(books)
+        else:
+            get_search_backend().rebuild()
+    result.updated += len(existing)
+    result.created += len(books) - len(existing)
+
+
+def import_books(rows, batch_size: int | None = None) -> ImportResult:
+    batch_size = batch_size or settings.BOOK_IMPORT_BATCH_SIZE
+    result = ImportResult()
+    rows = iter(rows)
+    try:
+        while batch := list(islice(rows, batch_size)):
+            upsert_books(validate_batch(batch, result), result)
+    finally:
+        if result.created or result.updated:
+            bump_catalog_version()
+    return result
+
+
+class Echo:
+    """File-like object that returns what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def export_books(file_format: str, chunk_size: int | None = None):
+    """Yield the catalog as CSV or JSONL lines, reading the table with a
+    server-side cursor where the database supports it"""
+    chunk_size = chunk_size or settings.BOOK_EXPORT_CHUNK_SIZE
+    rows = Book.objects.order_by("id").values_list(*FIELDS).iterator(chunk_size)
+    if file_format == "csv":
+        writer = csv.writer(Echo())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+
+    for row in rows:
+        book = dict(zip(FIELDS, row))
+        book["daily_fee"] = str(book["daily_fee"])
+        yield json.dumps(book) + "\n"
@@ -0,0 +1,95 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+from books_service.models import INVENTORY_VERSION_KEY, Book
+from library_service.conditional import bump_versions
+
+CATALOG_VERSION_KEY = "books:catalog-version"
+
+
+def catalog_version() -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+async def acatalog_version() -> int:
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        version = 1
+        await cache.aadd(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def bump_catalog_version() -> None:
+    """Invalidate every cached catalog response and catalog ETag at once"""
+    bump_versions(CATALOG_VERSION_KEY)
+
+
+def catalog_version_keys() -> list[str]:
+    """Version counters of everything a catalog page shows"""
+    return [CATALOG_VERSION_KEY, INVENTORY_VERSION_KEY]
+
+
+def catalog_cache_key(request, version: int | None = None) -> str:
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    version = catalog_version() if version is None else version
+    return f"books:v{version}:{request.path}?{params}"
+
+
+def response_books(data) -> list:
+    if isinstance(data, list):
+        return data
+    return data["results"] if "results" in data else [data]
+
+
+def inventory_query(books):
+    return Book.objects.filter(id__in=[book["id"] for book in books]).values_list(
+        "id", "inventory"
+    )
+
+
+def set_inventory(books, inventory: dict) -> None:
+    for book in books:
+        book["inventory"] = inventory.get(book["id"], 0)
+
+
+def with_live_inventory(data):
+    """Replace cached inventory with the current one using one primary key
+    query, so cached catalog pages never show stale stock"""
+    books = response_books(data)
+    set_inventory(books, dict(inventory_query(books)))
+    return data
+
+
+async def awith_live_inventory(data):
+    books = response_books(data)
+    set_inventory(
+        books, {book_id: count async for book_id, count in inventory_query(books)}
+    )
+    return data
+
+
+def cached_catalog_response(view_method, request, *args, **kwargs):
+    """Read-through cache of view_method response data keyed by catalog
+    version and query params"""
+    key = catalog_cache_key(request)
+    data = cache.get(key)
+    if data is None:
+        data = view_method(request, *args, **kwargs).data
+        cache.set(key, data, settings.BOOK_CATALOG_CACHE_TIMEOUT)
+    return with_live_inventory(data)
+
+
+async def acached_catalog_response(view_method, request, *args, **kwargs):
+    """cached_catalog_response() for async view methods"""
+    key = catalog_cache_key(request, await acatalog_version())
+    data = await cache.aget(key)
+    if data is None:
+        data = (await view_method(request, *args, **kwargs)).data
+        await cache.aset(key, data, settings.BOOK_CATALOG_CACHE_TIMEOUT)
+    return await awith_live_inventory(data)
@@ -0,0 +1,189 @@
+import asyncio
+import dataclasses
+import random
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.reverse import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from books_service.models import Book
+from books_service.views import BookViewSet
+from borrowings_service.models import Borrowing
+from borrowings_service.views import BorrowingsAPIView
+from library_service.benchmark import (
+    format_results,
+    generate_dataset,
+    load_report,
+    save_report,
+    summarize,
+)
+from telegram_chat.models import TelegramUser
+
+SCENARIOS = ("book_list", "book_detail", "borrowing_list", "borrowing_detail")
+MODES = ("sync", "async")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare sync and async list/retrieve of books and borrowings under "
+        "concurrent requests to the ASGI application, report p50/p95/p99 "
+        "and throughput. Generated data is committed, so concurrent "
+        "requests can read it, and deleted at the end"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--books", type=int, default=2_000)
+        parser.add_argument("--borrowings", type=int, default=10_000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=1_000)
+        parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+        parser.add_argument("--mode", action="append", choices=MODES)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", help="save results as JSON")
+        parser.add_argument("--baseline", help="JSON saved by an earlier run")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        scenarios = options["scenario"] or SCENARIOS
+        modes = options["mode"] or MODES
+        baseline = load_report(options["baseline"]) if options["baseline"] else None
+
+        with transaction.atomic():
+            dataset = generate_dataset(
+                options["users"], options["books"], options["borrowings"], rng
+            )
+        try:
+            self.stdout.write(
+                f"generated {len(dataset.users)} users, {len(dataset.books)} "
+                f"books, {dataset.borrowings} borrowings"
+            )
+            runner = ConcurrentRunner(dataset, rng, options["concurrency"])
+            results = []
+            for name in SCENARIOS:
+                if name not in scenarios:
+                    continue
+                for mode in MODES:
+                    if mode in modes:
+                        results.append(runner.run(name, mode, options["requests"]))
+        finally:
+            user_ids = [user.id for user in dataset.users]
+            TelegramUser.objects.filter(user_id__in=user_ids).delete()
+            get_user_model().objects.filter(id__in=user_ids).delete()
+            Book.objects.filter(id__in=[book.id for book in dataset.books]).delete()
+
+        for line in format_results(results, baseline):
+            self.stdout.write(line)
+        if options["output"]:
+            save_report(
+                options["output"],
+                results,
+                {
+                    key: options[key]
+                    for key in (
+                        "users",
+                        "books",
+                        "borrowings",
+                        "concurrency",
+                        "requests",
+                        "seed",
+                    )
+                },
+            )
+
+
+class ConcurrentRunner:
+    """Requests go through the ASGI handler and the whole middleware stack
+    in this process, without a server. The sync mode turns async actions
+    off, so the viewset runs in a thread like any sync view under ASGI"""
+
+    def __init__(self, dataset, rng: random.Random, concurrency: int):
+        self.dataset = dataset
+        self.rng = rng
+        self.concurrency = concurrency
+        self.application = ASGIHandler()
+        self.tokens = {
+            user.id: f"Bearer {AccessToken.for_user(user)}" for user in dataset.users
+        }
+        self.borrowings = list(
+            Borrowing.objects.filter(user__in=dataset.users).values_list(
+                "id", "user_id"
+            )
+        )
+
+    def book_list(self):
+        return (
+            reverse("books-service:book-list"),
+            {
+                "limit": 20,
+                "offset": self.rng.randrange(0, 200, 20),
+            },
+            None,
+        )
+
+    def book_detail(self):
+        book = self.rng.choice(self.dataset.books)
+        return reverse("books-service:book-detail", args=[book.id]), None, None
+
+    def borrowing_list(self):
+        user = self.rng.choice(self.dataset.users)
+        return (
+            reverse("borrowings_service:borrowing-list"),
+            {"limit": 20},
+            self.tokens[user.id],
+        )
+
+    def borrowing_detail(self):
+        borrowing_id, user_id = self.rng.choice(self.borrowings)
+        return (
+            reverse("borrowings_service:borrowing-detail", args=[borrowing_id]),
+            None,
+            self.tokens[user_id],
+        )
+
+    def run(self, name: str, mode: str, total: int):
+        requests = [getattr(self, name)() for _ in range(total)]
+        # fills the catalog and user caches, so the first mode is not slower
+        asyncio.run(self.send_all(requests[: self.concurrency]))
+        with ExitStack() as stack:
+            if mode == "sync":
+                for view in (BookViewSet, BorrowingsAPIView):
+                    stack.enter_context(mock.patch.object(view, "async_actions", ()))
+            started = time.perf_counter()
+            timings = asyncio.run(self.send_all(requests))
+            elapsed = time.perf_counter() - started
+        return dataclasses.replace(
+            summarize(f"{name}_{mode}", timings),
+            seconds=elapsed,
+            throughput=len(timings) / elapsed,
+        )
+
+    async def send_all(self, requests) -> list[float]:
+        queue = asyncio.Queue()
+        for request in requests:
+            queue.put_nowait(request)
+        timings = []
+
+        async def worker(client):
+            while not queue.empty():
+                url, params, token = queue.get_nowait()
+                headers = {"Authorize": token} if token else {}
+                started = time.perf_counter()
+                response = await client.get(url, params=params, headers=headers)
+                timings.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    raise CommandError(f"GET {url}: {response.status_code}")
+
+        transport = httpx.ASGITransport(app=self.application)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://127.0.0.1"
+        ) as client:
+            await asyncio.gather(*(worker(client) for _ in range(self.concurrency)))
+        return timings
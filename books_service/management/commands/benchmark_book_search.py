@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books_service.models import Book
+from books_service.search import IContainsSearchBackend, get_search_backend
+from library_service.benchmark import NAMES, SURNAMES, WORDS
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic catalog and compare icontains scan with the "
+        "configured search backend. Data is rolled back at the end"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=20)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def generate_books(self, total, batch_size, rng):
+        for start in range(0, total, batch_size):
+            Book.objects.bulk_create(
+                Book(
+                    title=" ".join(rng.sample(WORDS, rng.randint(2, 4))).title(),
+                    author=f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}".title(),
+                    cover=rng.choice(Book.CoverChoices.values),
+                    inventory=rng.randint(0, 20),
+                    daily_fee=rng.randint(10, 300) / 100,
+                )
+                for _ in range(min(batch_size, total - start))
+            )
+
+    def measure(self, backend, queries):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            queryset = backend.search(Book.objects.all(), query)
+            queryset.count()
+            list(queryset[:10])
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        self.stdout.write(
+            f"{name:<28} median {statistics.median(timings):9.2f} ms   "
+            f"p95 {p95:9.2f} ms   max {timings[-1]:9.2f} ms"
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        backend = get_search_backend()
+        queries = [
+            " ".join(rng.sample(WORDS + SURNAMES, rng.randint(1, 2)))
+            for _ in range(options["queries"])
+        ]
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.generate_books(options["books"], options["batch_size"], rng)
+            backend.rebuild()
+            self.stdout.write(
+                f"generated {options['books']} books in "
+                f"{time.perf_counter() - started:.1f} s"
+            )
+
+            self.report(
+                "icontains scan", self.measure(IContainsSearchBackend(), queries)
+            )
+            self.report(type(backend).__name__, self.measure(backend, queries))
+
+            transaction.set_rollback(True)
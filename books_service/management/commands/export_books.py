@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from books_service.bulk import FORMATS, export_books
+
+
+class Command(BaseCommand):
+    help = "Write the whole catalog as CSV or JSONL to a file or stdout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--output")
+        parser.add_argument("--chunk-size", type=int)
+
+    def handle(self, *args, **options):
+        stream = (
+            open(options["output"], "w", newline="", encoding="utf-8")
+            if options["output"]
+            else sys.stdout
+        )
+        try:
+            for line in export_books(options["format"], options["chunk_size"]):
+                stream.write(line)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books_service.bulk import FORMATS, detect_format, import_books, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update books from CSV or JSONL file, rows with id "
+        "update that book"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            stream = open(options["path"], "rb")
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with stream:
+            result = import_books(
+                read_rows(stream, options["format"] or detect_format(options["path"])),
+                options["batch_size"],
+            )
+
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        if result.errors_total > len(result.errors):
+            self.stderr.write(
+                f"...and {result.errors_total - len(result.errors)} more errors"
+            )
+        self.stdout.write(
+            f"created {result.created}, updated {result.updated}, "
+            f"failed {result.errors_total}"
+        )
@@ -0,0 +1,50 @@
+from django.db import migrations
+
+FTS_TABLE = "books_service_book_fts"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, author, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, author) "
+            f"SELECT id, title, author FROM books_service_book"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS books_service_book_search_idx "
+            "ON books_service_book USING gin ("
+            "to_tsvector('simple'::regconfig, "
+            "COALESCE(books_service_book.title, '') || ' ' || "
+            "COALESCE(books_service_book.author, '')))"
+        )
+        for field in ("title", "author"):
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS books_service_book_{field}_trgm_idx "
+                f"ON books_service_book USING gin (UPPER({field}) gin_trgm_ops)"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "postgresql":
+        for name in ("search", "title_trgm", "author_trgm"):
+            schema_editor.execute(f"DROP INDEX IF EXISTS books_service_book_{name}_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books_service", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,4 +1,14 @@
-from django.db import models
+from functools import reduce
+from operator import or_
+
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from library_service.conditional import bump_versions
+from library_service.events import publish_on_commit
+
+# changes with every inventory change, catalog ETags include it
+INVENTORY_VERSION_KEY = "books:inventory-version"
 
 
 class Book(models.Model):
@@ -12,5 +22,60 @@ class Book(models.Model):
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=10, decimal_places=2)
 
+    @staticmethod
+    def take_copy(book_id: int) -> bool:
+        """Atomically decrease inventory, returns False when out of stock"""
+        return bool(
+            Book.objects.filter(id=book_id, inventory__gt=0).update(
+                inventory=F("inventory") - 1
+            )
+        )
+
+    @staticmethod
+    def return_copy(book_id: int) -> None:
+        Book.objects.filter(id=book_id).update(inventory=F("inventory") + 1)
+
+    @staticmethod
+    def copies_case(counts: dict[int, int]) -> Case:
+        return Case(
+            *(When(id=book_id, then=Value(count)) for book_id, count in counts.items()),
+            default=Value(0),
+        )
+
+    @staticmethod
+    def take_copies(counts: dict[int, int]) -> bool:
+        """Take count copies of each book with one UPDATE that locks all the
+        rows, nothing changes unless every book has enough inventory"""
+        with transaction.atomic():
+            taken = Book.objects.filter(
+                reduce(
+                    or_,
+                    (
+                        Q(id=book_id, inventory__gte=count)
+                        for book_id, count in counts.items()
+                    ),
+                )
+            ).update(inventory=F("inventory") - Book.copies_case(counts))
+            if taken != len(counts):
+                transaction.set_rollback(True)
+                return False
+        return True
+
+    @staticmethod
+    def return_copies(counts: dict[int, int]) -> None:
+        Book.objects.filter(id__in=counts).update(
+            inventory=F("inventory") + Book.copies_case(counts)
+        )
+
+    @staticmethod
+    def publish_inventory(books) -> None:
+        """Push inventory of the books to event stream clients once the
+        transaction commits and give catalog pages a new ETag"""
+        bump_versions(INVENTORY_VERSION_KEY)
+        for book in books:
+            publish_on_commit(
+                "inventory", {"book": book.id, "inventory": book.inventory}
+            )
+
     def __str__(self):
         return self.title
@@ -0,0 +1,207 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Q, QuerySet
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+FTS_TABLE = "books_service_book_fts"
+
+# the same expression is used by GIN index from migration 0002_book_search,
+# PostgreSQL only uses expression index when query repeats it exactly
+POSTGRES_TEXT = (
+    "COALESCE(books_service_book.title, '') || ' ' || "
+    "COALESCE(books_service_book.author, '')"
+)
+POSTGRES_VECTOR = f"to_tsvector('simple'::regconfig, {POSTGRES_TEXT})"
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def words(query: str) -> list[str]:
+    return WORD_RE.findall(query or "")
+
+
+class BaseSearchBackend:
+    """Search backend interface, search methods return filtered queryset
+    and ranked querysets are annotated with rank (lower is better)"""
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        raise NotImplementedError
+
+    def filter_field(self, queryset: QuerySet, field: str, value: str) -> QuerySet:
+        raise NotImplementedError
+
+    def index_books(self, books) -> None:
+        pass
+
+    def remove_books(self, book_ids) -> None:
+        pass
+
+    def rebuild(self) -> None:
+        pass
+
+
+class IContainsSearchBackend(BaseSearchBackend):
+    """Fallback without full-text index, scans the whole table"""
+
+    def search(self, queryset, query):
+        for word in words(query):
+            queryset = queryset.filter(
+                Q(title__icontains=word) | Q(author__icontains=word)
+            )
+        return queryset
+
+    def filter_field(self, queryset, field, value):
+        return queryset.filter(**{f"{field}__icontains": value})
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """SQLite FTS5 virtual table kept in sync by books_service.signals"""
+
+    @staticmethod
+    def match_expression(query: str, column: str | None = None) -> str:
+        terms = " ".join(f'"{word}"*' for word in words(query))
+        if column and terms:
+            return f"{column} : ({terms})"
+        return terms
+
+    def matching(self, queryset, expression):
+        if not expression:
+            return queryset.none()
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                [expression],
+            )
+        )
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        # join against the virtual table so FTS5 computes bm25 rank once per
+        # match, ORM expressions can only express it as correlated subquery
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f"{FTS_TABLE}.rowid = books_service_book.id",
+                f"{FTS_TABLE} MATCH %s",
+            ],
+            params=[expression],
+            select={"rank": f"{FTS_TABLE}.rank"},
+            order_by=["rank", "id"],
+        )
+
+    def filter_field(self, queryset, field, value):
+        # ?title= and ?author= keep substring matching of the other backends,
+        # the index only narrows rows: inside a matching substring every word
+        # but the first is a whole token or (the last one) a token prefix
+        queryset = queryset.filter(**{f"{field}__icontains": value})
+        inner_words = words(value)[1:]
+        if not inner_words:
+            return queryset
+        return self.matching(
+            queryset, self.match_expression(" ".join(inner_words), field)
+        )
+
+    def index_books(self, books):
+        rows = [(book.id, book.title, book.author) for book in books]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, author) VALUES (%s, %s, %s)",
+                rows,
+            )
+
+    def remove_books(self, book_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                [(book_id,) for book_id in book_ids],
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, author) "
+                f"SELECT id, title, author FROM books_service_book"
+            )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector match served by GIN expression index, with trigram
+    similarity (pg_trgm GIN indexes) for typos and partial words"""
+
+    similarity_threshold = 0.3
+    word_similarity_threshold = 0.6
+
+    def search(self, queryset, query):
+        query_words = words(query)
+        query = " ".join(query_words)
+        if not query:
+            return queryset.none()
+        # every word has to be close to some word of title or author,
+        # whole query similarity lets one matching word pull in other books
+        similar_words = Q(
+            *(
+                RawSQL(
+                    f"word_similarity(%s, {POSTGRES_TEXT}) > %s",
+                    [word, self.word_similarity_threshold],
+                    output_field=BooleanField(),
+                )
+                for word in query_words
+            )
+        )
+        ts_query = "plainto_tsquery('simple'::regconfig, %s)"
+        return (
+            queryset.annotate(
+                text_rank=RawSQL(
+                    f"ts_rank({POSTGRES_VECTOR}, {ts_query})",
+                    [query],
+                    output_field=FloatField(),
+                ),
+                similarity=RawSQL(
+                    "GREATEST(similarity(books_service_book.title, %s), "
+                    "similarity(books_service_book.author, %s))",
+                    [query, query],
+                    output_field=FloatField(),
+                ),
+            )
+            .filter(
+                Q(
+                    RawSQL(
+                        f"{POSTGRES_VECTOR} @@ {ts_query}",
+                        [query],
+                        output_field=BooleanField(),
+                    )
+                )
+                | Q(similarity__gt=self.similarity_threshold) & similar_words
+            )
+            .annotate(rank=-(F("text_rank") + F("similarity")))
+            .order_by("rank", "id")
+        )
+
+    def filter_field(self, queryset, field, value):
+        # icontains compiles to UPPER(field) LIKE UPPER(%value%), which is
+        # served by UPPER(field) gin_trgm_ops indexes from 0002_book_search
+        return queryset.filter(**{f"{field}__icontains": value})
+
+
+@lru_cache
+def get_search_backend() -> BaseSearchBackend:
+    backend_path = settings.BOOK_SEARCH_BACKEND
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == "sqlite":
+        return SQLiteFTSSearchBackend()
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    return IContainsSearchBackend()
@@ -14,4 +14,17 @@ class BookSerializer(serializers.ModelSerializer):
             "cover",
             "inventory",
             "daily_fee"
-        )
\ No newline at end of file
+        )
+
+
+class BookImportSerializer(BookSerializer):
+    """Row of bulk import, rows with id update that book"""
+
+    id = serializers.IntegerField(required=False, min_value=1)
+
+
+class BookImportResultSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    updated = serializers.IntegerField()
+    errors_total = serializers.IntegerField()
+    errors = serializers.ListField(child=serializers.DictField())
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from books_service.cache import bump_catalog_version
+from books_service.models import Book
+from books_service.search import get_search_backend
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, update_fields=None, **kwargs):
+    if not update_fields or "inventory" in update_fields:
+        Book.publish_inventory([instance])
+    if update_fields and set(update_fields) == {"inventory"}:
+        return
+    bump_catalog_version()
+    if update_fields and not {"title", "author"} & set(update_fields):
+        return
+    get_search_backend().index_books([instance])
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_index(sender, instance, **kwargs):
+    bump_catalog_version()
+    get_search_backend().remove_books([instance.id])
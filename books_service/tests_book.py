@@ -1,5 +1,13 @@
+import csv
+import io
+import json
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from decimal import Decimal, ROUND_HALF_UP
@@ -10,6 +18,8 @@ from books_service.models import Book
 from books_service.serializers import BookSerializer
 
 BOOK_LIST_URL = reverse("books-service:book-list")
+BOOK_IMPORT_URL = reverse("books-service:book-import-books")
+BOOK_EXPORT_URL = reverse("books-service:book-export-books")
 
 
 def detail_url(book_id):
@@ -214,3 +224,239 @@ class AdminBookApiTest(TestCase):
         url = detail_url(self.book.id)
         res = self.client.delete(url)
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class BookQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        for _ in range(12):
+            sample_book()
+
+    def count_queries(self, params):
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(BOOK_LIST_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return len(context)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        small_page = self.count_queries({"limit": 2})
+        large_page = self.count_queries({"limit": 12})
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, 3)
+
+
+class BookCatalogCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = sample_book()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res, len(context)
+
+    def test_cached_list_read_only_inventory(self):
+        self.count_queries(BOOK_LIST_URL)
+        res, queries = self.count_queries(BOOK_LIST_URL)
+        self.assertEqual(queries, 1)
+        self.assertEqual(res.data["results"][0]["title"], self.book.title)
+
+    def test_cached_detail_show_live_inventory(self):
+        url = detail_url(self.book.id)
+        self.count_queries(url)
+        Book.take_copy(self.book.id)
+        res, queries = self.count_queries(url)
+        self.assertEqual(queries, 1)
+        self.assertEqual(res.data["inventory"], self.book.inventory - 1)
+
+    def test_book_change_invalidate_cache(self):
+        self.count_queries(BOOK_LIST_URL)
+        self.book.title = "New title"
+        self.book.save()
+        res, queries = self.count_queries(BOOK_LIST_URL)
+        self.assertGreater(queries, 1)
+        self.assertEqual(res.data["results"][0]["title"], "New title")
+
+        self.book.delete()
+        res, _ = self.count_queries(BOOK_LIST_URL)
+        self.assertEqual(res.data["count"], 0)
+
+    def test_query_params_are_part_of_key(self):
+        sample_book(title="Other", author="Somebody")
+        res, _ = self.count_queries(f"{BOOK_LIST_URL}?title=other")
+        self.assertEqual(res.data["count"], 1)
+        res, _ = self.count_queries(BOOK_LIST_URL)
+        self.assertEqual(res.data["count"], 2)
+
+
+class BookSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.hobbit = sample_book(title="The Hobbit", author="J. R. R. Tolkien")
+        self.rings = sample_book(
+            title="The Lord of the Rings", author="J. R. R. Tolkien"
+        )
+        self.dune = sample_book(title="Dune", author="Frank Herbert")
+
+    def search(self, **params):
+        res = self.client.get(BOOK_LIST_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [book["id"] for book in res.data["results"]]
+
+    def test_search_by_title_and_author(self):
+        self.assertEqual(self.search(q="tolkien hobbit"), [self.hobbit.id])
+        self.assertEqual(set(self.search(q="tolk")), {self.hobbit.id, self.rings.id})
+        self.assertEqual(self.search(q="herbert"), [self.dune.id])
+        self.assertEqual(self.search(q="unknown"), [])
+
+    def test_search_order_by_relevance(self):
+        sample_book(title="Dune Messiah", author="Frank Herbert")
+        self.assertEqual(self.search(q="dune")[0], self.dune.id)
+
+    def test_search_ignore_query_syntax(self):
+        self.assertEqual(self.search(q='dune* "'), [self.dune.id])
+        self.assertEqual(self.search(q="***"), [])
+
+    def test_title_filter_do_not_match_author(self):
+        self.assertEqual(self.search(title="tolkien"), [])
+        self.assertEqual(self.search(author="tolkien", title="lord"), [self.rings.id])
+
+    def test_field_filters_match_substrings(self):
+        self.assertEqual(self.search(title="obbit"), [self.hobbit.id])
+        self.assertEqual(self.search(title="he Lord of th"), [self.rings.id])
+        self.assertEqual(self.search(author="rank Herb"), [self.dune.id])
+        self.assertEqual(self.search(title="Lord Rings"), [])
+
+    def test_index_follow_book_changes(self):
+        self.dune.title = "Children of Dune"
+        self.dune.save()
+        self.assertEqual(self.search(q="children"), [self.dune.id])
+
+        self.dune.delete()
+        self.assertEqual(self.search(q="dune"), [])
+
+
+class BookBulkImportExportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            email="admin@gmail.com",
+            password="password1",
+            is_staff=True,
+        )
+        self.client.force_authenticate(self.admin)
+        self.book = sample_book(title="Old Title")
+
+    def upload(self, name, content):
+        return self.client.post(
+            BOOK_IMPORT_URL,
+            {"file": SimpleUploadedFile(name, content.encode())},
+            format="multipart",
+        )
+
+    def test_import_csv_create_update_and_report_errors(self):
+        content = (
+            "id,title,author,cover,inventory,daily_fee\n"
+            f"{self.book.id},New Title,Tiffany Smith,HARD,3,1.50\n"
+            ",Dune,Frank Herbert,SOFT,5,0.75\n"
+            ",Broken,Nobody,PAPER,-1,0.75\n"
+        )
+        with CaptureQueriesContext(connection) as context:
+            res = self.upload("books.csv", content)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["created"], 1)
+        self.assertEqual(res.data["updated"], 1)
+        self.assertEqual(res.data["errors_total"], 1)
+        self.assertEqual(res.data["errors"][0]["line"], 4)
+        self.assertEqual(set(res.data["errors"][0]["errors"]), {"cover", "inventory"})
+        inserts = [q for q in context.captured_queries if "INSERT" in q["sql"]]
+        self.assertLessEqual(len(inserts), 3)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, "New Title")
+        self.assertEqual(self.book.inventory, 3)
+        self.assertTrue(Book.objects.filter(title="Dune").exists())
+
+    def test_import_jsonl_reindex_search_and_invalidate_cache(self):
+        self.client.get(BOOK_LIST_URL)
+        lines = [
+            json.dumps(
+                {
+                    "title": "The Hobbit",
+                    "author": "J. R. R. Tolkien",
+                    "cover": "HARD",
+                    "inventory": 2,
+                    "daily_fee": "1.00",
+                }
+            ),
+            "not json",
+        ]
+        res = self.upload("books.jsonl", "\n".join(lines))
+        self.assertEqual(res.data["created"], 1)
+        self.assertEqual(res.data["errors"][0]["line"], 2)
+
+        res = self.client.get(BOOK_LIST_URL)
+        self.assertEqual(res.data["count"], 2)
+        res = self.client.get(BOOK_LIST_URL, {"q": "hobbit"})
+        self.assertEqual(
+            [book["title"] for book in res.data["results"]], ["The Hobbit"]
+        )
+
+    def test_import_unknown_and_repeated_ids(self):
+        new_id = self.book.id + 100
+        content = (
+            "id,title,author,cover,inventory,daily_fee\n"
+            f"{new_id},Restored,Tiffany Smith,HARD,3,1.50\n"
+            f"{self.book.id},First,Tiffany Smith,HARD,3,1.50\n"
+            f"{self.book.id},Second,Tiffany Smith,HARD,3,1.50\n"
+        )
+        res = self.upload("books.csv", content)
+        self.assertEqual((res.data["created"], res.data["updated"]), (1, 1))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, "Second")
+
+        # the id sequence continues after the imported id
+        self.assertGreater(sample_book(title="Next").id, new_id)
+
+    def test_import_and_export_admin_only(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user(
+                email="user@gmail.com", password="password1"
+            )
+        )
+        self.assertEqual(
+            self.upload("books.csv", "title\n").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+        self.assertEqual(
+            self.client.get(BOOK_EXPORT_URL).status_code, status.HTTP_403_FORBIDDEN
+        )
+
+    def test_export_stream_round_trip(self):
+        sample_book(title="Dune", author="Frank Herbert")
+        res = self.client.get(BOOK_EXPORT_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        content = b"".join(res.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([row["title"] for row in rows], ["Old Title", "Dune"])
+
+        res = self.upload("books.csv", content)
+        self.assertEqual(res.data["updated"], 2)
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_export_jsonl(self):
+        res = self.client.get(BOOK_EXPORT_URL, {"file_format": "jsonl"})
+        books = [
+            json.loads(line)
+            for line in b"".join(res.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(books[0]["id"], self.book.id)
+        self.assertEqual(books[0]["daily_fee"], "0.50")
@@ -1,33 +1,71 @@
+from django.http import StreamingHttpResponse
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 
+from books_service.bulk import (
+    FORMATS,
+    detect_format,
+    export_books,
+    import_books,
+    read_rows,
+)
+from books_service.cache import (
+    acached_catalog_response,
+    cached_catalog_response,
+    catalog_version_keys,
+)
 from books_service.models import Book
-from books_service.serializers import BookSerializer
+from books_service.serializers import BookImportResultSerializer, BookSerializer
 from books_service.permissions import IsAdminOrReadOnly
+from books_service.search import get_search_backend
+from library_service.conditional import ConditionalGetMixin
+from library_service.pagination import AsyncLimitOffsetPagination
+from library_service.viewsets import AsyncReadMixin
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ConditionalGetMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = (IsAdminOrReadOnly,)
+    pagination_class = AsyncLimitOffsetPagination
+
+    def get_version_keys(self):
+        return catalog_version_keys()
 
     def get_queryset(self):
+        query = self.request.query_params.get("q")
         title = self.request.query_params.get("title")
         author = self.request.query_params.get("author")
 
         queryset = self.queryset
+        search_backend = get_search_backend()
 
         if title:
-            queryset = queryset.filter(title__icontains=title)
+            queryset = search_backend.filter_field(queryset, "title", title)
 
         if author:
-            queryset = queryset.filter(author__icontains=author)
+            queryset = search_backend.filter_field(queryset, "author", author)
+
+        if query:
+            queryset = search_backend.search(queryset, query)
 
         return queryset
 
     @extend_schema(
         parameters=[
+            OpenApiParameter(
+                "q",
+                type=OpenApiTypes.STR,
+                description="full-text search by title and author, "
+                "results are ordered by relevance (ex. ?q=tolkien hobbit)",
+                required=False,
+            ),
             OpenApiParameter(
                 "title",
                 type=OpenApiTypes.STR,
@@ -44,4 +82,79 @@ class BookViewSet(viewsets.ModelViewSet):
     )
     def list(self, request, *args, **kwargs):
         """Gets list of Books"""
-        return super().list(request, *args, **kwargs)
+        return Response(cached_catalog_response(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(
+            cached_catalog_response(super().retrieve, request, *args, **kwargs)
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        return Response(
+            await acached_catalog_response(super().alist, request, *args, **kwargs)
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return Response(
+            await acached_catalog_response(super().aretrieve, request, *args, **kwargs)
+        )
+
+    @extend_schema(
+        request={
+            "multipart/form-data": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+            }
+        },
+        responses=BookImportResultSerializer,
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_books(self, request):
+        """Create or update books from CSV or JSONL file (.jsonl), rows
+        with id update that book"""
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": ["No file was submitted."]})
+        result = import_books(read_rows(upload, detect_format(upload.name)))
+        return Response(
+            BookImportResultSerializer(result).data,
+            status=status.HTTP_200_OK,
+        )
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "file_format",
+                type=OpenApiTypes.STR,
+                enum=FORMATS,
+                description="export format, csv by default (ex. ?file_format=jsonl)",
+                required=False,
+            ),
+        ],
+        responses={(200, "text/csv"): OpenApiTypes.BINARY},
+    )
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="export",
+        permission_classes=[IsAdminUser],
+    )
+    def export_books(self, request):
+        """Stream the whole catalog without loading it into memory"""
+        export_format = request.query_params.get("file_format", "csv")
+        if export_format not in FORMATS:
+            raise ValidationError({"file_format": [f"Choose one of {FORMATS}."]})
+        content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+        response = StreamingHttpResponse(
+            export_books(export_format), content_type=content_type
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="books.{export_format}"'
+        )
+        return response
@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from borrowings_service.models import Borrowing
+from borrowings_service.models import BookHold, Borrowing, BorrowingSummary
 
 admin.site.register(Borrowing)
+admin.site.register(BorrowingSummary)
+admin.site.register(BookHold)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BorrowingsServiceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "borrowings_service"
+
+    def ready(self):
+        import borrowings_service.signals  # noqa: F401
@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+from django.utils.timezone import now
+from rest_framework.exceptions import ValidationError
+
+from books_service.models import Book
+from borrowings_service.models import BookHold
+from telegram_chat.tasks import queue_messages
+
+WAITING = BookHold.StatusChoices.WAITING
+READY = BookHold.StatusChoices.READY
+
+
+def queue_position():
+    """Waiting holds of the same book placed before this one, plus one"""
+    ahead = (
+        BookHold.objects.filter(
+            book_id=OuterRef("book_id"), status=WAITING, id__lte=OuterRef("id")
+        )
+        .order_by()
+        .values("book_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Subquery(ahead)
+
+
+def place_hold(user, book: Book) -> BookHold:
+    """Join the queue of a book that is out of stock. Call inside
+    write_transaction, the book row lock orders it with returns"""
+    inventory = (
+        Book.objects.select_for_update()
+        .filter(id=book.id)
+        .values_list("inventory", flat=True)
+        .first()
+    )
+    if inventory:
+        raise ValidationError("book is in stock, borrow it instead")
+    if BookHold.objects.filter(
+        book=book, user=user, status__in=BookHold.ACTIVE_STATUSES
+    ).exists():
+        raise ValidationError("you already hold this book")
+    return BookHold.objects.create(
+        book=book, user=user, expires_at=now() + settings.BOOK_HOLD_MAX_WAIT
+    )
+
+
+def hand_over_copies(counts: dict[int, int]) -> list[BookHold]:
+    """Give returned copies to the oldest waiting holds of each book and
+    queue a Telegram message for their holders, copies nobody waits for go
+    back to inventory. Runs in the transaction of the return, so the copy
+    is never free for anyone else in between"""
+    counts = {book_id: count for book_id, count in counts.items() if count}
+    if not counts:
+        return []
+    # same lock order as place_hold, sorted to avoid deadlocks
+    list(
+        Book.objects.select_for_update()
+        .filter(id__in=counts)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    current = now()
+    holds = []
+    for book_id, count in counts.items():
+        holds.extend(
+            BookHold.objects.select_for_update(of=("self",))
+            .select_related("book", "user__telegram")
+            .filter(book_id=book_id, status=WAITING, expires_at__gt=current)
+            .order_by("id")[:count]
+        )
+    if holds:
+        expires_at = current + settings.BOOK_HOLD_PICKUP_WINDOW
+        BookHold.objects.filter(id__in=[hold.id for hold in holds]).update(
+            status=READY, ready_at=current, expires_at=expires_at
+        )
+        queue_messages(
+            [
+                (
+                    hold.user.telegram.chat_id,
+                    f"{hold.book.title} by {hold.book.author} you are waiting "
+                    f"for is back, borrow it before "
+                    f"{expires_at:%Y-%m-%d %H:%M} UTC",
+                )
+                for hold in holds
+                if hasattr(hold.user, "telegram")
+            ]
+        )
+        for hold in holds:
+            counts[hold.book_id] -= 1
+            hold.status, hold.ready_at, hold.expires_at = READY, current, expires_at
+    remaining = {book_id: count for book_id, count in counts.items() if count}
+    if remaining:
+        Book.return_copies(remaining)
+        Book.publish_inventory(
+            Book.objects.filter(id__in=remaining).only("id", "inventory")
+        )
+    return holds
+
+
+def claim_holds(user_id: int, book_ids) -> set[int]:
+    """Mark ready holds of the user for these books fulfilled, returns ids
+    of books whose reserved copy the user takes"""
+    holds = BookHold.objects.filter(
+        user_id=user_id, book_id__in=book_ids, status=READY, expires_at__gt=now()
+    )
+    claimed = set(holds.select_for_update().values_list("book_id", flat=True))
+    if claimed:
+        holds.update(status=BookHold.StatusChoices.FULFILLED)
+    return claimed
+
+
+def cancel_hold(hold: BookHold) -> None:
+    """Leave the queue, a reserved copy goes to the next holder. Call
+    inside write_transaction, a return may have made the hold ready since
+    it was loaded, so the current status is read under lock"""
+    # book row first, same lock order as hand_over_copies
+    list(
+        Book.objects.select_for_update()
+        .filter(id=hold.book_id)
+        .values_list("id", flat=True)
+    )
+    status = (
+        BookHold.objects.select_for_update()
+        .filter(id=hold.id, status__in=BookHold.ACTIVE_STATUSES)
+        .values_list("status", flat=True)
+        .first()
+    )
+    if status is None:
+        raise ValidationError("hold is not active")
+    BookHold.objects.filter(id=hold.id).update(status=BookHold.StatusChoices.CANCELLED)
+    if status == READY:
+        hand_over_copies({hold.book_id: 1})
+    hold.status = BookHold.StatusChoices.CANCELLED
+
+
+def expire_holds() -> int:
+    """Expire holds past expires_at, copies of ready holds move on down
+    the queue. Call inside write_transaction"""
+    expired = list(
+        BookHold.objects.select_for_update(of=("self",))
+        .filter(status__in=BookHold.ACTIVE_STATUSES, expires_at__lte=now())
+        .values_list(
+            "id", "book_id", "status", "user__telegram__chat_id", "book__title"
+        )
+    )
+    if not expired:
+        return 0
+    BookHold.objects.filter(id__in=[hold_id for hold_id, *_ in expired]).update(
+        status=BookHold.StatusChoices.EXPIRED
+    )
+    counts = {}
+    for _, book_id, status, _, _ in expired:
+        if status == READY:
+            counts[book_id] = counts.get(book_id, 0) + 1
+    queue_messages(
+        [
+            (chat_id, f"Your hold on {title} has expired, it went to the next reader")
+            for _, _, status, chat_id, title in expired
+            if status == READY and chat_id
+        ]
+    )
+    hand_over_copies(counts)
+    return len(expired)
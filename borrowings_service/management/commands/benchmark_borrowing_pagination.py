@@ -0,0 +1,98 @@
+import datetime
+import random
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from books_service.models import Book
+from borrowings_service.models import Borrowing
+from borrowings_service.views import BorrowingsAPIView
+from library_service.pagination import KeysetPagination
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare limit/offset and cursor pages of the borrowing list at "
+        "growing depth. Data is rolled back at the end"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--borrowings", type=int, default=200_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+
+    def generate(self, total, batch_size):
+        rng = random.Random(42)
+        admin = get_user_model().objects.create_user(
+            email="benchmark-admin@library.test", password="benchmark", is_staff=True
+        )
+        book = Book.objects.create(
+            title="Benchmark",
+            author="Benchmark",
+            cover="SOFT",
+            inventory=1,
+            daily_fee=1,
+        )
+        today = datetime.date.today()
+        for start in range(0, total, batch_size):
+            borrowings = []
+            for _ in range(min(batch_size, total - start)):
+                expected = today + datetime.timedelta(days=rng.randint(-60, 60))
+                returned = rng.random() < 0.7
+                borrowings.append(
+                    Borrowing(
+                        expected_return_date=expected,
+                        actual_return_date=(
+                            expected + datetime.timedelta(days=rng.randint(-5, 5))
+                            if returned
+                            else None
+                        ),
+                        book=book,
+                        user=admin,
+                    )
+                )
+            Borrowing.objects.bulk_create(borrowings)
+        return admin
+
+    def timed(self, view, admin, params, repeat):
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(repeat):
+            request = factory.get(
+                "/api/library/borrowings/", params, SERVER_NAME="127.0.0.1"
+            )
+            force_authenticate(request, user=admin)
+            started = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def cursor_at(self, depth):
+        pagination = KeysetPagination()
+        pagination.fields = BorrowingsAPIView.keyset_ordering
+        row = pagination.order_queryset(Borrowing.objects.all())[depth]
+        return pagination.encode_cursor(row)
+
+    def handle(self, *args, **options):
+        total = options["borrowings"]
+        view = async_to_sync(BorrowingsAPIView.as_view({"get": "list"}))
+
+        with transaction.atomic():
+            admin = self.generate(total, options["batch_size"])
+            self.stdout.write(f"{'depth':>10} {'offset ms':>12} {'cursor ms':>12}")
+            for depth in (0, total // 10, total // 2, total * 9 // 10, total - 20):
+                offset_ms = self.timed(
+                    view, admin, {"limit": 10, "offset": depth}, options["repeat"]
+                )
+                cursor_params = {"limit": 10, "count": "false"}
+                if depth:
+                    cursor_params["cursor"] = self.cursor_at(depth - 1)
+                cursor_ms = self.timed(view, admin, cursor_params, options["repeat"])
+                self.stdout.write(f"{depth:>10} {offset_ms:>12.2f} {cursor_ms:>12.2f}")
+            transaction.set_rollback(True)
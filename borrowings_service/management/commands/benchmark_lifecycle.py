@@ -0,0 +1,236 @@
+import dataclasses
+import datetime
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from borrowings_service.tasks import send_message_for_overdue_borrowings
+from library_service.benchmark import (
+    WORDS,
+    benchmark_database,
+    format_results,
+    generate_dataset,
+    load_report,
+    save_report,
+    stand_ins,
+    summarize,
+)
+from payment_service.tasks import generate_overdue_fines
+
+SCENARIOS = ("catalog_search", "borrow", "list_borrowings", "return", "overdue_task")
+# nightly batch jobs, they never run next to copies of themselves
+SERIAL_SCENARIOS = ("overdue_task",)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run borrow/return lifecycle scenarios with concurrent workers against "
+        "synthetic data and Stripe and Telegram stand-ins, report p50/p95/p99 "
+        "and wall-clock throughput. Runs on a throwaway benchmark_<name> "
+        "database, the configured one is not touched"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000)
+        parser.add_argument("--books", type=int, default=5_000)
+        parser.add_argument("--borrowings", type=int, default=50_000)
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--overdue-iterations", type=int, default=3)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="concurrent clients, each with its own database connection",
+        )
+        parser.add_argument(
+            "--celery-workers",
+            type=int,
+            default=2,
+            help="threads running tasks sent by requests, 0 runs them inline",
+        )
+        parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+        parser.add_argument("--stripe-latency-ms", type=float, default=0)
+        parser.add_argument("--telegram-latency-ms", type=float, default=0)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", help="save results as JSON")
+        parser.add_argument("--baseline", help="JSON saved by an earlier run")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        rng = random.Random(options["seed"])
+        scenarios = options["scenario"] or SCENARIOS
+        baseline = load_report(options["baseline"]) if options["baseline"] else None
+
+        with benchmark_database(max(options["verbosity"] - 1, 0)):
+            with stand_ins(
+                options["stripe_latency_ms"] / 1000,
+                options["telegram_latency_ms"] / 1000,
+                options["celery_workers"],
+            ):
+                dataset = generate_dataset(
+                    options["users"], options["books"], options["borrowings"], rng
+                )
+                self.stdout.write(
+                    f"generated {len(dataset.users)} users, "
+                    f"{len(dataset.books)} books, {dataset.borrowings} "
+                    f"borrowings, {dataset.payments} payments"
+                )
+                runner = ScenarioRunner(dataset, rng, options["workers"])
+                results = []
+                for name in SCENARIOS:
+                    if name not in scenarios:
+                        continue
+                    repeat = (
+                        options["overdue_iterations"]
+                        if name == "overdue_task"
+                        else options["iterations"]
+                    )
+                    results.append(runner.run(name, repeat))
+            connections.close_all()
+
+        for line in format_results(results, baseline):
+            self.stdout.write(line)
+        if options["output"]:
+            save_report(
+                options["output"],
+                results,
+                {
+                    key: options[key]
+                    for key in (
+                        "users",
+                        "books",
+                        "borrowings",
+                        "iterations",
+                        "workers",
+                        "celery_workers",
+                        "stripe_latency_ms",
+                        "telegram_latency_ms",
+                        "seed",
+                    )
+                },
+            )
+
+
+class ScenarioRunner:
+    """Every operation returns its latency in seconds. Operations of a
+    scenario are split between workers, threads with their own client and
+    database connection, and throughput is operations per wall-clock
+    second. Requests go through the whole middleware and URL stack"""
+
+    def __init__(self, dataset, rng: random.Random, workers: int):
+        self.dataset = dataset
+        self.rng = rng
+        self.workers = workers
+        self.borrowed = deque()
+
+    def run(self, name: str, repeat: int):
+        operation = self.scenario(name)
+        if name == "return":
+            # returns need borrowings, made before the timed part
+            missing = repeat - len(self.borrowed)
+            if missing > 0:
+                self.run_workers(self.borrow, missing, self.workers)
+        workers = 1 if name in SERIAL_SCENARIOS else self.workers
+        started = time.perf_counter()
+        timings = self.run_workers(operation, repeat, workers)
+        elapsed = time.perf_counter() - started
+        return dataclasses.replace(
+            summarize(name, timings),
+            seconds=elapsed,
+            throughput=len(timings) / elapsed if elapsed else 0.0,
+        )
+
+    def run_workers(self, operation, repeat: int, workers: int) -> list[float]:
+        counts = [
+            repeat // workers + (index < repeat % workers) for index in range(workers)
+        ]
+        seeds = [self.rng.random() for _ in counts]
+        with ThreadPoolExecutor(workers, thread_name_prefix="benchmark") as executor:
+            futures = [
+                executor.submit(self.work, operation, count, random.Random(seed))
+                for count, seed in zip(counts, seeds)
+                if count
+            ]
+            return [timing for future in futures for timing in future.result()]
+
+    @staticmethod
+    def work(operation, count: int, rng: random.Random) -> list[float]:
+        client = APIClient(SERVER_NAME="127.0.0.1")
+        try:
+            return [operation(client, rng) for _ in range(count)]
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def request(client, method, url, user=None, data=None):
+        client.force_authenticate(user=user)
+        started = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise CommandError(f"{method.upper()} {url}: {response.status_code}")
+        return response, elapsed
+
+    def catalog_search(self, client, rng):
+        url = reverse("books-service:book-list")
+        return self.request(
+            client, "get", url, data={"q": " ".join(rng.sample(WORDS, 2))}
+        )[1]
+
+    def borrow(self, client, rng):
+        url = reverse("borrowings_service:borrowing-list")
+        user = rng.choice(self.dataset.users)
+        book = rng.choice(self.dataset.books)
+        response, elapsed = self.request(
+            client,
+            "post",
+            url,
+            user,
+            {
+                "book": book.id,
+                "expected_return_date": datetime.date.today()
+                + datetime.timedelta(days=14),
+            },
+        )
+        self.borrowed.append((response.data["id"], user))
+        return elapsed
+
+    def list_borrowings(self, client, rng):
+        url = reverse("borrowings_service:borrowing-list")
+        return self.request(
+            client,
+            "get",
+            url,
+            rng.choice(self.dataset.users),
+            {"limit": 20, "is_active": "true"},
+        )[1]
+
+    def return_borrowing(self, client, rng):
+        borrowing_id, user = self.borrowed.pop()
+        url = reverse(
+            "borrowings_service:borrowing-return-borrowing", args=[borrowing_id]
+        )
+        return self.request(client, "post", url, user)[1]
+
+    def overdue_task(self, client, rng):
+        """The first run does the whole backlog, next runs are incremental"""
+        started = time.perf_counter()
+        send_message_for_overdue_borrowings()
+        generate_overdue_fines()
+        return time.perf_counter() - started
+
+    def scenario(self, name):
+        return {
+            "catalog_search": self.catalog_search,
+            "borrow": self.borrow,
+            "list_borrowings": self.list_borrowings,
+            "return": self.return_borrowing,
+            "overdue_task": self.overdue_task,
+        }[name]
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from borrowings_service.summary import rebuild_all_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute per-user borrowing summaries from borrowings and payments"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Rebuilt {rebuild_all_summaries()} summaries")
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books_service", "0002_book_search"),
+        ("borrowings_service", "0003_alter_borrowing_options"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["actual_return_date", "expected_return_date", "id"],
+                name="borrowing_ordering_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "actual_return_date", "expected_return_date", "id"],
+                name="borrowing_user_ordering_idx",
+            ),
+        ),
+    ]
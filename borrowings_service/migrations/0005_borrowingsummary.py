@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowings_service", "0004_borrowing_indexes"),
+        ("users_service", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BorrowingSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="borrowing_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("active_count", models.IntegerField(default=0)),
+                ("overdue_count", models.IntegerField(default=0)),
+                (
+                    "outstanding",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("overdue_as_of", models.DateField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name_plural": "borrowing summaries",
+            },
+        ),
+    ]
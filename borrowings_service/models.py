@@ -2,6 +2,7 @@ import datetime
 
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Q
 from rest_framework.exceptions import ValidationError
 
 from books_service.models import Book
@@ -18,6 +19,12 @@ class Borrowing(models.Model):
         get_user_model(), on_delete=models.CASCADE, related_name="user_borrowings"
     )
 
+    @staticmethod
+    def overdue_filter(today: datetime.date) -> Q:
+        """Not returned and overdue from the day after the expected return,
+        the rule of fines, summaries and the overdue digest"""
+        return Q(actual_return_date__isnull=True, expected_return_date__lt=today)
+
     @staticmethod
     def validate_borrowing(return_date, error_to_raise, actual_return_date=None):
         borrow_date = datetime.date.today()
@@ -51,3 +58,83 @@ class Borrowing(models.Model):
 
     class Meta:
         ordering = ["actual_return_date", "expected_return_date"]
+        indexes = [
+            # list ordering, keyset pagination and overdue scan
+            # (actual_return_date IS NULL AND expected_return_date <= ?)
+            models.Index(
+                fields=["actual_return_date", "expected_return_date", "id"],
+                name="borrowing_ordering_idx",
+            ),
+            models.Index(
+                fields=["user", "actual_return_date", "expected_return_date", "id"],
+                name="borrowing_user_ordering_idx",
+            ),
+        ]
+
+
+class BorrowingSummary(models.Model):
+    """Per-user counters for "my account" views, kept up to date by the
+    borrow, return and payment code paths (see borrowings_service.summary).
+    overdue_count is exact as of overdue_as_of, borrowings become overdue
+    without any write so the daily task moves it forward"""
+
+    user = models.OneToOneField(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="borrowing_summary",
+    )
+    active_count = models.IntegerField(default=0)
+    overdue_count = models.IntegerField(default=0)
+    outstanding = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    overdue_as_of = models.DateField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "borrowing summaries"
+
+    def __str__(self):
+        return f"Summary of user {self.user_id}"
+
+
+class BookHold(models.Model):
+    """Place in the waiting queue of a book that is out of stock. Returned
+    copies go to the oldest waiting hold (see borrowings_service.holds),
+    the holder has until expires_at to borrow it"""
+
+    class StatusChoices(models.TextChoices):
+        WAITING = "WAITING"
+        READY = "READY"
+        FULFILLED = "FULFILLED"
+        CANCELLED = "CANCELLED"
+        EXPIRED = "EXPIRED"
+
+    ACTIVE_STATUSES = (StatusChoices.WAITING, StatusChoices.READY)
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="holds")
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name="book_holds"
+    )
+    status = models.CharField(
+        max_length=10, choices=StatusChoices.choices, default=StatusChoices.WAITING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "user"],
+                condition=models.Q(status__in=["WAITING", "READY"]),
+                name="one_active_hold_per_book",
+            ),
+        ]
+        indexes = [
+            # next waiting hold of a book, FIFO by id
+            models.Index(fields=["book", "status", "id"], name="hold_queue_idx"),
+            models.Index(fields=["status", "expires_at"], name="hold_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"Hold of {self.book_id} by {self.user_id}: {self.status}"
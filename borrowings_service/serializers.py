@@ -1,16 +1,35 @@
 import datetime
+from collections import Counter
 
-from django.db import transaction
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from borrowings_service.models import Borrowing
+from borrowings_service.holds import claim_holds, hand_over_copies, place_hold
+from borrowings_service.models import BookHold, Borrowing, BorrowingSummary
+from borrowings_service.summary import (
+    record_borrow,
+    record_bulk_borrow,
+    record_return,
+    record_returns,
+)
+from books_service.models import Book
 from books_service.serializers import BookSerializer
-from telegram_chat.views import send_message_to_chat, send_private_message
-from payment_service.views import helper
+from library_service.database import write_transaction
+from library_service.events import publish_on_commit
+from telegram_chat.tasks import queue_message_to_chat, queue_private_message
+from payment_service.views import create_payments, helper
 from payment_service.serializers import PaymentSerializer
 
 
+def stock_message(book: Book) -> str:
+    if book.inventory == 0:
+        return f"We out of stock of the {book.title} by {book.author}"
+    if book.inventory <= 3:
+        return f"Only {book.inventory} copy of {book.title} by {book.author} left"
+    return f"Have you already read {book.title} by {book.author}"
+
+
 class BorrowingSerializer(serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
     payments = PaymentSerializer(many=True, read_only=True)
@@ -28,6 +47,13 @@ class BorrowingSerializer(serializers.ModelSerializer):
         )
 
 
+class BorrowingSummarySerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = BorrowingSummary
+        fields = ("active_count", "overdue_count", "outstanding", "overdue_as_of")
+
+
 class CreateBorrowingSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
@@ -37,39 +63,43 @@ class CreateBorrowingSerializer(serializers.ModelSerializer):
         )
         Borrowing.validate_borrowing(expected_return_date, ValidationError)
         book = attrs.get("book", None)
-        if book.inventory <= 0:
+        if book.inventory <= 0 and not self.has_ready_hold(book):
             raise ValidationError(
                 "insufficient inventory, inventory must be greater than 0"
             )
 
         return data
 
+    def has_ready_hold(self, book: Book) -> bool:
+        request = self.context.get("request")
+        return bool(request) and (
+            BookHold.objects.filter(
+                book=book, user_id=request.user.id, status=BookHold.StatusChoices.READY
+            ).exists()
+        )
+
     def create(self, validated_data):
-        with transaction.atomic():
+        with write_transaction():
             book = validated_data.get("book")
-            book.inventory -= 1
-            book.save()
-            if book.inventory == 0:
-                massage = f"We out of stock of the {book.title} by {book.author}"
-                send_message_to_chat(massage)
-            elif book.inventory <= 3:
-                message = (
-                    f"Only {book.inventory} copy of {book.title} by {book.author} left"
-                )
-                send_message_to_chat(message)
-            else:
-                message = f"Have you already read {book.title} by {book.author}"
-                send_message_to_chat(message)
             user = validated_data.get("user")
+            # the copy reserved for a ready hold is already off inventory
+            if not (claim_holds(user.id, [book.id]) or Book.take_copy(book.id)):
+                raise ValidationError(
+                    "insufficient inventory, inventory must be greater than 0"
+                )
+            book.refresh_from_db(fields=["inventory"])
+            Book.publish_inventory([book])
+            queue_message_to_chat(stock_message(book))
             if hasattr(user, "telegram"):
                 return_date = validated_data.get("expected_return_date")
                 message = (
                     f"Congratulations you just borrowed {book.title} by {book.author},"
                     f" make sure you finish reading by {return_date}"
                 )
-                send_private_message(message, chat_id=user.telegram.chat_id)
+                queue_private_message(message, chat_id=user.telegram.chat_id)
             borrowing = Borrowing.objects.create(**validated_data)
-            helper(borrowing)
+            record_borrow(borrowing, helper(borrowing))
+            publish_on_commit("borrow", {"id": borrowing.id, "book": book.id})
             return borrowing
 
     class Meta:
@@ -83,12 +113,149 @@ class ReturnBorrowingSerializer(serializers.ModelSerializer):
         model = Borrowing
         fields = ("id",)
 
-    def update(self, instance, validated_data):
-        borrowing = super().update(instance, validated_data)
-        if not borrowing.actual_return_date:
-            borrowing.actual_return_date = datetime.date.today()
-            borrowing.save()
-            borrowing.book.inventory += 1
-            borrowing.book.save()
-            return borrowing
-        raise ValidationError("already returned")
+    def update(self, borrowing, validated_data):
+        # no save(): full_clean() rejects overdue borrowings, and the row
+        # loaded by the view may already be returned by another request
+        today = datetime.date.today()
+        with write_transaction():
+            returned = Borrowing.objects.filter(
+                id=borrowing.id, actual_return_date__isnull=True
+            ).update(actual_return_date=today)
+            if not returned:
+                raise ValidationError("already returned")
+            hand_over_copies({borrowing.book_id: 1})
+            record_return(borrowing)
+            publish_on_commit("return", {"id": borrowing.id, "book": borrowing.book_id})
+        borrowing.actual_return_date = today
+        return borrowing
+
+
+class BulkBorrowingItemSerializer(serializers.ModelSerializer):
+    # books of all items are fetched with one query in BulkBorrowingSerializer
+    book = serializers.IntegerField(source="book_id", min_value=1)
+
+    def validate(self, attrs):
+        Borrowing.validate_borrowing(attrs["expected_return_date"], ValidationError)
+        return attrs
+
+    class Meta:
+        model = Borrowing
+        fields = ("id", "expected_return_date", "book")
+
+
+class BulkBorrowingSerializer(serializers.Serializer):
+    """Borrow several books at once: one inventory UPDATE, one combined
+    checkout session and one message per chat"""
+
+    borrowings = BulkBorrowingItemSerializer(
+        many=True, min_length=1, max_length=settings.BULK_BORROWING_MAX_ITEMS
+    )
+
+    def validate_borrowings(self, items):
+        books = Book.objects.in_bulk({item["book_id"] for item in items})
+        missing = sorted({item["book_id"] for item in items} - books.keys())
+        if missing:
+            raise ValidationError(f"books {missing} do not exist")
+        for item in items:
+            item["book"] = books[item.pop("book_id")]
+        return items
+
+    def create(self, validated_data):
+        user = validated_data["user"]
+        items = validated_data["borrowings"]
+        counts = Counter(item["book"].id for item in items)
+        with write_transaction():
+            for book_id in claim_holds(user.id, counts):
+                counts[book_id] -= 1
+            # books fully covered by ready holds need no inventory
+            taken = +counts
+            if taken and not Book.take_copies(taken):
+                raise ValidationError(
+                    "insufficient inventory, inventory must be greater than 0"
+                )
+            books = Book.objects.in_bulk(counts)
+            borrowings = Borrowing.objects.bulk_create(
+                Borrowing(user=user, **item) for item in items
+            )
+            record_bulk_borrow(user.id, create_payments(borrowings))
+            Book.publish_inventory(books.values())
+            for borrowing in borrowings:
+                publish_on_commit(
+                    "borrow", {"id": borrowing.id, "book": borrowing.book_id}
+                )
+            queue_message_to_chat("\n".join(map(stock_message, books.values())))
+            if hasattr(user, "telegram"):
+                lines = [
+                    f"{item['book'].title} by {item['book'].author}, "
+                    f"finish reading by {item['expected_return_date']}"
+                    for item in items
+                ]
+                queue_private_message(
+                    "\n".join(["Congratulations you just borrowed:", *lines]),
+                    chat_id=user.telegram.chat_id,
+                )
+        return {"borrowings": borrowings}
+
+
+class BulkReturnBorrowingSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.BULK_BORROWING_MAX_ITEMS,
+    )
+    actual_return_date = serializers.DateField(read_only=True)
+
+    def validate_borrowings(self, value):
+        if len(set(value)) != len(value):
+            raise ValidationError("borrowings must not repeat")
+        return value
+
+    def create(self, validated_data):
+        user = validated_data["user"]
+        borrowing_ids = validated_data["borrowings"]
+        today = datetime.date.today()
+        with write_transaction():
+            returned = Borrowing.objects.filter(
+                id__in=borrowing_ids, user=user, actual_return_date__isnull=True
+            ).update(actual_return_date=today)
+            if returned != len(borrowing_ids):
+                raise ValidationError(
+                    "borrowings must be your own and not returned yet"
+                )
+            borrowings = list(
+                Borrowing.objects.filter(id__in=borrowing_ids).only(
+                    "id", "book_id", "user_id", "expected_return_date"
+                )
+            )
+            hand_over_copies(Counter(borrowing.book_id for borrowing in borrowings))
+            record_returns(user.id, borrowings)
+            for borrowing in borrowings:
+                publish_on_commit(
+                    "return", {"id": borrowing.id, "book": borrowing.book_id}
+                )
+        return {"borrowings": borrowing_ids, "actual_return_date": today}
+
+
+class BookHoldSerializer(serializers.ModelSerializer):
+    position = serializers.IntegerField(read_only=True, allow_null=True)
+
+    def create(self, validated_data):
+        with write_transaction():
+            hold = place_hold(validated_data["user"], validated_data["book"])
+        hold.position = BookHold.objects.filter(
+            book_id=hold.book_id, status=BookHold.StatusChoices.WAITING, id__lte=hold.id
+        ).count()
+        return hold
+
+    class Meta:
+        model = BookHold
+        fields = (
+            "id",
+            "book",
+            "status",
+            "position",
+            "created_at",
+            "ready_at",
+            "expires_at",
+        )
+        read_only_fields = ("status", "created_at", "ready_at", "expires_at")
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borrowings_service.models import Borrowing
+from borrowings_service.summary import bump_borrowings_version
+from payment_service.models import Payment
+
+
+@receiver(post_save, sender=Borrowing)
+@receiver(post_delete, sender=Borrowing)
+def borrowing_changed(sender, instance, **kwargs):
+    """Edits outside the serializers, e.g. in admin. QuerySet.update() and
+    bulk writes bump the version where they are made"""
+    bump_borrowings_version([instance.user_id])
+
+
+@receiver(post_save, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    bump_borrowings_version([instance.borrowing.user_id])
@@ -0,0 +1,211 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+from operator import sub
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Case, Count, DecimalField, F, OuterRef, Q, Subquery
+from django.db.models import Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from borrowings_service.models import Borrowing, BorrowingSummary
+from library_service.conditional import bump_versions
+from library_service.database import write_transaction
+from payment_service.models import Payment
+
+BORROWINGS_VERSION_KEY = "borrowings:version"
+
+
+def borrowings_version_key(user_id: int) -> str:
+    return f"borrowings:{user_id}:version"
+
+
+def borrowings_version_keys(user) -> list[str]:
+    """Counter of the borrowings and payments a user sees, staff see all"""
+    if user.is_staff:
+        return [BORROWINGS_VERSION_KEY]
+    return [borrowings_version_key(user.id)]
+
+
+def bump_borrowings_version(user_ids) -> None:
+    """Borrowings or payments of the users changed, their pages and the
+    staff ones get a new ETag"""
+    bump_versions(BORROWINGS_VERSION_KEY, *map(borrowings_version_key, user_ids))
+
+
+def compute_summary(user_id: int) -> BorrowingSummary:
+    """Summary of one user counted from borrowings and payments"""
+    today = now().date()
+    counts = Borrowing.objects.filter(user_id=user_id).aggregate(
+        active=Count("id", filter=Q(actual_return_date__isnull=True)),
+        overdue=Count("id", filter=Borrowing.overdue_filter(today)),
+    )
+    outstanding = Payment.objects.filter(
+        borrowing__user_id=user_id, status=Payment.StatusChoices.PENDING
+    ).aggregate(total=Sum("money_to_pay"))["total"]
+    return BorrowingSummary(
+        user_id=user_id,
+        active_count=counts["active"],
+        overdue_count=counts["overdue"],
+        outstanding=outstanding or Decimal("0"),
+        overdue_as_of=today,
+    )
+
+
+def rebuild_summary(user_id: int) -> BorrowingSummary:
+    summary = compute_summary(user_id)
+    summary.save()
+    return summary
+
+
+def lock_summary_builds(user_ids) -> None:
+    """get_summary builds a missing row holding the lock of the user row.
+    Writers take the locks of users without a row too, so their change
+    ends up either in the built row or applied to it. On SQLite
+    write_transaction() already serializes both"""
+    if not connection.features.has_select_for_update:
+        return
+    list(
+        get_user_model()
+        .objects.select_for_update(of=("self",))
+        .filter(id__in=user_ids, borrowing_summary__isnull=True)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+def get_summary(user_id: int) -> BorrowingSummary:
+    """Primary key lookup, the row is built on first access"""
+    summary = BorrowingSummary.objects.filter(user_id=user_id).first()
+    if summary is None:
+        with write_transaction():
+            lock_summary_builds([user_id])
+            summary = compute_summary(user_id)
+            # a concurrent request may have built it already
+            BorrowingSummary.objects.bulk_create([summary], ignore_conflicts=True)
+    return summary
+
+
+def change_summary(user_id: int, active: int = 0, outstanding=0, **extra) -> None:
+    """Apply deltas with one UPDATE in the transaction of the change.
+    Users without summary are skipped, get_summary builds it from the
+    tables that already include the change"""
+    bump_borrowings_version([user_id])
+
+    def update():
+        return BorrowingSummary.objects.filter(user_id=user_id).update(
+            active_count=F("active_count") + active,
+            outstanding=F("outstanding") + outstanding,
+            **extra,
+        )
+
+    if not update():
+        # a build computed before this change may be inserting the row
+        lock_summary_builds([user_id])
+        update()
+
+
+def record_borrow(borrowing: Borrowing, payment: Payment) -> None:
+    change_summary(borrowing.user_id, active=1, outstanding=payment.money_to_pay)
+
+
+def record_bulk_borrow(user_id: int, payments: list[Payment]) -> None:
+    change_summary(
+        user_id,
+        active=len(payments),
+        outstanding=sum(payment.money_to_pay for payment in payments),
+    )
+
+
+def record_returns(user_id: int, borrowings: list[Borrowing]) -> None:
+    """Borrowings stop being active, and overdue if they were counted so"""
+    was_overdue = [
+        Case(
+            When(overdue_as_of__gt=borrowing.expected_return_date, then=Value(1)),
+            default=Value(0),
+        )
+        for borrowing in borrowings
+    ]
+    change_summary(
+        user_id,
+        active=-len(borrowings),
+        overdue_count=reduce(sub, was_overdue, F("overdue_count")),
+    )
+
+
+def record_return(borrowing: Borrowing) -> None:
+    record_returns(borrowing.user_id, [borrowing])
+
+
+def record_outstanding(changes) -> int:
+    """changes are (user id, amount) pairs, applied to all users with one
+    UPDATE ... CASE so batch jobs do not issue a query per user"""
+    totals = defaultdict(Decimal)
+    for user_id, amount in changes:
+        totals[user_id] += amount
+    totals = {user_id: amount for user_id, amount in totals.items() if amount}
+    if not totals:
+        return 0
+    bump_borrowings_version(totals)
+    # see change_summary, builds of missing rows must not miss the change
+    lock_summary_builds(totals)
+    amount_field = BorrowingSummary._meta.get_field("outstanding")
+    return BorrowingSummary.objects.filter(user_id__in=totals).update(
+        outstanding=F("outstanding")
+        + Case(
+            *(
+                When(user_id=user_id, then=Value(amount, output_field=amount_field))
+                for user_id, amount in totals.items()
+            ),
+            default=Value(Decimal("0"), output_field=amount_field),
+        )
+    )
+
+
+def refresh_overdue_counts(today: datetime.date | None = None) -> int:
+    """Recount overdue borrowings of every summary with one UPDATE"""
+    today = today or now().date()
+    overdue = (
+        Borrowing.objects.filter(Borrowing.overdue_filter(today), user=OuterRef("pk"))
+        .order_by()
+        .values("user")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return BorrowingSummary.objects.update(
+        overdue_count=Coalesce(Subquery(overdue), 0), overdue_as_of=today
+    )
+
+
+def rebuild_all_summaries() -> int:
+    """Repair drift (e.g. rows changed in admin) with two UPDATEs"""
+    today = now().date()
+    active = (
+        Borrowing.objects.filter(user=OuterRef("pk"), actual_return_date__isnull=True)
+        .order_by()
+        .values("user")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    outstanding = (
+        Payment.objects.filter(
+            borrowing__user=OuterRef("pk"), status=Payment.StatusChoices.PENDING
+        )
+        .order_by()
+        .values("borrowing__user")
+        .annotate(total=Sum("money_to_pay"))
+        .values("total")
+    )
+    with transaction.atomic():
+        BorrowingSummary.objects.update(
+            active_count=Coalesce(Subquery(active), 0),
+            outstanding=Coalesce(
+                Subquery(outstanding),
+                Value(Decimal("0")),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        return refresh_overdue_counts(today)
@@ -1,25 +1,88 @@
+from borrowings_service.holds import expire_holds
 from borrowings_service.models import Borrowing
-from telegram_chat.views import send_message_to_chat, send_private_message
+from borrowings_service.summary import refresh_overdue_counts
+from library_service.database import write_transaction
+from telegram_chat.tasks import queue_messages, split_message
 
 from celery import shared_task
+from django.conf import settings
 from django.utils.timezone import now
 
 
+def overdue_borrowings():
+    """Overdue borrowings joined with book and linked telegram chat,
+    as plain tuples so big scans do not build model instances"""
+    return (
+        Borrowing.objects.filter(Borrowing.overdue_filter(now().date()))
+        .order_by("expected_return_date", "id")
+        .values_list(
+            "user_id",
+            "book_id",
+            "book__title",
+            "book__author",
+            "borrow_date",
+            "expected_return_date",
+            "user__telegram__chat_id",
+        )
+    )
+
+
 @shared_task
 def send_message_for_overdue_borrowings():
-    borrowings = Borrowing.objects.filter(
-        actual_return_date__isnull=True, expected_return_date__lte=now().date()
-    )
-    if borrowings:
-        for borrowing in borrowings:
-            message = f"User with id {borrowing.user.id} overdue borrowing of {borrowing.book.id} by {borrowing.book.author}"
-            send_message_to_chat(message)
-            if hasattr(borrowing.user, "telegram"):
-                message = (
-                    f"Hey, you borrowed {borrowing.book.title} at {borrowing.borrow_date}. "
-                    f"Expected return date: {borrowing.expected_return_date} has "
-                    f"already passed. Please return book as soon as possible"
+    chunk_size = settings.OVERDUE_SCAN_CHUNK_SIZE
+    report_lines = []
+    reminders = []
+    overdue_count = 0
+
+    for (
+        user_id,
+        book_id,
+        title,
+        author,
+        borrow_date,
+        expected_return_date,
+        chat_id,
+    ) in overdue_borrowings().iterator(chunk_size=chunk_size):
+        overdue_count += 1
+        if len(report_lines) < settings.OVERDUE_REPORT_MAX_LINES:
+            report_lines.append(
+                f"User with id {user_id} overdue borrowing of {book_id} by {author}"
+            )
+        if chat_id:
+            reminders.append(
+                (
+                    chat_id,
+                    f"Hey, you borrowed {title} at {borrow_date}. "
+                    f"Expected return date: {expected_return_date} has "
+                    f"already passed. Please return book as soon as possible",
                 )
-                send_private_message(message, borrowing.user.telegram.chat_id)
+            )
+        if len(reminders) >= chunk_size:
+            queue_messages(reminders)
+            reminders = []
+    queue_messages(reminders)
+
+    if not overdue_count:
+        report_lines = ["No borrowings overdue today!"]
     else:
-        send_message_to_chat("No borrowings overdue today!")
+        report_lines.insert(0, f"{overdue_count} borrowings overdue today:")
+        if overdue_count > settings.OVERDUE_REPORT_MAX_LINES:
+            report_lines.append(
+                f"...and {overdue_count - settings.OVERDUE_REPORT_MAX_LINES} more"
+            )
+    queue_messages(
+        [(settings.BASE_CHAT_ID, text) for text in split_message(report_lines)]
+    )
+    return overdue_count
+
+
+@shared_task
+def refresh_borrowing_summaries():
+    """Borrowings become overdue at midnight without any write"""
+    return refresh_overdue_counts()
+
+
+@shared_task
+def expire_book_holds():
+    with write_transaction():
+        return expire_holds()
@@ -1,17 +1,63 @@
+import base64
 import datetime
+import json
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection, connections, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 
 from rest_framework.test import APIClient
 
 from books_service.models import Book
-from borrowings_service.models import Borrowing
-from borrowings_service.serializers import BorrowingSerializer
+from borrowings_service.holds import cancel_hold
+from borrowings_service.models import BookHold, Borrowing, BorrowingSummary
+from borrowings_service.serializers import (
+    BorrowingSerializer,
+    CreateBorrowingSerializer,
+    ReturnBorrowingSerializer,
+)
+from borrowings_service.summary import (
+    compute_summary,
+    get_summary,
+    rebuild_summary,
+    record_return,
+    refresh_overdue_counts,
+)
+from borrowings_service.tasks import (
+    expire_book_holds,
+    overdue_borrowings,
+    send_message_for_overdue_borrowings,
+)
+from library_service.database import write_transaction
+from library_service.pagination import KeysetPagination
+from payment_service.models import Payment
+from payment_service.stripe_stand_in import StripeStandIn
+from payment_service.tasks import (
+    create_checkout_session,
+    create_combined_checkout_session,
+    generate_overdue_fines,
+    mark_sessions_paid,
+)
+from telegram_chat.models import OutboxMessage, TelegramUser
 
 BORROWING_LIST_URL = reverse("borrowings_service:borrowing-list")
+BULK_BORROW_URL = reverse("borrowings_service:borrowing-bulk-borrow")
+BULK_RETURN_URL = reverse("borrowings_service:borrowing-bulk-return")
+HOLD_LIST_URL = reverse("borrowings_service:hold-list")
 
 
 def sample_book(**params):
@@ -149,15 +195,23 @@ class PrivateBorrowingTests(TestCase):
         self.assertEqual(book_inventory, self.book.inventory)
 
     def test_created_property_have_payment(self):
-        """test that payment created with borrowing"""
+        """test that payment created with borrowing and checkout session
+        filled in after commit"""
         payload = {
             "expected_return_date": tomorrow(),
             "book": self.book.id,
         }
-        res = self.client.post(BORROWING_LIST_URL, payload)
-        borrowing = Borrowing.objects.get(id=res.data["id"])
-        payment = borrowing.payments.first()
-        self.assertTrue(payment)
+        with StripeStandIn().patch(), patch(
+            "payment_service.views.create_checkout_session.delay",
+            side_effect=create_checkout_session,
+        ), patch("telegram_chat.tasks.dispatch_outbox.delay"):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(BORROWING_LIST_URL, payload)
+                payment = Payment.objects.get(borrowing_id=res.data["id"])
+                self.assertEqual(payment.session_status, "PENDING")
+                self.assertEqual(payment.session_url, None)
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_status, "CREATED")
         self.assertNotEqual(payment.session_url, None)
         self.assertNotEqual(payment.session_id, None)
         self.assertEqual(self.book.daily_fee, payment.money_to_pay)
@@ -191,6 +245,18 @@ class PrivateBorrowingTests(TestCase):
         self.assertEqual(self.borrowing.actual_return_date, datetime.date.today())
         self.assertEqual(inventory + 1, self.book.inventory)
 
+    def test_return_overdue_borrowing(self):
+        Borrowing.objects.filter(id=self.borrowing.id).update(
+            expected_return_date=yesterday()
+        )
+        inventory = self.book.inventory
+        res = self.client.post(f"{detail_url(self.borrowing.id)}return/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.borrowing.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(self.borrowing.actual_return_date, datetime.date.today())
+        self.assertEqual(inventory + 1, self.book.inventory)
+
     def test_return_borrowing_twice(self):
         url = detail_url(self.borrowing.id)
         self.client.post(f"{url}return/")
@@ -250,3 +316,712 @@ class AdminBorrowingTests(TestCase):
         url = detail_url(self.borrowing.id)
         res = self.client.get(f"{url}return/")
         self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class BorrowingQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        self.client.force_authenticate(user=self.user)
+        for _ in range(12):
+            borrowing = Borrowing.objects.create(
+                borrow_date=yesterday(),
+                expected_return_date=tomorrow(),
+                book=sample_book(),
+                user=self.user,
+            )
+            for _ in range(2):
+                Payment.objects.create(
+                    type="PAYMENT", borrowing=borrowing, money_to_pay=1
+                )
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return len(context)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        small_page = self.count_queries(BORROWING_LIST_URL, {"limit": 2})
+        large_page = self.count_queries(BORROWING_LIST_URL, {"limit": 12})
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, 3)
+
+    def test_detail_prefetch_payments(self):
+        borrowing = Borrowing.objects.first()
+        self.assertLessEqual(self.count_queries(detail_url(borrowing.id)), 2)
+
+
+@override_settings(
+    BASE_CHAT_ID="-100123", OVERDUE_SCAN_CHUNK_SIZE=2, OVERDUE_REPORT_MAX_LINES=3
+)
+@patch("telegram_chat.tasks.dispatch_outbox.delay")
+class OverdueBorrowingsTaskTests(TestCase):
+
+    def create_overdue_borrowing(self, user):
+        borrowing = Borrowing.objects.create(
+            expected_return_date=tomorrow(), book=sample_book(), user=user
+        )
+        Borrowing.objects.filter(id=borrowing.id).update(
+            expected_return_date=yesterday()
+        )
+
+    def test_no_overdue_borrowings(self, mock_delay):
+        self.assertEqual(send_message_for_overdue_borrowings(), 0)
+        self.assertEqual(
+            OutboxMessage.objects.get().text, "No borrowings overdue today!"
+        )
+
+    def test_borrowing_due_today_is_not_overdue(self, mock_delay):
+        user = sample_user(email="user@gmail.com", password="<PASSWORD>")
+        borrowing = Borrowing.objects.create(
+            expected_return_date=tomorrow(), book=sample_book(), user=user
+        )
+        Borrowing.objects.filter(id=borrowing.id).update(
+            expected_return_date=datetime.date.today()
+        )
+
+        self.assertEqual(send_message_for_overdue_borrowings(), 0)
+        refresh_overdue_counts()
+        self.assertEqual(get_summary(user.id).overdue_count, 0)
+
+    def test_overdue_digest_and_private_reminders(self, mock_delay):
+        linked_user = sample_user(email="linked@gmail.com", password="<PASSWORD>")
+        TelegramUser.objects.create(chat_id=42, user=linked_user)
+        user = sample_user(email="user@gmail.com", password="<PASSWORD>")
+        for _ in range(3):
+            self.create_overdue_borrowing(linked_user)
+        for _ in range(2):
+            self.create_overdue_borrowing(user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(send_message_for_overdue_borrowings(), 5)
+        self.assertLessEqual(len(context), 4)
+
+        digest = OutboxMessage.objects.get(chat_id="-100123")
+        self.assertTrue(digest.text.startswith("5 borrowings overdue today:"))
+        self.assertIn("...and 2 more", digest.text)
+        self.assertEqual(OutboxMessage.objects.filter(chat_id="42").count(), 3)
+        self.assertGreaterEqual(mock_delay.call_count, 2)
+
+
+@patch("telegram_chat.tasks.dispatch_outbox.delay")
+@patch("payment_service.views.create_checkout_session.delay")
+class ConcurrentBorrowingTests(TransactionTestCase):
+    inventory = 5
+    workers = 20
+
+    def setUp(self):
+        self.book = sample_book(inventory=self.inventory)
+        self.users = [
+            sample_user(email=f"user{i}@gmail.com", password="<PASSWORD>")
+            for i in range(self.workers)
+        ]
+
+    def borrow(self, user):
+        """validate all requests before anyone saves, then borrow retrying
+        while in-memory sqlite reports lock"""
+        try:
+            serializer = CreateBorrowingSerializer(
+                data={"expected_return_date": tomorrow(), "book": self.book.id}
+            )
+            valid = serializer.is_valid()
+            self.barrier.wait()
+            if not valid:
+                return False
+            for _ in range(200):
+                try:
+                    serializer.save(user=user)
+                    return True
+                except OperationalError:
+                    time.sleep(0.01)
+                except ValidationError:
+                    return False
+            return False
+        finally:
+            connections.close_all()
+
+    def test_concurrent_borrowings_do_not_oversell(self, *mocks):
+        self.barrier = threading.Barrier(self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.borrow, self.users))
+
+        self.book.refresh_from_db()
+        self.assertEqual(sum(results), self.inventory)
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(
+            Borrowing.objects.filter(book=self.book).count(), self.inventory
+        )
+
+
+@patch("telegram_chat.tasks.dispatch_outbox.delay")
+@patch("payment_service.views.create_checkout_session.delay")
+class ConcurrentBorrowAndReturnTests(TransactionTestCase):
+    """No retries here: write transactions of the borrowing path wait for
+    the lock instead of failing as locked"""
+
+    workers = 10
+
+    def setUp(self):
+        self.book = sample_book(inventory=self.workers)
+        self.users = [
+            sample_user(email=f"user{i}@gmail.com", password="<PASSWORD>")
+            for i in range(self.workers)
+        ]
+        self.borrowed = [
+            Borrowing.objects.create(
+                expected_return_date=tomorrow(), book=self.book, user=user
+            )
+            for user in self.users
+        ]
+        self.barrier = threading.Barrier(self.workers * 2)
+
+    def borrow(self, user):
+        try:
+            serializer = CreateBorrowingSerializer(
+                data={"expected_return_date": tomorrow(), "book": self.book.id}
+            )
+            serializer.is_valid(raise_exception=True)
+            self.barrier.wait()
+            serializer.save(user=user)
+        finally:
+            connections.close_all()
+
+    def return_borrowing(self, borrowing):
+        try:
+            self.barrier.wait()
+            ReturnBorrowingSerializer(borrowing, data={}).is_valid(raise_exception=True)
+            ReturnBorrowingSerializer().update(borrowing, {})
+        finally:
+            connections.close_all()
+
+    def test_concurrent_borrow_and_return_without_lock_errors(self, *mocks):
+        with ThreadPoolExecutor(max_workers=self.workers * 2) as executor:
+            futures = [executor.submit(self.borrow, user) for user in self.users]
+            futures += [
+                executor.submit(self.return_borrowing, borrowing)
+                for borrowing in self.borrowed
+            ]
+            for future in futures:
+                future.result()
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, self.workers)
+        self.assertEqual(
+            Borrowing.objects.filter(actual_return_date__isnull=True).count(),
+            self.workers,
+        )
+
+
+class BorrowingCursorPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        self.client.force_authenticate(user=self.user)
+        book = sample_book()
+        for days in (5, 3, 3, 8, 1, 3, 2):
+            Borrowing.objects.create(
+                expected_return_date=tomorrow() + datetime.timedelta(days=days),
+                book=book,
+                user=self.user,
+            )
+        returned = Borrowing.objects.order_by("id")[:3]
+        for borrowing in returned:
+            borrowing.actual_return_date = tomorrow()
+            borrowing.save()
+
+    def test_cursor_walk_return_every_borrowing_once_in_order(self):
+        ids = []
+        url = f"{BORROWING_LIST_URL}?limit=2"
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.data["count"], 7)
+            ids += [borrowing["id"] for borrowing in res.data["results"]]
+            url = res.data["next"]
+
+        expected = sorted(
+            Borrowing.objects.all(),
+            key=lambda b: (
+                b.actual_return_date is not None,
+                b.actual_return_date or datetime.date.min,
+                b.expected_return_date,
+                b.id,
+            ),
+        )
+        self.assertEqual(ids, [borrowing.id for borrowing in expected])
+
+    def test_cursor_page_without_count(self):
+        res = self.client.get(BORROWING_LIST_URL, {"limit": 2, "count": "false"})
+        self.assertNotIn("count", res.data)
+        self.assertEqual(len(res.data["results"]), 2)
+        self.assertIn("cursor=", res.data["next"])
+
+    def test_offset_pagination_still_supported(self):
+        res = self.client.get(BORROWING_LIST_URL, {"limit": 2, "offset": 6})
+        self.assertEqual(res.data["count"], 7)
+        self.assertEqual(len(res.data["results"]), 1)
+
+    def test_invalid_cursor(self):
+        res = self.client.get(BORROWING_LIST_URL, {"cursor": "broken"})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_values_of_wrong_type(self):
+        for values in (["x", "y", "z"], [None, "2025-01-01", [1]]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            res = self.client.get(BORROWING_LIST_URL, {"cursor": cursor})
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN output is SQLite specific")
+class BorrowingIndexTests(TestCase):
+
+    def setUp(self):
+        self.pagination = KeysetPagination()
+        self.pagination.fields = ("actual_return_date", "expected_return_date", "id")
+
+    def assert_use_index(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf"USING (COVERING )?INDEX {index_name}\b")
+        self.assertNotIn("SCAN borrowings_service_borrowing\n", plan + "\n")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_overdue_scan_use_index(self):
+        self.assert_use_index(overdue_borrowings(), "borrowing_ordering_idx")
+
+    def test_admin_list_use_index(self):
+        queryset = self.pagination.order_queryset(Borrowing.objects.all())
+        self.assert_use_index(queryset[:10], "borrowing_ordering_idx")
+
+    def test_cursor_page_use_index(self):
+        queryset = self.pagination.order_queryset(
+            Borrowing.objects.filter(self.pagination.after([None, "2025-01-01", 5]))
+        )
+        self.assert_use_index(queryset[:10], "borrowing_ordering_idx")
+
+    def test_user_active_list_use_index(self):
+        queryset = self.pagination.order_queryset(
+            Borrowing.objects.filter(user_id=1, actual_return_date__isnull=True)
+        )
+        self.assert_use_index(queryset[:10], "borrowing_user_ordering_idx")
+
+    def test_payment_session_lookup_use_index(self):
+        plan = Payment.objects.filter(session_id="cs_test").explain()
+        self.assertIn("USING INDEX payment_service_payment_session_id", plan)
+
+
+class BorrowingSummaryTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(email="user@gmail.com", password="<PASSWORD>")
+        self.client.force_authenticate(user=self.user)
+        self.book = sample_book(daily_fee=2)
+        get_summary(self.user.id)
+
+    def borrow(self):
+        res = self.client.post(
+            BORROWING_LIST_URL,
+            {"expected_return_date": tomorrow(), "book": self.book.id},
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return Borrowing.objects.get(id=res.data["id"])
+
+    def return_borrowing(self, borrowing):
+        res = self.client.post(f"{detail_url(borrowing.id)}return/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def assert_summary(self, active, overdue, outstanding):
+        summary = BorrowingSummary.objects.get(user=self.user)
+        self.assertEqual(
+            (summary.active_count, summary.overdue_count, summary.outstanding),
+            (active, overdue, outstanding),
+        )
+        rebuilt = rebuild_summary(self.user.id)
+        self.assertEqual(
+            (rebuilt.active_count, rebuilt.overdue_count, rebuilt.outstanding),
+            (active, overdue, outstanding),
+        )
+
+    def test_borrow_and_return_update_summary(self):
+        first = self.borrow()
+        self.borrow()
+        self.assert_summary(active=2, overdue=0, outstanding=4)
+
+        self.return_borrowing(first)
+        self.assert_summary(active=1, overdue=0, outstanding=4)
+
+    def test_missing_summary_is_built_on_first_access(self):
+        BorrowingSummary.objects.all().delete()
+        Borrowing.objects.create(
+            expected_return_date=tomorrow(), book=self.book, user=self.user
+        )
+
+        summary = get_summary(self.user.id)
+
+        self.assertEqual(summary.active_count, 1)
+        with self.assertNumQueries(1):
+            get_summary(self.user.id)
+
+    def test_summary_built_during_borrow_gets_the_borrow(self):
+        BorrowingSummary.objects.all().delete()
+        # computed by a concurrent request before the borrow commits
+        stale = compute_summary(self.user.id)
+
+        def build(user_ids):
+            BorrowingSummary.objects.bulk_create([stale], ignore_conflicts=True)
+
+        with patch("borrowings_service.summary.lock_summary_builds", side_effect=build):
+            self.borrow()
+
+        self.assert_summary(active=1, overdue=0, outstanding=2)
+
+    def make_overdue(self, borrowing):
+        Borrowing.objects.filter(id=borrowing.id).update(
+            expected_return_date=yesterday()
+        )
+        borrowing.refresh_from_db()
+
+    def mark_returned(self, borrowing):
+        Borrowing.objects.filter(id=borrowing.id).update(
+            actual_return_date=datetime.date.today()
+        )
+        record_return(borrowing)
+
+    def test_overdue_count_refreshed_and_cleared_on_return(self):
+        borrowing = self.borrow()
+        self.make_overdue(borrowing)
+        self.assertEqual(get_summary(self.user.id).overdue_count, 0)
+
+        with self.assertNumQueries(1):
+            refresh_overdue_counts()
+        self.assertEqual(get_summary(self.user.id).overdue_count, 1)
+
+        self.mark_returned(borrowing)
+        self.assert_summary(active=0, overdue=0, outstanding=2)
+
+    def test_return_before_refresh_keeps_overdue_count(self):
+        refresh_overdue_counts(yesterday())
+        borrowing = self.borrow()
+        self.make_overdue(borrowing)
+
+        self.mark_returned(borrowing)
+
+        self.assertEqual(get_summary(self.user.id).overdue_count, 0)
+
+    def test_fines_and_paid_sessions_update_outstanding(self):
+        borrowing = self.borrow()
+        self.make_overdue(borrowing)
+        generate_overdue_fines()
+        fine = Payment.objects.get(type=Payment.TypeChoices.FINE)
+        self.assertEqual(fine.money_to_pay, 4)
+        refresh_overdue_counts()
+        self.assert_summary(active=1, overdue=1, outstanding=6)
+
+        Payment.objects.filter(borrowing=borrowing).update(session_id="cs_paid")
+        mark_sessions_paid(["cs_paid"])
+        self.assert_summary(active=1, overdue=1, outstanding=0)
+
+    def test_rebuild_command_repairs_drift(self):
+        self.borrow()
+        BorrowingSummary.objects.update(active_count=7, outstanding=0)
+
+        call_command("rebuild_borrowing_summaries", stdout=StringIO())
+
+        self.assert_summary(active=1, overdue=0, outstanding=2)
+
+
+@override_settings(BASE_CHAT_ID="-100123")
+@patch("telegram_chat.tasks.dispatch_outbox.delay")
+class BulkBorrowingTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(email="user@gmail.com", password="<PASSWORD>")
+        TelegramUser.objects.create(chat_id=42, user=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.books = [sample_book(title=f"Book {index}") for index in range(5)]
+
+    def bulk_borrow(self, books):
+        return self.client.post(
+            BULK_BORROW_URL,
+            {
+                "borrowings": [
+                    {"book": book.id, "expected_return_date": tomorrow()}
+                    for book in books
+                ]
+            },
+            format="json",
+        )
+
+    def test_bulk_borrow(self, mock_delay):
+        first, second = self.books[:2]
+        stand_in = StripeStandIn()
+        with stand_in.patch(), patch(
+            "payment_service.views.create_combined_checkout_session.delay",
+            side_effect=create_combined_checkout_session,
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.bulk_borrow([first, second, first])
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data["borrowings"]), 3)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.inventory, second.inventory), (18, 19))
+        self.assertEqual(len(stand_in.calls), 1)
+        self.assertEqual(len(stand_in.calls[0]["line_items"]), 3)
+        payments = Payment.objects.filter(borrowing__user=self.user)
+        self.assertEqual(payments.count(), 3)
+        self.assertEqual(len(set(payments.values_list("session_id", flat=True))), 1)
+        self.assertEqual(OutboxMessage.objects.filter(chat_id="-100123").count(), 1)
+        self.assertEqual(OutboxMessage.objects.filter(chat_id="42").count(), 1)
+
+    def test_bulk_borrow_queries_do_not_depend_on_books(self, mock_delay):
+        with CaptureQueriesContext(connection) as two_books:
+            self.bulk_borrow(self.books[:2])
+        with CaptureQueriesContext(connection) as five_books:
+            self.bulk_borrow(self.books)
+        self.assertEqual(len(two_books), len(five_books))
+
+    def test_bulk_borrow_insufficient_inventory_changes_nothing(self, mock_delay):
+        sold_out = sample_book(inventory=1)
+
+        res = self.bulk_borrow([self.books[0], sold_out, sold_out])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.books[0].refresh_from_db()
+        sold_out.refresh_from_db()
+        self.assertEqual((self.books[0].inventory, sold_out.inventory), (20, 1))
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_bulk_borrow_validation(self, mock_delay):
+        missing_book = Book(id=10_000)
+        too_many = self.books[:1] * (settings.BULK_BORROWING_MAX_ITEMS + 1)
+        for books in ([], too_many, [self.books[0], missing_book]):
+            res = self.bulk_borrow(books)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_bulk_return(self, mock_delay):
+        self.bulk_borrow(self.books[:2] * 2)
+        borrowing_ids = list(Borrowing.objects.values_list("id", flat=True))
+
+        res = self.client.post(
+            BULK_RETURN_URL, {"borrowings": borrowing_ids}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["actual_return_date"], str(datetime.date.today()))
+        self.assertFalse(
+            Borrowing.objects.filter(actual_return_date__isnull=True).exists()
+        )
+        for book in self.books[:2]:
+            book.refresh_from_db()
+            self.assertEqual(book.inventory, 20)
+
+    def test_bulk_return_is_all_or_nothing(self, mock_delay):
+        self.bulk_borrow(self.books[:1])
+        other_user = sample_user(email="other@gmail.com", password="<PASSWORD>")
+        other = Borrowing.objects.create(
+            expected_return_date=tomorrow(), book=self.books[1], user=other_user
+        )
+        own = Borrowing.objects.get(user=self.user)
+
+        for borrowing_ids in ([own.id, other.id], [own.id, own.id]):
+            res = self.client.post(
+                BULK_RETURN_URL, {"borrowings": borrowing_ids}, format="json"
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        own.refresh_from_db()
+        self.assertIsNone(own.actual_return_date)
+
+
+@override_settings(BASE_CHAT_ID="-100123")
+@patch("telegram_chat.tasks.dispatch_outbox.delay")
+class BookHoldTests(TestCase):
+
+    def setUp(self):
+        self.book = sample_book(inventory=1)
+        self.clients = {}
+        for name, chat_id in (("reader", None), ("first", 41), ("second", None)):
+            user = sample_user(email=f"{name}@gmail.com", password="<PASSWORD>")
+            if chat_id:
+                TelegramUser.objects.create(chat_id=chat_id, user=user)
+            client = APIClient()
+            client.force_authenticate(user=user)
+            self.clients[name] = client
+
+    def borrow(self, name):
+        return self.clients[name].post(
+            BORROWING_LIST_URL,
+            {"book": self.book.id, "expected_return_date": tomorrow()},
+        )
+
+    def hold(self, name):
+        return self.clients[name].post(HOLD_LIST_URL, {"book": self.book.id})
+
+    def return_borrowing(self, name, borrowing_id):
+        return self.clients[name].post(
+            reverse(
+                "borrowings_service:borrowing-return-borrowing", args=[borrowing_id]
+            )
+        )
+
+    def cancel(self, name, hold_id):
+        return self.clients[name].post(
+            reverse("borrowings_service:hold-cancel", args=[hold_id])
+        )
+
+    def hold_status(self, name):
+        return BookHold.objects.get(user__email=f"{name}@gmail.com").status
+
+    def borrow_and_queue(self):
+        borrowing_id = self.borrow("reader").data["id"]
+        self.assertEqual(self.hold("first").data["position"], 1)
+        self.assertEqual(self.hold("second").data["position"], 2)
+        return borrowing_id
+
+    def test_hold_only_when_out_of_stock(self, mock_delay):
+        res = self.hold("first")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.borrow("reader")
+        self.assertEqual(self.hold("first").status_code, status.HTTP_201_CREATED)
+        res = self.hold("first")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_return_hands_copy_to_first_hold(self, mock_delay):
+        borrowing_id = self.borrow_and_queue()
+
+        res = self.return_borrowing("reader", borrowing_id)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(self.hold_status("first"), BookHold.StatusChoices.READY)
+        self.assertEqual(self.hold_status("second"), BookHold.StatusChoices.WAITING)
+        self.assertIn("is back", OutboxMessage.objects.filter(chat_id="41").last().text)
+        res = self.clients["second"].get(HOLD_LIST_URL)
+        self.assertEqual(res.data["results"][0]["position"], 1)
+
+    def test_only_ready_holder_borrows_returned_copy(self, mock_delay):
+        self.return_borrowing("reader", self.borrow_and_queue())
+
+        self.assertEqual(self.borrow("second").status_code, 400)
+        self.assertEqual(self.borrow("first").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.hold_status("first"), BookHold.StatusChoices.FULFILLED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_cancel_passes_copy_on(self, mock_delay):
+        self.return_borrowing("reader", self.borrow_and_queue())
+        first = BookHold.objects.get(user__email="first@gmail.com")
+
+        self.assertEqual(self.cancel("first", first.id).status_code, 200)
+        self.assertEqual(self.hold_status("second"), BookHold.StatusChoices.READY)
+        self.assertEqual(self.cancel("first", first.id).status_code, 400)
+
+        second = BookHold.objects.get(user__email="second@gmail.com")
+        self.cancel("second", second.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+
+    def test_cancel_hold_made_ready_after_it_was_loaded(self, mock_delay):
+        self.borrow("reader")
+        self.hold("first")
+        hold = BookHold.objects.get(user__email="first@gmail.com")
+        # a return hands the copy to the hold after the view fetched it
+        BookHold.objects.filter(id=hold.id).update(status=BookHold.StatusChoices.READY)
+
+        with write_transaction():
+            cancel_hold(hold)
+
+        self.assertEqual(self.hold_status("first"), BookHold.StatusChoices.CANCELLED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+
+    def test_expired_ready_hold_moves_on(self, mock_delay):
+        self.return_borrowing("reader", self.borrow_and_queue())
+        BookHold.objects.filter(status=BookHold.StatusChoices.READY).update(
+            expires_at=now() - datetime.timedelta(minutes=1)
+        )
+
+        self.assertEqual(expire_book_holds(), 1)
+
+        self.assertEqual(self.hold_status("first"), BookHold.StatusChoices.EXPIRED)
+        self.assertEqual(self.hold_status("second"), BookHold.StatusChoices.READY)
+        self.assertIn(
+            "has expired", OutboxMessage.objects.filter(chat_id="41").last().text
+        )
+
+    def test_bulk_return_and_bulk_borrow_use_holds(self, mock_delay):
+        self.borrow("reader")
+        self.hold("first")
+
+        self.clients["reader"].post(
+            BULK_RETURN_URL,
+            {"borrowings": list(Borrowing.objects.values_list("id", flat=True))},
+            format="json",
+        )
+        self.assertEqual(self.hold_status("first"), BookHold.StatusChoices.READY)
+
+        res = self.clients["first"].post(
+            BULK_BORROW_URL,
+            {
+                "borrowings": [
+                    {"book": self.book.id, "expected_return_date": tomorrow()}
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.hold_status("first"), BookHold.StatusChoices.FULFILLED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+
+class BenchmarkLifecycleCommandTests(TransactionTestCase):
+    # tests already run on a throwaway database
+    @patch(
+        "borrowings_service.management.commands.benchmark_lifecycle"
+        ".benchmark_database",
+        return_value=nullcontext(),
+    )
+    def test_benchmark_runs_concurrent_workers(self, mock_database):
+        out = StringIO()
+        # tasks run next to the requests, e.g. outbox claims, must not fail
+        with self.assertNoLogs("library_service.benchmark", "ERROR"):
+            call_command(
+                "benchmark_lifecycle",
+                users=3,
+                books=5,
+                borrowings=10,
+                iterations=4,
+                overdue_iterations=1,
+                workers=2,
+                celery_workers=1,
+                stdout=out,
+            )
+
+        mock_database.assert_called_once()
+        for scenario in ("catalog_search", "borrow", "list_borrowings", "return"):
+            self.assertIn(scenario, out.getvalue())
+        # borrowed and returned by the workers, checkout sessions were
+        # created by the task thread
+        borrowed = Borrowing.objects.order_by("-id")[:4]
+        self.assertEqual(Borrowing.objects.count(), 14)
+        self.assertTrue(all(borrowing.actual_return_date for borrowing in borrowed))
+        self.assertFalse(
+            Payment.objects.filter(borrowing__in=borrowed, session_id=None).exists()
+        )
@@ -1,9 +1,11 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from borrowings_service.views import BorrowingsAPIView
+from borrowings_service.views import BookHoldViewSet, BorrowingsAPIView
 
 router = routers.DefaultRouter()
+# before the borrowings, their detail route would match holds/ otherwise
+router.register("holds", BookHoldViewSet, basename="hold")
 router.register("", BorrowingsAPIView)
 
 urlpatterns = [
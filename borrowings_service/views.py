@@ -1,18 +1,33 @@
+from django.db.models import Prefetch
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from borrowings_service.models import Borrowing
+from books_service.cache import catalog_version_keys
+from borrowings_service.holds import cancel_hold, queue_position
+from borrowings_service.models import BookHold, Borrowing
+from borrowings_service.summary import borrowings_version_keys
+from library_service.conditional import ConditionalGetMixin
+from library_service.database import write_transaction
+from library_service.pagination import KeysetPagination
+from library_service.viewsets import AsyncReadMixin
+from payment_service.models import Payment
+from payment_service.serializers import PaymentSerializer
 from borrowings_service.serializers import (
+    BookHoldSerializer,
     BorrowingSerializer,
+    BulkBorrowingSerializer,
+    BulkReturnBorrowingSerializer,
     CreateBorrowingSerializer,
     ReturnBorrowingSerializer,
 )
 
 
 class BorrowingsAPIView(
+    ConditionalGetMixin,
+    AsyncReadMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.CreateModelMixin,
@@ -21,10 +36,26 @@ class BorrowingsAPIView(
     queryset = Borrowing.objects.select_related("book", "user")
     serializer_class = BorrowingSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = KeysetPagination
+    keyset_ordering = ("actual_return_date", "expected_return_date", "id")
+
+    def get_version_keys(self):
+        # borrowings embed their book with its inventory
+        return [*catalog_version_keys(), *borrowings_version_keys(self.request.user)]
 
     def get_queryset(self):
         queryset = self.queryset
 
+        if self.action in ("list", "retrieve"):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "payments",
+                    queryset=Payment.objects.only(
+                        *PaymentSerializer.Meta.fields
+                    ).order_by("id"),
+                )
+            )
+
         is_active = self.request.query_params.get("is_active")
 
         if is_active == "true":
@@ -45,6 +76,10 @@ class BorrowingsAPIView(
             return CreateBorrowingSerializer
         elif self.action == "return_borrowing":
             return ReturnBorrowingSerializer
+        elif self.action == "bulk_borrow":
+            return BulkBorrowingSerializer
+        elif self.action == "bulk_return":
+            return BulkReturnBorrowingSerializer
 
         return BorrowingSerializer
 
@@ -65,6 +100,25 @@ class BorrowingsAPIView(
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=["POST"], detail=False, url_path="bulk")
+    def bulk_borrow(self, request):
+        """Borrow up to BULK_BORROWING_MAX_ITEMS books paid with one
+        checkout session"""
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(user=request.user)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=["POST"], detail=False, url_path="bulk-return")
+    def bulk_return(self, request):
+        """Return several own borrowings, all or none of them"""
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(user=request.user)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     @extend_schema(
         parameters=[
             OpenApiParameter(
@@ -83,3 +137,50 @@ class BorrowingsAPIView(
     def list(self, request, *args, **kwargs):
         """Gets list of borrowings"""
         return super().list(request, *args, **kwargs)
+
+
+class BookHoldViewSet(
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.CreateModelMixin,
+    viewsets.GenericViewSet,
+):
+    """Waiting queue of books that are out of stock. When a copy comes
+    back the oldest waiting hold becomes READY, the holder is notified in
+    Telegram and can borrow the book until expires_at"""
+
+    queryset = BookHold.objects.all()
+    serializer_class = BookHoldSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        queryset = self.queryset.filter(user=self.request.user)
+        if self.action in ("list", "retrieve"):
+            queryset = queryset.annotate(position=queue_position())
+        if self.request.query_params.get("is_active") == "true":
+            queryset = queryset.filter(status__in=BookHold.ACTIVE_STATUSES)
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(methods=["POST"], detail=True, url_path="cancel")
+    def cancel(self, request, pk=None):
+        """Leave the queue, a copy held for you goes to the next reader"""
+        hold = self.get_object()
+        with write_transaction():
+            cancel_hold(hold)
+        return Response(self.get_serializer(hold).data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "is_active",
+                type=OpenApiTypes.STR,
+                description="only waiting and ready holds (ex. ?is_active=true)",
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        """Gets list of own holds"""
+        return super().list(request, *args, **kwargs)
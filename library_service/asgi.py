@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_service.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after Django setup, the pipeline needs loaded apps and settings
+from library_service.events import get_broker  # noqa: E402
+from library_service.lifespan import LifespanMiddleware  # noqa: E402
+from telegram_chat.pipeline import pipeline  # noqa: E402
+
+application = LifespanMiddleware(
+    django_application,
+    on_startup=[pipeline.start],
+    on_shutdown=[get_broker().close, pipeline.stop],
+)
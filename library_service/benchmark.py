@@ -0,0 +1,297 @@
+import datetime
+import json
+import logging
+import random
+import statistics
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+from celery.app.task import Task
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.test import override_settings
+
+from books_service.models import Book
+from books_service.search import get_search_backend
+from borrowings_service.models import Borrowing
+from library_service.celery import app as celery_app
+from payment_service.models import Payment
+from payment_service.stripe_stand_in import StripeStandIn
+from telegram_chat.models import TelegramUser
+from telegram_chat.telegram_stand_in import TelegramStandIn
+
+logger = logging.getLogger(__name__)
+
+# words of synthetic titles and authors, shared by the benchmark commands
+WORDS = (
+    "shadow river empire garden winter silent golden broken secret night "
+    "ocean storm crown forest glass stone iron letter journey memory kingdom "
+    "dragon harbor island lantern mirror orchard paper quiet raven summer "
+    "thunder valley wander whisper wild willow"
+).split()
+NAMES = (
+    "anna boris clara dmytro emma felix greta hugo irena jonas karina leo "
+    "maria nazar olga petro rosa stepan taras ulyana viktor yaryna zenon"
+).split()
+SURNAMES = (
+    "bondar hrytsenko koval lysenko melnyk petrenko savchenko shevchenko "
+    "tkachenko vasylenko moroz kravets rudenko polishchuk oliinyk marchenko"
+).split()
+BENCHMARK_PASSWORD = "benchmark"
+
+
+@contextmanager
+def benchmark_database(verbosity: int = 0):
+    """Migrated throwaway database next to the configured one, named
+    benchmark_<name>, dropped at the end. Benchmarks commit their data, so
+    workers with their own connections see it, and never touch the
+    configured database"""
+    name = Path(str(connection.settings_dict["NAME"]))
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    test_name = test_settings.get("NAME")
+    test_settings["NAME"] = str(name.with_name(f"benchmark_{name.name}"))
+    old_name = connection.creation.create_test_db(
+        verbosity=verbosity, autoclobber=True, serialize=False
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        test_settings["NAME"] = test_name
+
+
+@dataclass
+class Dataset:
+    users: list
+    books: list
+    borrowings: int
+    payments: int
+
+
+def generate_dataset(
+    users: int,
+    books: int,
+    borrowings: int,
+    rng: random.Random,
+    batch_size: int = 5_000,
+    telegram_share: float = 0.5,
+) -> Dataset:
+    """Synthetic library: users (part of them with telegram chat), books,
+    active, overdue and returned borrowings with their payments"""
+    password = make_password(BENCHMARK_PASSWORD)
+    user_objects = get_user_model().objects.bulk_create(
+        get_user_model()(email=f"reader{index}@library.test", password=password)
+        for index in range(users)
+    )
+    TelegramUser.objects.bulk_create(
+        TelegramUser(chat_id=100_000 + index, user=user)
+        for index, user in enumerate(user_objects)
+        if rng.random() < telegram_share
+    )
+    book_objects = Book.objects.bulk_create(
+        Book(
+            title=" ".join(rng.sample(WORDS, rng.randint(2, 4))).title(),
+            author=f"{rng.choice(SURNAMES)} {rng.choice(SURNAMES)}".title(),
+            cover=rng.choice(Book.CoverChoices.values),
+            inventory=rng.randint(50, 500),
+            daily_fee=Decimal(rng.randint(10, 300)) / 100,
+        )
+        for _ in range(books)
+    )
+    get_search_backend().rebuild()
+
+    today = datetime.date.today()
+    payments = 0
+    for start in range(0, borrowings, batch_size):
+        batch = []
+        for _ in range(min(batch_size, borrowings - start)):
+            expected = today + datetime.timedelta(days=rng.randint(-30, 30))
+            returned = rng.random() < 0.6
+            batch.append(
+                Borrowing(
+                    expected_return_date=expected,
+                    actual_return_date=(
+                        expected + datetime.timedelta(days=rng.randint(-5, 5))
+                        if returned
+                        else None
+                    ),
+                    book=rng.choice(book_objects),
+                    user=rng.choice(user_objects),
+                )
+            )
+        Borrowing.objects.bulk_create(batch)
+        created = Payment.objects.bulk_create(
+            Payment(
+                type=Payment.TypeChoices.PAYMENT,
+                borrowing=borrowing,
+                money_to_pay=borrowing.book.daily_fee * 10,
+                status=(
+                    Payment.StatusChoices.PAID
+                    if borrowing.actual_return_date
+                    else Payment.StatusChoices.PENDING
+                ),
+            )
+            for borrowing in batch
+        )
+        payments += len(created)
+    return Dataset(user_objects, book_objects, borrowings, payments)
+
+
+class TaskThreads:
+    """Stands in for a Celery worker next to the web process: tasks sent
+    with delay() run in a pool of threads with their own connections"""
+
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="celery")
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def apply_async(self, task, args=None, kwargs=None, **options):
+        future = self.executor.submit(self.run, task, args or (), kwargs or {})
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    @staticmethod
+    def run(task, args, kwargs):
+        try:
+            return task(*args, **kwargs)
+        except Exception:
+            logger.exception("Benchmark task %s failed", task.name)
+        finally:
+            connections.close_all()
+
+    def join(self):
+        """Wait for queued tasks and the tasks they send"""
+        while True:
+            with self.lock:
+                pending = list(self.pending)
+            if not pending:
+                break
+            wait(pending)
+        self.executor.shutdown()
+
+
+@contextmanager
+def stand_ins(
+    stripe_latency: float = 0, telegram_latency: float = 0, celery_workers: int = 0
+):
+    """Local Stripe and Telegram stand-ins. Celery tasks run in
+    celery_workers threads, or inline after commit when it is 0"""
+    stripe_stand_in = StripeStandIn(latency=stripe_latency)
+    telegram_stand_in = TelegramStandIn(latency=telegram_latency)
+    eager = celery_app.conf.task_always_eager
+    celery_app.conf.task_always_eager = not celery_workers
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(stripe_stand_in.patch())
+            stack.enter_context(telegram_stand_in.patch())
+            stack.enter_context(override_settings(BASE_CHAT_ID="-100"))
+            if celery_workers:
+                threads = TaskThreads(celery_workers)
+                stack.enter_context(
+                    mock.patch.object(
+                        Task,
+                        "apply_async",
+                        lambda task, args=None, kwargs=None, **options: (
+                            threads.apply_async(task, args, kwargs)
+                        ),
+                    )
+                )
+                # before the patch is undone, running tasks may send more
+                stack.callback(threads.join)
+            yield stripe_stand_in, telegram_stand_in
+    finally:
+        celery_app.conf.task_always_eager = eager
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    operations: int
+    seconds: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    throughput: float
+
+
+def summarize(name: str, timings: list[float]) -> ScenarioResult:
+    """timings are seconds per operation"""
+    milliseconds = sorted(timing * 1000 for timing in timings)
+    if len(milliseconds) > 1:
+        cuts = statistics.quantiles(milliseconds, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = milliseconds[0] if milliseconds else 0.0
+    total = sum(timings)
+    return ScenarioResult(
+        name=name,
+        operations=len(timings),
+        seconds=total,
+        p50_ms=p50,
+        p95_ms=p95,
+        p99_ms=p99,
+        mean_ms=statistics.fmean(milliseconds) if milliseconds else 0.0,
+        throughput=len(timings) / total if total else 0.0,
+    )
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_report(path: str, results: list[ScenarioResult], options: dict) -> None:
+    with open(path, "w") as report:
+        json.dump(
+            {
+                "revision": git_revision(),
+                "options": options,
+                "results": [asdict(result) for result in results],
+            },
+            report,
+            indent=2,
+        )
+
+
+def load_report(path: str) -> dict[str, dict]:
+    with open(path) as report:
+        return {result["name"]: result for result in json.load(report)["results"]}
+
+
+def format_results(results: list[ScenarioResult], baseline: dict | None = None):
+    yield (
+        f"{'scenario':<20} {'ops':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'ops/s':>9}" + ("  p95 vs baseline" if baseline else "")
+    )
+    for result in results:
+        line = (
+            f"{result.name:<20} {result.operations:>6} {result.p50_ms:>9.2f} "
+            f"{result.p95_ms:>9.2f} {result.p99_ms:>9.2f} {result.throughput:>9.1f}"
+        )
+        previous = (baseline or {}).get(result.name)
+        if previous and previous["p95_ms"]:
+            change = (result.p95_ms / previous["p95_ms"] - 1) * 100
+            line += f"  {change:+.1f}%"
+        yield line
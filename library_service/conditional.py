@@ -0,0 +1,164 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+# Celery workers bump counters too, a cache of one process never sees them
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def versions_shared() -> bool:
+    """Whether every process reads and bumps the same counters"""
+    return settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES
+
+
+def modified_key(key: str) -> str:
+    return f"{key}:modified"
+
+
+def initial_version() -> int:
+    """Counters that are not set yet or were culled start from the clock,
+    so they never repeat a value an earlier ETag was built from"""
+    return time.time_ns()
+
+
+def read_versions(keys: list[str], cached: dict) -> dict:
+    versions = {}
+    for key in keys:
+        versions[key] = cached.get(key)
+        if versions[key] is None:
+            versions[key] = initial_version()
+            cache.add(key, versions[key], timeout=None)
+        versions[modified_key(key)] = cached.get(modified_key(key))
+    return versions
+
+
+def get_versions(keys: list[str]) -> dict:
+    """Version counters and their change times with one cache read"""
+    return read_versions(
+        keys, cache.get_many([*keys, *(modified_key(key) for key in keys)])
+    )
+
+
+async def aget_versions(keys: list[str]) -> dict:
+    cached = await cache.aget_many([*keys, *(modified_key(key) for key in keys)])
+    missing = {key: initial_version() for key in keys if cached.get(key) is None}
+    for key, version in missing.items():
+        await cache.aadd(key, version, timeout=None)
+    return read_versions(keys, {**cached, **missing})
+
+
+def bump_versions(*keys: str) -> None:
+    """Increment the counters now and again after commit, so a response
+    built from the old rows meanwhile does not keep the new version"""
+
+    def bump():
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, initial_version(), timeout=None)
+        cache.set_many(
+            {modified_key(key): int(time.time()) for key in keys}, timeout=None
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+    default_detail = "Not modified."
+    default_code = "not_modified"
+
+
+# ETag and Last-Modified of conditional_actions from version counters of
+# the data they show (get_version_keys()), not from the rendered body. A
+# matching If-None-Match (or If-Modified-Since without it) is answered with
+# 304 from initial(), before the queryset or serializers run, so an
+# unchanged page costs one cache read. Writers call bump_versions(). Off
+# with a process-local cache (the LocMemCache default): bumps made by Celery
+# workers would never reach the web processes. Kept out of the docstring,
+# which would end up in the API schema.
+class ConditionalGetMixin:
+    conditional_actions = ("list", "retrieve")
+    etag = None
+    last_modified = None
+
+    def get_version_keys(self) -> list[str]:
+        raise NotImplementedError
+
+    def is_conditional(self, request) -> bool:
+        return (
+            request.method in ("GET", "HEAD")
+            and self.action in self.conditional_actions
+            and versions_shared()
+        )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.is_conditional(request):
+            self.check_not_modified(request, get_versions(self.get_version_keys()))
+
+    async def ainitial(self, request, *args, **kwargs):
+        """AsyncReadMixin hook, counters are read with the async cache API"""
+        super().initial(request, *args, **kwargs)
+        if self.is_conditional(request):
+            versions = await aget_versions(self.get_version_keys())
+            self.check_not_modified(request, versions)
+
+    def check_not_modified(self, request, versions: dict) -> None:
+        keys = self.get_version_keys()
+        state = ",".join(
+            [*(f"{key}={versions[key]}" for key in keys), request.accepted_media_type]
+        )
+        digest = hashlib.blake2b(state.encode(), digest_size=12).hexdigest()
+        # weak, renderers may format the same data differently
+        self.etag = f'W/"{digest}"'
+        modified = [versions[modified_key(key)] for key in keys]
+        self.last_modified = None if None in modified else max(modified)
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            if "*" in etags or digest in {
+                etag.removeprefix("W/").strip('"') for etag in etags
+            }:
+                raise NotModified()
+            return
+        if_modified_since = parse_http_date_safe(
+            request.headers.get("If-Modified-Since", "")
+        )
+        if (
+            if_modified_since is not None
+            and self.last_modified is not None
+            and self.last_modified <= if_modified_since
+        ):
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.etag and response.status_code in (200, 304):
+            response["ETag"] = self.etag
+            if self.last_modified is not None:
+                response["Last-Modified"] = http_date(self.last_modified)
+            # clients revalidate every time, pages of a user stay private
+            patch_cache_control(
+                response, no_cache=True, private=request.user.is_authenticated
+            )
+        return response
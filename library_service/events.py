@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import cache
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# set in Celery workers by library_service.celery, their in-process broker
+# has no subscribers, so without EVENT_BROKER_URL their events are dropped
+worker_process = False
+
+
+@dataclass(frozen=True)
+class Event:
+    id: str
+    type: str
+    data: dict
+
+    def encode(self) -> str:
+        """Server-sent events wire format"""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+def event_order(event_id: str) -> tuple[int, ...]:
+    """Sort key of local ("42") and Redis stream ("1700000000000-0") ids"""
+    return tuple(int(part) for part in event_id.split("-"))
+
+
+class Subscription:
+    """Events of one stream client. The queue is bounded: a client that
+    does not keep up is closed, it reconnects with Last-Event-ID and gets
+    the missed events from the broker buffer"""
+
+    def __init__(self, queue_size: int):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def offer(self, event: Event | None) -> None:
+        """Runs in the loop of the subscriber, None closes the stream"""
+        if self.closed:
+            return
+        if event is not None and not self.queue.full():
+            self.queue.put_nowait(event)
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Event | None:
+        return await self.queue.get()
+
+
+class EventBroker:
+    """In-process pub/sub: events published from any thread are fanned out
+    to the subscriptions of this process, the last buffer_size events are
+    kept for Last-Event-ID. Ids are only meaningful inside one process,
+    use RedisEventBroker when the app runs on several processes or nodes"""
+
+    def __init__(self, buffer_size: int, queue_size: int):
+        self.queue_size = queue_size
+        self.buffer = deque(maxlen=buffer_size)
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.last_id = 0
+
+    def publish(self, event_type: str, data: dict) -> None:
+        with self.lock:
+            self.last_id = next(self.ids)
+            event = Event(str(self.last_id), event_type, data)
+            self.buffer.append(event)
+        self.dispatch(event)
+
+    def dispatch(self, event: Event | None) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # loop of a finished request, e.g. under WSGI
+                self.unsubscribe(subscription)
+
+    async def replay(self, last_event_id: str) -> list[Event] | None:
+        """Events after last_event_id, None when some of them are no
+        longer kept and the client has to reload its state"""
+        (last,) = event_order(last_event_id)
+        with self.lock:
+            events, newest = list(self.buffer), self.last_id
+        # an id from before a restart, or older than the buffer
+        if last > newest or (events and int(events[0].id) > last + 1):
+            return None
+        return [event for event in events if int(event.id) > last]
+
+    async def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    async def close(self) -> None:
+        """End every open stream, servers wait for them on shutdown"""
+        self.dispatch(None)
+
+
+class RedisEventBroker(EventBroker):
+    """Events go through a Redis stream trimmed to about buffer_size
+    entries. One listener task per process reads it and fans the events
+    out to the local subscriptions, replay reads the stream itself"""
+
+    def __init__(self, url: str, stream: str, buffer_size: int, queue_size: int):
+        super().__init__(buffer_size, queue_size)
+        self.url = url
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.async_client = None
+        self.listener = None
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_client[0] is not loop:
+            self.async_client = (
+                loop,
+                redis.asyncio.Redis.from_url(self.url, decode_responses=True),
+            )
+        return self.async_client[1]
+
+    @staticmethod
+    def to_event(entry_id: str, fields: dict) -> Event:
+        return Event(entry_id, fields["type"], json.loads(fields["data"]))
+
+    def publish(self, event_type: str, data: dict) -> None:
+        self.client.xadd(
+            self.stream,
+            {"type": event_type, "data": json.dumps(data)},
+            maxlen=self.buffer_size,
+            approximate=True,
+        )
+
+    async def listen(self, last_id: str) -> None:
+        client = self.get_async_client()
+        while True:
+            try:
+                response = await client.xread(
+                    {self.stream: last_id}, block=5_000, count=100
+                )
+            except redis.RedisError:
+                logger.exception("Failed to read event stream")
+                await asyncio.sleep(1)
+                continue
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    self.dispatch(self.to_event(entry_id, fields))
+
+    async def replay(self, last_event_id: str) -> list[Event] | None:
+        client = self.get_async_client()
+        last = event_order(last_event_id)
+        first = await client.xrange(self.stream, count=1)
+        newest = await client.xrevrange(self.stream, count=1)
+        if (
+            not first
+            or event_order(first[0][0]) > last
+            or event_order(newest[0][0]) < last
+        ):
+            return None
+        entries = await client.xrange(
+            self.stream, min=f"({last_event_id}", count=self.buffer_size
+        )
+        return [self.to_event(entry_id, fields) for entry_id, fields in entries]
+
+    async def subscribe(self) -> Subscription:
+        subscription = await super().subscribe()
+        if self.listener is None or self.listener.get_loop() is not subscription.loop:
+            # read from the current end, events after it are either in the
+            # replay of this subscription or dispatched by the listener
+            newest = await self.get_async_client().xrevrange(self.stream, count=1)
+            self.listener = asyncio.create_task(
+                self.listen(newest[0][0] if newest else "0-0")
+            )
+        return subscription
+
+    async def close(self) -> None:
+        await super().close()
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+
+
+@cache
+def get_broker() -> EventBroker:
+    if settings.EVENT_BROKER_URL:
+        return RedisEventBroker(
+            settings.EVENT_BROKER_URL,
+            settings.EVENT_STREAM_KEY,
+            settings.EVENT_STREAM_BUFFER,
+            settings.EVENT_STREAM_CLIENT_QUEUE,
+        )
+    return EventBroker(settings.EVENT_STREAM_BUFFER, settings.EVENT_STREAM_CLIENT_QUEUE)
+
+
+def publish_on_commit(event_type: str, data: dict) -> None:
+    """Publish after the current transaction commits, so subscribers never
+    see a change that was rolled back"""
+    if worker_process and not settings.EVENT_BROKER_URL:
+        logger.warning(
+            "%s event from a Celery worker dropped, set EVENT_BROKER_URL "
+            "to deliver events of tasks",
+            event_type,
+        )
+        return
+
+    def publish():
+        try:
+            get_broker().publish(event_type, data)
+        except Exception:
+            logger.exception("Failed to publish %s event", event_type)
+
+    transaction.on_commit(publish)
@@ -0,0 +1,37 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LifespanMiddleware:
+    """Answer ASGI lifespan events that Django does not handle, so
+    long-lived resources start and stop once per server process"""
+
+    def __init__(self, app, on_startup=(), on_shutdown=()):
+        self.app = app
+        self.on_startup = list(on_startup)
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await self.app(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    for handler in self.on_startup:
+                        await handler()
+                except Exception as exc:
+                    logger.exception("Lifespan startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(exc)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for handler in self.on_shutdown:
+                    try:
+                        await handler()
+                    except Exception:
+                        logger.exception("Lifespan shutdown handler failed")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.db.backends.signals import connection_created
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value=1, **labels) -> None:
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}_total", dict(zip(self.labels, key)), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels) -> None:
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0, 0)
+            )
+            if index < len(self.buckets):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            }
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": bound}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    """Process-local metrics rendered in Prometheus text format, extra
+    collectors add metrics kept elsewhere (e.g. telegram client counters)"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector) -> None:
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics + [m for c in self.collectors for m in c()]:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Request latency by view",
+        labels=("view", "method", "status"),
+    )
+)
+REQUEST_QUERIES = registry.register(
+    Histogram(
+        "http_request_db_queries",
+        "SQL queries per request",
+        labels=("view",),
+        buckets=QUERY_BUCKETS,
+    )
+)
+REQUEST_DB_SECONDS = registry.register(
+    Histogram(
+        "http_request_db_seconds", "Time spent in SQL per request", labels=("view",)
+    )
+)
+REQUEST_EXTERNAL_SECONDS = registry.register(
+    Histogram(
+        "http_request_external_seconds",
+        "Time spent calling external services per request",
+        labels=("view",),
+    )
+)
+EXTERNAL_CALL_SECONDS = registry.register(
+    Histogram(
+        "external_call_duration_seconds",
+        "Latency of external service calls",
+        labels=("service",),
+    )
+)
+QUERY_BUDGET_EXCEEDED = registry.register(
+    Counter(
+        "http_request_query_budget_exceeded",
+        "Requests that made more queries than their budget",
+        labels=("view",),
+    )
+)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    external_seconds: float = 0.0
+
+
+# context variables follow the request into sync_to_async threads
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    stats = current_request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def install_db_wrapper(connection, **kwargs) -> None:
+    # inserted first, execute_wrapper() context managers pop the last one
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, db_execute_wrapper)
+
+
+connection_created.connect(install_db_wrapper)
+
+
+@contextmanager
+def track_external(service: str):
+    """Time a call to Stripe, Telegram, etc. and add it to the request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_CALL_SECONDS.observe(elapsed, service=service)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.external_seconds += elapsed
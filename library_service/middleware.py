@@ -0,0 +1,103 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from library_service.metrics import (
+    QUERY_BUDGET_EXCEEDED,
+    REQUEST_DB_SECONDS,
+    REQUEST_EXTERNAL_SECONDS,
+    REQUEST_QUERIES,
+    REQUEST_SECONDS,
+    RequestStats,
+    current_request_stats,
+    install_db_wrapper,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """Record latency, SQL query count and time, and external call time of
+    every request per view. Requests over QUERY_BUDGET are logged, or fail
+    when QUERY_BUDGET_STRICT is set (tests)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    @staticmethod
+    def start():
+        # connections opened before this module was imported never sent
+        # connection_created, e.g. the test database connection
+        for connection in connections.all(initialized_only=True):
+            install_db_wrapper(connection)
+        stats = RequestStats()
+        return stats, current_request_stats.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats: RequestStats, started: float):
+        view = view_name(request)
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        REQUEST_QUERIES.observe(stats.queries, view=view)
+        REQUEST_DB_SECONDS.observe(stats.db_seconds, view=view)
+        REQUEST_EXTERNAL_SECONDS.observe(stats.external_seconds, view=view)
+        self.check_query_budget(request.method, view, stats)
+
+    @staticmethod
+    def check_query_budget(method: str, view: str, stats: RequestStats) -> None:
+        """QUERY_BUDGETS keys are "METHOD view_name" or just view_name"""
+        budget = settings.QUERY_BUDGETS.get(
+            f"{method} {view}", settings.QUERY_BUDGETS.get(view, settings.QUERY_BUDGET)
+        )
+        if budget is None or stats.queries <= budget:
+            return
+        QUERY_BUDGET_EXCEEDED.inc(view=view)
+        message = (
+            f"{method} {view} made {stats.queries} SQL queries, budget is {budget}"
+        )
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
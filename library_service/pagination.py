@@ -0,0 +1,198 @@
+import base64
+import datetime
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+async def afetch(queryset, chunk_size: int) -> list:
+    """Rows of a sliced queryset through the async ORM, prefetch_related
+    lookups run per chunk"""
+    return [obj async for obj in queryset.aiterator(chunk_size=max(chunk_size, 1))]
+
+
+class AsyncLimitOffsetPagination(LimitOffsetPagination):
+    """LimitOffsetPagination with apaginate_queryset() for async views"""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return await afetch(
+            queryset[self.offset : self.offset + self.limit], self.limit
+        )
+
+
+class KeysetPagination(AsyncLimitOffsetPagination):
+    """Keyset (cursor) pagination over view.keyset_ordering, each page is
+    an indexed range scan instead of OFFSET. Requests with ?offset= keep
+    limit/offset behaviour, ?count=false skips COUNT(*) in keyset mode.
+    Nullable ordering fields are sorted NULLS FIRST on every database"""
+
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    max_limit = 100
+
+    def setup(self, request, view) -> None:
+        self.request = request
+        self.keyset = request.query_params.get(self.offset_query_param) is None
+        self.with_count = (
+            not self.keyset
+            or request.query_params.get(self.count_query_param) != "false"
+        )
+        if self.keyset:
+            self.limit = self.get_limit(request)
+            self.fields = view.keyset_ordering
+
+    def page_queryset(self, queryset):
+        """Rows after the cursor, one more than limit to tell if there is
+        a next page"""
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.after(self.decode_cursor(cursor, queryset.model))
+            )
+        return queryset[: self.limit + 1]
+
+    def set_page(self, page: list) -> list:
+        self.has_next = len(page) > self.limit
+        self.page = page[: self.limit]
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.setup(request, view)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        queryset = self.order_queryset(queryset)
+        self.count = self.get_count(queryset) if self.with_count else None
+        return self.set_page(list(self.page_queryset(queryset)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.setup(request, view)
+        if not self.keyset:
+            return await super().apaginate_queryset(queryset, request, view)
+
+        queryset = self.order_queryset(queryset)
+        self.count = await queryset.acount() if self.with_count else None
+        return self.set_page(await afetch(self.page_queryset(queryset), self.limit + 1))
+
+    def order_queryset(self, queryset):
+        nullable = {field.name for field in queryset.model._meta.fields if field.null}
+        return queryset.order_by(
+            *(
+                F(field).asc(nulls_first=True) if field in nullable else F(field).asc()
+                for field in self.fields
+            )
+        )
+
+    def after(self, values):
+        """(f1, f2, ..., fn) > (v1, v2, ..., vn) with NULL lower than any value"""
+
+        def greater(field, value):
+            if value is None:
+                return Q(**{f"{field}__isnull": False})
+            return Q(**{f"{field}__gt": value})
+
+        def equal(field, value):
+            if value is None:
+                return Q(**{f"{field}__isnull": True})
+            return Q(**{field: value})
+
+        pairs = list(zip(self.fields, values))
+        field, value = pairs[-1]
+        return reduce(
+            lambda condition, pair: greater(*pair) | (equal(*pair) & condition),
+            reversed(pairs[:-1]),
+            greater(field, value),
+        )
+
+    def encode_cursor(self, obj):
+        values = []
+        for field in self.fields:
+            value = getattr(obj, field)
+            if isinstance(value, datetime.date):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        """Cursor values converted to the types of their fields, a cursor
+        that does not fit them is a page that does not exist"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise NotFound("Invalid cursor")
+        try:
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return None
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.with_count:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["required"] = ["results"]
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor of the next page, taken from next link",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to false to skip total count",
+                "schema": {"type": "boolean"},
+            },
+        ]
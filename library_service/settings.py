@@ -13,12 +13,16 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 
 from datetime import timedelta
+from decimal import Decimal
 from pathlib import Path
 
+from celery.schedules import crontab
 from django.urls import reverse
 from dotenv import load_dotenv
 from django.core.signing import Signer
 
+from library_service.database import database_from_url
+
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -59,6 +63,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "users_service.User"
 
 MIDDLEWARE = [
+    "library_service.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -92,12 +97,80 @@ WSGI_APPLICATION = "library_service.wsgi.application"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DATABASES = {
+    "default": database_from_url(
+        os.environ.get("DATABASE_URL") or f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
+        conn_max_age=int(os.environ.get("DATABASE_CONN_MAX_AGE", 60)),
+        pool_max_size=int(os.environ.get("DATABASE_POOL_MAX_SIZE", 0)),
+    )
+}
+
+# applied to every SQLite connection: WAL lets readers work while one
+# connection writes, NORMAL sync is safe in WAL mode and skips an fsync per
+# commit, writers wait up to busy_timeout ms for the lock
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 20_000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64_000,
+    "temp_store": "MEMORY",
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     }
 }
 
+# a shared cache (REDIS_CACHE_URL) also turns on ETags of books, borrowings
+# and payments and the cache of authenticated users, their version counters
+# are bumped by other processes as well
+if os.environ.get("REDIS_CACHE_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get("REDIS_CACHE_URL"),
+    }
+
+BOOK_CATALOG_CACHE_TIMEOUT = 15 * 60
+# authenticated users are cached this long, saves invalidate them sooner.
+# Only with the shared cache, a process-local one could not revoke them
+USER_CACHE_TIMEOUT = 60
+
+# server-sent events, EVENT_BROKER_URL (redis) shares them between processes.
+# Without it only events of the web process reach its clients: changes made
+# by Celery tasks (copies handed over by expire_book_holds) are logged and
+# dropped. Set it whenever the web server runs several processes or Celery
+# workers run
+EVENT_BROKER_URL = os.environ.get("EVENT_BROKER_URL")
+EVENT_STREAM_KEY = "library:events"
+EVENT_STREAM_BUFFER = 1000
+# events queued per client, slower clients are disconnected and resume
+EVENT_STREAM_CLIENT_QUEUE = 100
+EVENT_STREAM_HEARTBEAT = 15
+EVENT_STREAM_RETRY_MS = 3000
+
+# request metrics, SQL queries over budget are logged or fail when strict
+# /metrics/ needs METRICS_TOKEN as bearer token, without it only DEBUG serves it
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+QUERY_BUDGET = 20
+QUERY_BUDGETS = {
+    "GET books-service:book-list": 5,
+    "GET books-service:book-detail": 5,
+    "GET borrowings-service:borrowing-list": 5,
+    "GET borrowings-service:borrowing-detail": 5,
+    "GET payment-service:payment-list": 5,
+    "GET payment-service:payment-detail": 5,
+    "GET users-service:user-summary": 4,
+}
+QUERY_BUDGET_STRICT = False
+BOOK_IMPORT_BATCH_SIZE = 1000
+BOOK_IMPORT_MAX_ERRORS = 1000
+BOOK_EXPORT_CHUNK_SIZE = 2000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -143,7 +216,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users_service.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 10,
@@ -178,6 +251,24 @@ TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/"
 BOT_USERNAME = os.environ.get("BOT_USERNAME")
 NGROK_URL = os.environ.get("NGROK_URL")
 signer = Signer()
+TELEGRAM_OUTBOX_BATCH_SIZE = 500
+TELEGRAM_OUTBOX_MAX_ATTEMPTS = 5
+TELEGRAM_OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=5)
+TELEGRAM_API_TIMEOUT = 5
+TELEGRAM_POOL_SIZE = 10
+TELEGRAM_MAX_RETRIES = 3
+# longer retry_after is left to the next outbox dispatch
+TELEGRAM_MAX_RETRY_AFTER = 60
+# messages per second for the whole bot, seconds between messages of a chat
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_INTERVAL = 1.0
+TELEGRAM_GROUP_INTERVAL = 3.0
+TELEGRAM_UPDATE_QUEUE_SIZE = 1000
+TELEGRAM_UPDATE_CONCURRENCY = 8
+# Telegram keeps undelivered updates for 24 hours
+TELEGRAM_UPDATE_DEDUPE_TIMEOUT = 24 * 60 * 60
+OVERDUE_SCAN_CHUNK_SIZE = 2000
+OVERDUE_REPORT_MAX_LINES = 100
 
 # celery settings
 CELERY_BROKER_URL = "redis://localhost:6379"
@@ -185,7 +276,50 @@ CELERY_RESULT_BACKEND = "redis://localhost:6379"
 CELERY_TIMEZONE = "Europe/Kyiv"
 CELERY_TASK_TRAK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-telegram-outbox": {
+        "task": "telegram_chat.tasks.dispatch_outbox",
+        "schedule": timedelta(minutes=1),
+    },
+    "reconcile-pending-payments": {
+        "task": "payment_service.tasks.reconcile_pending_payments",
+        "schedule": timedelta(minutes=30),
+    },
+    "expire-book-holds": {
+        "task": "borrowings_service.tasks.expire_book_holds",
+        "schedule": timedelta(minutes=15),
+    },
+    # crontab hours are CELERY_TIMEZONE, task dates are UTC (TIME_ZONE): 03:05
+    # in Kyiv is after UTC midnight in winter (UTC+2) and summer (UTC+3) time
+    "refresh-borrowing-summaries": {
+        "task": "borrowings_service.tasks.refresh_borrowing_summaries",
+        "schedule": crontab(hour=3, minute=5),
+    },
+    # after UTC midnight too, see refresh-borrowing-summaries
+    "generate-overdue-fines": {
+        "task": "payment_service.tasks.generate_overdue_fines",
+        "schedule": crontab(hour=3, minute=15),
+    },
+}
 
 # stripe settings
 
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
+# checkout sessions expire after 24 hours, older ones can not be paid
+STRIPE_RECONCILE_WINDOW = timedelta(days=2)
+STRIPE_RECONCILE_BATCH_SIZE = 500
+
+# book search backend, None picks one matching the database vendor
+BOOK_SEARCH_BACKEND = os.environ.get("BOOK_SEARCH_BACKEND")
+
+# fines settings
+FINE_MULTIPLIER = Decimal("2")
+FINE_RECALCULATION_DAYS = 2
+FINE_CHUNK_SIZE = 1000
+
+# borrowings settings
+BULK_BORROWING_MAX_ITEMS = 20
+# a returned copy is kept for the next holder this long
+BOOK_HOLD_PICKUP_WINDOW = timedelta(days=2)
+BOOK_HOLD_MAX_WAIT = timedelta(days=30)
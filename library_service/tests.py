@@ -0,0 +1,608 @@
+import asyncio
+import datetime
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from books_service.models import Book
+from books_service.views import BookViewSet
+from borrowings_service.models import Borrowing
+from borrowings_service.summary import borrowings_version_key, bump_borrowings_version
+from library_service.database import database_from_url, write_transaction
+from library_service.events import (
+    EventBroker,
+    RedisEventBroker,
+    get_broker,
+    publish_on_commit,
+)
+from library_service.metrics import (
+    REQUEST_QUERIES,
+    Histogram,
+    registry,
+    track_external,
+)
+from library_service.middleware import QueryBudgetExceeded
+
+BOOK_LIST_URL = reverse("books-service:book-list")
+BORROWING_LIST_URL = reverse("borrowings_service:borrowing-list")
+METRICS_URL = reverse("metrics")
+EVENTS_URL = reverse("events")
+PAYMENT_LIST_URL = reverse("payment-service:payment-list")
+
+
+def sample_book(**params):
+    defaults = {
+        "title": "Sample Book",
+        "author": "Tiffany Smith",
+        "cover": "HARD",
+        "inventory": 20,
+        "daily_fee": 0.5,
+    }
+    defaults.update(params)
+    return Book.objects.create(**defaults)
+
+
+class HistogramTests(TestCase):
+
+    def test_render_cumulative_buckets(self):
+        histogram = Histogram("test_seconds", "Test", labels=("view",), buckets=(1, 5))
+        for value in (0.5, 2, 10):
+            histogram.observe(value, view='a"b')
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{view="a\\"b",le="1"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="a\\"b",le="5"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="a\\"b",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{view="a\\"b"} 3', lines)
+
+
+class MetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        sample_book()
+        for metric in registry.metrics:
+            metric.clear()
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_request_latency_and_queries_per_view(self):
+        self.client.get(BOOK_LIST_URL)
+        ((key, (counts, total, count)),) = REQUEST_QUERIES._values.items()
+        self.assertEqual(key, ("books-service:book-list",))
+        self.assertEqual(count, 1)
+        self.assertGreater(total, 0)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(res.status_code, 200)
+        content = res.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{view="books-service:book-list",'
+            'method="GET",status="200"} 1',
+            content,
+        )
+        self.assertIn("# TYPE telegram_api_requests counter", content)
+
+    def test_external_call_time_added_to_request(self):
+        with track_external("stripe"):
+            pass
+        self.assertIn(
+            'external_call_duration_seconds_count{service="stripe"} 1',
+            registry.render(),
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token_required(self):
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 403)
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_without_token_only_open_in_debug(self):
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(METRICS_URL).status_code, 200)
+
+    @override_settings(
+        QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={"books-service:book-list": 1}
+    )
+    def test_strict_query_budget_fail_request(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(BOOK_LIST_URL)
+
+    @override_settings(QUERY_BUDGETS={"books-service:book-list": 1})
+    def test_query_budget_logged_by_default(self):
+        with self.assertLogs("library_service.middleware", "WARNING"):
+            res = self.client.get(BOOK_LIST_URL)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'http_request_query_budget_exceeded_total{view="books-service:book-list"} 1',
+            registry.render(),
+        )
+
+
+class DatabaseUrlTests(TestCase):
+
+    def test_sqlite_url(self):
+        database = database_from_url("sqlite:////srv/library/db.sqlite3")
+        self.assertEqual(database["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(database["NAME"], "/srv/library/db.sqlite3")
+        self.assertEqual(database["TEST"]["NAME"], "/srv/library/test_db.sqlite3")
+
+    def test_postgres_url_with_persistent_connections(self):
+        database = database_from_url(
+            "postgres://library:p%40ss@db:5432/library?sslmode=require",
+            conn_max_age=120,
+        )
+        self.assertEqual(database["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual(
+            (database["USER"], database["PASSWORD"], database["HOST"]),
+            ("library", "p@ss", "db"),
+        )
+        self.assertEqual((database["NAME"], database["PORT"]), ("library", 5432))
+        self.assertEqual(database["OPTIONS"], {"sslmode": "require"})
+        self.assertEqual(database["CONN_MAX_AGE"], 120)
+        self.assertTrue(database["CONN_HEALTH_CHECKS"])
+
+    def test_postgres_pool_disables_persistent_connections(self):
+        database = database_from_url(
+            "postgresql://library@db/library", pool_max_size=10
+        )
+        self.assertEqual(database["CONN_MAX_AGE"], 0)
+        self.assertEqual(database["OPTIONS"]["pool"]["max_size"], 10)
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ImproperlyConfigured):
+            database_from_url("mysql://library@db/library")
+
+
+@skipUnless(
+    connection.vendor == "sqlite" and not connection.is_in_memory_db(),
+    "SQLite file database only",
+)
+class SQLiteWritersTests(TransactionTestCase):
+    writers = 8
+
+    def setUp(self):
+        self.book = Book.objects.create(
+            title="Book", author="Author", cover="HARD", inventory=100, daily_fee=1
+        )
+
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 20_000)
+
+    def run_writers(self, write):
+        barrier = threading.Barrier(self.writers)
+
+        def writer(_):
+            try:
+                write(barrier)
+                return None
+            except OperationalError as exc:
+                return exc
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.writers) as executor:
+            return [
+                error for error in executor.map(writer, range(self.writers)) if error
+            ]
+
+    def test_deferred_transaction_that_reads_first_is_locked(self):
+        def write(barrier):
+            with transaction.atomic():
+                Book.objects.get(id=self.book.id)
+                barrier.wait()
+                Book.take_copy(self.book.id)
+
+        errors = self.run_writers(write)
+        self.assertTrue(errors)
+        self.assertIn("locked", str(errors[0]))
+
+    def test_write_transaction_waits_for_lock(self):
+        def write(barrier):
+            barrier.wait()
+            with write_transaction():
+                Book.objects.get(id=self.book.id)
+                time.sleep(0.01)
+                Book.take_copy(self.book.id)
+
+        self.assertEqual(self.run_writers(write), [])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 100 - self.writers)
+
+
+class AsyncReadViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email="reader@library.test", password="<PASSWORD>"
+        )
+        self.book = sample_book()
+        self.borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+        )
+        self.headers = {"Authorize": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    def test_read_routes_are_async(self):
+        self.assertTrue(iscoroutinefunction(resolve(BOOK_LIST_URL).func))
+        self.assertTrue(iscoroutinefunction(resolve(BORROWING_LIST_URL).func))
+
+    async def test_book_list_and_detail(self):
+        res = await self.async_client.get(BOOK_LIST_URL, {"title": "sample"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([book["id"] for book in res.json()["results"]], [self.book.id])
+
+        res = await self.async_client.get(
+            reverse("books-service:book-detail", args=[self.book.id])
+        )
+        self.assertEqual(res.json()["title"], self.book.title)
+
+        res = await self.async_client.get(
+            reverse("books-service:book-detail", args=[self.book.id + 1])
+        )
+        self.assertEqual(res.status_code, 404)
+
+    async def test_borrowing_list_and_detail(self):
+        res = await self.async_client.get(BORROWING_LIST_URL, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [borrowing["id"] for borrowing in res.json()["results"]],
+            [self.borrowing.id],
+        )
+
+        res = await self.async_client.get(
+            reverse("borrowings_service:borrowing-detail", args=[self.borrowing.id]),
+            headers=self.headers,
+        )
+        self.assertEqual(res.json()["book"]["id"], self.book.id)
+
+    async def test_borrowings_of_other_user_not_found(self):
+        other = await get_user_model().objects.acreate(email="other@library.test")
+        res = await self.async_client.get(
+            reverse("borrowings_service:borrowing-detail", args=[self.borrowing.id]),
+            headers={"Authorize": f"Bearer {AccessToken.for_user(other)}"},
+        )
+        self.assertEqual(res.status_code, 404)
+
+    async def test_authentication_required(self):
+        res = await self.async_client.get(BORROWING_LIST_URL)
+        self.assertEqual(res.status_code, 401)
+        self.assertIn("WWW-Authenticate", res.headers)
+
+        res = await self.async_client.get(
+            BORROWING_LIST_URL, headers={"Authorize": "Bearer invalid"}
+        )
+        self.assertEqual(res.status_code, 401)
+
+    def test_sync_and_async_responses_match(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        params = {"limit": 5, "offset": 0}
+
+        responses = []
+        for async_actions in (BookViewSet.async_actions, ()):
+            cache.clear()
+            with mock.patch.object(BookViewSet, "async_actions", async_actions):
+                responses.append(client.get(BOOK_LIST_URL, params).data)
+        self.assertEqual(responses[0], responses[1])
+
+    def test_create_still_sync(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.post(
+            BORROWING_LIST_URL,
+            {
+                "book": self.book.id,
+                "expected_return_date": datetime.date.today()
+                + datetime.timedelta(days=3),
+            },
+        )
+        self.assertEqual(res.status_code, 201)
+
+
+@override_settings(EVENT_BROKER_URL=None)
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        get_broker.cache_clear()
+        self.addCleanup(get_broker.cache_clear)
+        self.user = get_user_model().objects.create_user(
+            email="reader@library.test", password="<PASSWORD>"
+        )
+        self.book = sample_book(inventory=2)
+
+    async def read_events(self, response, count):
+        events = []
+        async for chunk in response.streaming_content:
+            chunk = chunk.decode()
+            if chunk.startswith("id:") or chunk.startswith("event:"):
+                events.append(chunk)
+            if len(events) == count:
+                return events
+
+    async def test_replay_after_last_event_id(self):
+        broker = EventBroker(buffer_size=3, queue_size=10)
+        for inventory in range(5):
+            broker.publish("inventory", {"book": 1, "inventory": inventory})
+
+        events = await broker.replay("3")
+        self.assertEqual([event.id for event in events], ["4", "5"])
+        self.assertEqual(await broker.replay("5"), [])
+        # event 2 was dropped from the buffer, 6 is from before a restart
+        self.assertIsNone(await broker.replay("1"))
+        self.assertIsNone(await broker.replay("6"))
+
+    async def test_slow_client_disconnected(self):
+        broker = EventBroker(buffer_size=10, queue_size=2)
+        subscription = await broker.subscribe()
+        for inventory in range(3):
+            broker.publish("inventory", {"book": 1, "inventory": inventory})
+        await asyncio.sleep(0)
+
+        self.assertIsNone(await subscription.get())
+        self.assertTrue(subscription.closed)
+
+    async def test_stream_resumes_from_last_event_id(self):
+        broker = get_broker()
+        broker.publish("inventory", {"book": 1, "inventory": 1})
+        broker.publish("inventory", {"book": 1, "inventory": 0})
+
+        response = await self.async_client.get(
+            EVENTS_URL, headers={"Last-Event-ID": "1"}
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, broker.publish, "return", {"id": 7, "book": 1})
+        events = await asyncio.wait_for(self.read_events(response, 2), 5)
+        # shutdown ends the stream and drops the subscription
+        await broker.close()
+        async for _ in response.streaming_content:
+            pass
+
+        self.assertEqual(
+            events,
+            [
+                'id: 2\nevent: inventory\ndata: {"book": 1, "inventory": 0}\n\n',
+                'id: 3\nevent: return\ndata: {"id": 7, "book": 1}\n\n',
+            ],
+        )
+        self.assertFalse(broker.subscriptions)
+
+    async def test_reset_when_missed_events_are_gone(self):
+        response = await self.async_client.get(EVENTS_URL, {"last_event_id": "40"})
+        events = await asyncio.wait_for(self.read_events(response, 1), 5)
+        await get_broker().close()
+        self.assertEqual(events, ["event: reset\ndata: {}\n\n"])
+
+    def test_needs_asgi(self):
+        self.assertEqual(self.client.get(EVENTS_URL).status_code, 501)
+
+    @mock.patch("telegram_chat.tasks.dispatch_outbox.delay")
+    @mock.patch("payment_service.views.create_checkout_session.delay")
+    def test_borrow_and_return_published_after_commit(self, *mocks):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = client.post(
+                BORROWING_LIST_URL,
+                {
+                    "book": self.book.id,
+                    "expected_return_date": datetime.date.today()
+                    + datetime.timedelta(days=3),
+                },
+            )
+            borrowing_id = res.data["id"]
+            # nothing is sent before the transaction commits
+            self.assertFalse(get_broker().buffer)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(
+                reverse(
+                    "borrowings_service:borrowing-return-borrowing", args=[borrowing_id]
+                )
+            )
+
+        self.assertEqual(
+            [(event.type, event.data) for event in get_broker().buffer],
+            [
+                ("inventory", {"book": self.book.id, "inventory": 1}),
+                ("borrow", {"id": borrowing_id, "book": self.book.id}),
+                ("inventory", {"book": self.book.id, "inventory": 2}),
+                ("return", {"id": borrowing_id, "book": self.book.id}),
+            ],
+        )
+
+    @mock.patch("library_service.events.worker_process", True)
+    def test_worker_events_dropped_without_shared_broker(self):
+        with self.assertLogs("library_service.events", "WARNING"):
+            with self.captureOnCommitCallbacks(execute=True):
+                publish_on_commit("inventory", {"book": self.book.id, "inventory": 1})
+        self.assertFalse(get_broker().buffer)
+
+
+# shared between processes like the Redis cache in production
+SHARED_CACHE = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(
+            tempfile.gettempdir(), f"library-service-tests-{os.getpid()}"
+        ),
+    }
+}
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email="reader@library.test", password="<PASSWORD>"
+        )
+        self.other = get_user_model().objects.create_user(
+            email="other@library.test", password="<PASSWORD>"
+        )
+        self.book = sample_book()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(url, params, headers={"If-None-Match": response["ETag"]})
+
+    def test_unchanged_catalog_not_modified_without_queries(self):
+        res = self.client.get(BOOK_LIST_URL)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res["ETag"].startswith('W/"'))
+        self.assertIn("no-cache", res["Cache-Control"])
+
+        with self.assertNumQueries(0):
+            not_modified = self.revalidate(BOOK_LIST_URL, res)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertEqual(not_modified["ETag"], res["ETag"])
+
+    async def test_async_read_not_modified(self):
+        res = await self.async_client.get(BOOK_LIST_URL)
+        not_modified = await self.async_client.get(
+            BOOK_LIST_URL, headers={"If-None-Match": res["ETag"]}
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_inventory_change_gives_new_etag(self):
+        res = self.client.get(BOOK_LIST_URL)
+        self.client.post(
+            BORROWING_LIST_URL,
+            {
+                "book": self.book.id,
+                "expected_return_date": datetime.date.today()
+                + datetime.timedelta(days=3),
+            },
+        )
+
+        res = self.revalidate(BOOK_LIST_URL, res)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["results"][0]["inventory"], 19)
+
+    def test_borrowing_pages_per_user(self):
+        staff = get_user_model().objects.create_user(
+            email="staff@library.test", password="<PASSWORD>", is_staff=True
+        )
+        staff_client = APIClient()
+        staff_client.force_authenticate(staff)
+        own = self.client.get(PAYMENT_LIST_URL)
+        all_payments = staff_client.get(PAYMENT_LIST_URL)
+
+        bump_borrowings_version([self.other.id])
+
+        self.assertEqual(self.revalidate(PAYMENT_LIST_URL, own).status_code, 304)
+        res = staff_client.get(
+            PAYMENT_LIST_URL, headers={"If-None-Match": all_payments["ETag"]}
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("private", res["Cache-Control"])
+
+    def test_return_gives_new_etag(self):
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+        )
+        detail_url = reverse("borrowings_service:borrowing-detail", args=[borrowing.id])
+        res = self.client.get(detail_url)
+        self.assertEqual(self.revalidate(detail_url, res).status_code, 304)
+
+        self.client.post(
+            reverse(
+                "borrowings_service:borrowing-return-borrowing", args=[borrowing.id]
+            )
+        )
+        res = self.revalidate(detail_url, res)
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(res.data["actual_return_date"])
+
+    def test_bump_in_another_process_gives_new_etag(self):
+        res = self.client.get(PAYMENT_LIST_URL)
+        # e.g. a Celery worker storing the checkout session of a payment
+        worker = multiprocessing.get_context("fork").Process(
+            target=bump_borrowings_version, args=([self.user.id],)
+        )
+        worker.start()
+        worker.join()
+        self.assertEqual(worker.exitcode, 0)
+
+        self.assertEqual(self.revalidate(PAYMENT_LIST_URL, res).status_code, 200)
+
+    def test_culled_counter_does_not_repeat_old_etag(self):
+        res = self.client.get(PAYMENT_LIST_URL)
+        cache.delete(borrowings_version_key(self.user.id))
+
+        self.assertEqual(self.revalidate(PAYMENT_LIST_URL, res).status_code, 200)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_off_with_process_local_cache(self):
+        res = self.client.get(PAYMENT_LIST_URL, headers={"If-None-Match": "*"})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("ETag", res)
+
+    def test_if_modified_since(self):
+        bump_borrowings_version([self.user.id])
+        res = self.client.get(BORROWING_LIST_URL)
+        self.assertIn("Last-Modified", res)
+
+        res = self.client.get(
+            BORROWING_LIST_URL, headers={"If-Modified-Since": res["Last-Modified"]}
+        )
+        self.assertEqual(res.status_code, 304)
+
+    def test_errors_not_cached(self):
+        res = APIClient().get(BORROWING_LIST_URL, headers={"If-None-Match": "*"})
+        self.assertEqual(res.status_code, 401)
+        self.assertNotIn("ETag", res)
+
+
+@skipUnless(os.environ.get("EVENT_BROKER_URL"), "needs EVENT_BROKER_URL (redis)")
+class RedisEventBrokerTests(TestCase):
+
+    def setUp(self):
+        self.broker = RedisEventBroker(
+            os.environ["EVENT_BROKER_URL"],
+            f"library:test-events:{os.getpid()}",
+            buffer_size=100,
+            queue_size=10,
+        )
+        self.addCleanup(self.broker.client.delete, self.broker.stream)
+
+    async def test_publish_subscribe_and_replay(self):
+        self.broker.publish("inventory", {"book": 1, "inventory": 1})
+        ((first_id, _),) = self.broker.client.xrange(self.broker.stream)
+        subscription = await self.broker.subscribe()
+        self.broker.publish("inventory", {"book": 1, "inventory": 0})
+
+        event = await asyncio.wait_for(subscription.get(), 10)
+        self.assertEqual(event.data, {"book": 1, "inventory": 0})
+        self.assertEqual(await self.broker.replay(first_id), [event])
+        self.assertIsNone(await self.broker.replay("1-0"))
+        await self.broker.close()
+        self.assertIsNone(await subscription.get())
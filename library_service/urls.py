@@ -25,8 +25,12 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from library_service.views import events, metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", metrics, name="metrics"),
+    path("api/library/events/", events, name="events"),
     path(
         "api/library/users/", include("users_service.urls", namespace="users-service")
     ),
@@ -0,0 +1,89 @@
+import asyncio
+import hmac
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from library_service.events import event_order, get_broker
+from library_service.metrics import registry
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, protected by METRICS_TOKEN. Without
+    the token it is only open with DEBUG"""
+    token = settings.METRICS_TOKEN
+    if token:
+        authorization = request.headers.get("Authorization", "")
+        # constant time, the response time does not leak the token
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            return HttpResponse(status=403)
+    elif not settings.DEBUG:
+        return HttpResponse(status=403)
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+async def stream_events(subscription, replay, last_event_id):
+    broker = get_broker()
+    try:
+        yield f"retry: {settings.EVENT_STREAM_RETRY_MS}\n\n"
+        if replay is None:
+            # missed events are gone, the client reloads the catalog
+            yield "event: reset\ndata: {}\n\n"
+        for event in replay or ():
+            yield event.encode()
+            last_event_id = event.id
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.get(), settings.EVENT_STREAM_HEARTBEAT
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            # the subscription starts before the replay, skip what it sent
+            if last_event_id and event_order(event.id) <= event_order(last_event_id):
+                continue
+            yield event.encode()
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def events(request):
+    """Server-sent events of book inventory and borrow/return changes.
+    Reconnecting clients send Last-Event-ID (or ?last_event_id=) and get
+    the events they missed, or a reset event when those are gone"""
+    if request.method != "GET":
+        return HttpResponse(status=405)
+    if not isinstance(request, ASGIRequest):
+        # WSGI servers read the whole stream before sending it
+        return HttpResponse("Event stream needs an ASGI server", status=501)
+    broker = get_broker()
+    last_event_id = request.headers.get(
+        "Last-Event-ID", request.GET.get("last_event_id")
+    )
+    subscription = await broker.subscribe()
+    replay = []
+    try:
+        if last_event_id:
+            try:
+                replay = await broker.replay(last_event_id)
+            except ValueError:
+                replay = None
+            if replay is None:
+                last_event_id = None
+    except Exception:
+        broker.unsubscribe(subscription)
+        raise
+    response = StreamingHttpResponse(
+        stream_events(subscription, replay, last_event_id),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # nginx would buffer the stream otherwise
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,125 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+
+# Serve async_actions (list and retrieve) natively async: the ORM is
+# awaited through aget/aiterator and the serializer works on rows that are
+# already loaded, so under ASGI a read does not hold a thread while it waits
+# for the cache or the database. Other actions run the regular sync DRF
+# dispatch in a thread, like any sync view under ASGI.
+#
+# Authenticators may define aauthenticate(), others are called through
+# sync_to_async. Paginators may define apaginate_queryset(). A comment, not
+# a docstring: drf-spectacular shows docstrings of view bases as operation
+# descriptions.
+class AsyncReadMixin:
+    async_actions = ("list", "retrieve")
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not any(action in cls.async_actions for action in actions.values()):
+            return view
+        sync_view = sync_to_async(view)
+
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            # sync view sets head for get, actions is updated in place
+            action = actions.get(request.method.lower(), actions.get("get"))
+            if action in cls.async_actions:
+                return await view(request, *args, **kwargs)
+            return await sync_view(request, *args, **kwargs)
+
+        return csrf_exempt(async_view)
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.action_map.get(request.method.lower()) in self.async_actions:
+            return self.adispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch for async handlers, alist() serves list"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.aperform_authentication(request)
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, f"a{self.action}")
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        """initial() of async actions, mixins override it to await checks"""
+        self.initial(request, *args, **kwargs)
+
+    async def aperform_authentication(self, request) -> None:
+        """Request._authenticate() with awaited authenticators, the user is
+        set before initial() so it does not authenticate again"""
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, "aauthenticate"):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(
+                        request
+                    )
+            except APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        if hasattr(self.paginator, "apaginate_queryset"):
+            return await self.paginator.apaginate_queryset(
+                queryset, self.request, view=self
+            )
+        return await sync_to_async(self.paginate_queryset)(queryset)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404(f"No {queryset.model._meta.object_name} matches the query.")
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer([obj async for obj in queryset], many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(await self.aget_object())
+        return Response(serializer.data)
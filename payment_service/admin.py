@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from payment_service.models import Payment
+from payment_service.models import Payment, StripeEvent
 
 
 admin.site.register(Payment)
+admin.site.register(StripeEvent)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+def mark_existing_sessions_created(apps, schema_editor):
+    Payment = apps.get_model("payment_service", "Payment")
+    Payment.objects.filter(session_id__isnull=False).update(session_status="CREATED")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payment_service", "0003_alter_payment_borrowing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="session_status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "Pending"),
+                    ("CREATED", "Created"),
+                    ("FAILED", "Failed"),
+                ],
+                default="PENDING",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(mark_existing_sessions_created, migrations.RunPython.noop),
+    ]
@@ -11,6 +11,11 @@ class Payment(models.Model):
         PAYMENT = "PAYMENT"
         FINE = "FINE"
 
+    class SessionStatusChoices(models.TextChoices):
+        PENDING = "PENDING"
+        CREATED = "CREATED"
+        FAILED = "FAILED"
+
     status = models.CharField(
         max_length=10, choices=StatusChoices.choices, default=StatusChoices.PENDING
     )
@@ -19,5 +24,22 @@ class Payment(models.Model):
         Borrowing, on_delete=models.CASCADE, related_name="payments"
     )
     session_url = models.URLField(max_length=500, null=True, blank=True)
-    session_id = models.CharField(max_length=255, null=True, blank=True)
+    session_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    session_status = models.CharField(
+        max_length=10,
+        choices=SessionStatusChoices.choices,
+        default=SessionStatusChoices.PENDING,
+    )
     money_to_pay = models.DecimalField(decimal_places=2, max_digits=10)
+
+
+class StripeEvent(models.Model):
+    """Stripe webhook event that was already applied, Stripe redelivers
+    events so they are deduplicated by id"""
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=255)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
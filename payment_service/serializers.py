@@ -13,5 +13,6 @@ class PaymentSerializer(serializers.ModelSerializer):
             "borrowing",
             "session_url",
             "session_id",
+            "session_status",
             "money_to_pay",
         )
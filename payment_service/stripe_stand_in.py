@@ -0,0 +1,66 @@
+import itertools
+import time
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import stripe
+
+
+class StripeStandIn:
+    """Local replacement of stripe.checkout.Session for tests,
+    remembers idempotency keys like the real API does"""
+
+    def __init__(
+        self, failures: int = 0, error=stripe.APIConnectionError, latency: float = 0
+    ):
+        self.failures = failures
+        self.error = error
+        self.latency = latency
+        self.calls = []
+        self.sessions = {}
+        self._ids = itertools.count(1)
+
+    def create(self, idempotency_key=None, **params):
+        self.calls.append(params)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failures:
+            self.failures -= 1
+            raise self.error("stripe is not available")
+        if idempotency_key in self.sessions:
+            return self.sessions[idempotency_key]
+        session_id = f"cs_test_{next(self._ids)}"
+        session = SimpleNamespace(
+            id=session_id,
+            url=f"https://checkout.stripe.test/pay/{session_id}",
+            payment_status="unpaid",
+            metadata=params.get("metadata", {}),
+        )
+        if idempotency_key:
+            self.sessions[idempotency_key] = session
+        return session
+
+    def complete(self, session):
+        session.payment_status = "paid"
+        session.status = "complete"
+        return session
+
+    def list(self, **params):
+        self.calls.append(params)
+        sessions = [
+            session
+            for session in self.sessions.values()
+            if getattr(session, "status", "open") == params.get("status", "complete")
+        ]
+        return SimpleNamespace(auto_paging_iter=lambda: iter(sessions))
+
+    def patch(self):
+        stack = ExitStack()
+        stack.enter_context(
+            patch("stripe.checkout.Session.create", side_effect=self.create)
+        )
+        stack.enter_context(
+            patch("stripe.checkout.Session.list", side_effect=self.list)
+        )
+        return stack
@@ -0,0 +1,332 @@
+import datetime
+
+import stripe
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from django.utils.timezone import now
+
+from borrowings_service.models import Borrowing
+from borrowings_service.summary import bump_borrowings_version, record_outstanding
+from library_service.metrics import track_external
+from payment_service.models import Payment, StripeEvent
+
+PAID_SESSION_EVENTS = {
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+}
+
+RETRYABLE_STRIPE_ERRORS = (
+    stripe.APIConnectionError,
+    stripe.RateLimitError,
+    stripe.APIError,
+)
+
+
+def line_item(payment: Payment) -> dict:
+    product_prefix = "Fine" if payment.type == Payment.TypeChoices.FINE else "Borrowed"
+    return {
+        "price_data": {
+            "currency": "USD",
+            "product_data": {
+                "name": f"{product_prefix}: {payment.borrowing.book.title}"
+            },
+            "unit_amount": int(payment.money_to_pay * 100),
+        },
+        "quantity": 1,
+    }
+
+
+def open_checkout_session(payments: list[Payment], idempotency_key: str, metadata):
+    """Create one Stripe checkout session paying all payments, idempotency
+    key makes retries return the already created session"""
+    with track_external("stripe"):
+        return stripe.checkout.Session.create(
+            api_key=settings.STRIPE_SECRET_KEY,
+            idempotency_key=idempotency_key,
+            line_items=[line_item(payment) for payment in payments],
+            mode="payment",
+            success_url="http://127.0.0.1:8000/api/library/payment/success/"
+            "?session_id={CHECKOUT_SESSION_ID}",
+            cancel_url="http://127.0.0.1:8000/api/library/payment/cancel/",
+            metadata=metadata,
+        )
+
+
+def create_stripe_session(payment: Payment):
+    return open_checkout_session(
+        [payment],
+        f"payment-{payment.id}-checkout-session",
+        {"payment_id": payment.id},
+    )
+
+
+def create_combined_stripe_session(payments: list[Payment]):
+    payment_ids = ",".join(str(payment.id) for payment in payments)
+    return open_checkout_session(
+        payments,
+        f"payments-{payment_ids}-checkout-session",
+        {"payment_ids": payment_ids},
+    )
+
+
+def start_checkout(task, payments: list[Payment], create_session):
+    """Open session for payments and store it on all of them, Stripe
+    outages are retried with exponential backoff"""
+    queryset = Payment.objects.filter(id__in=[payment.id for payment in payments])
+
+    def update(**fields):
+        queryset.update(**fields)
+        # session fields are shown on payment and borrowing pages
+        bump_borrowings_version({payment.borrowing.user_id for payment in payments})
+
+    try:
+        session = create_session(payments)
+    except RETRYABLE_STRIPE_ERRORS as exc:
+        if task.request.retries < task.max_retries:
+            raise task.retry(exc=exc, countdown=2**task.request.retries * 10)
+        update(session_status=Payment.SessionStatusChoices.FAILED)
+        raise
+    except stripe.StripeError:
+        update(session_status=Payment.SessionStatusChoices.FAILED)
+        raise
+
+    update(
+        session_id=session.id,
+        session_url=session.url,
+        session_status=Payment.SessionStatusChoices.CREATED,
+    )
+    return session.id
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=10)
+def create_checkout_session(self, payment_id: int):
+    payment = Payment.objects.select_related("borrowing__book").get(id=payment_id)
+    if payment.session_status != Payment.SessionStatusChoices.PENDING:
+        return payment.session_id
+    return start_checkout(
+        self, [payment], lambda payments: create_stripe_session(payments[0])
+    )
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=10)
+def create_combined_checkout_session(self, payment_ids: list[int]):
+    """One checkout session with a line item per payment, used when
+    several books are borrowed at once"""
+    payments = list(
+        Payment.objects.select_related("borrowing__book")
+        .filter(id__in=payment_ids)
+        .order_by("id")
+    )
+    if not payments:
+        return None
+    if all(
+        payment.session_status != Payment.SessionStatusChoices.PENDING
+        for payment in payments
+    ):
+        return payments[0].session_id
+    return start_checkout(self, payments, create_combined_stripe_session)
+
+
+def mark_sessions_paid(session_ids) -> int:
+    session_ids = list(session_ids)
+    if not session_ids:
+        return 0
+    with transaction.atomic():
+        paid = list(
+            Payment.objects.select_for_update(of=("self",))
+            .filter(session_id__in=session_ids, status=Payment.StatusChoices.PENDING)
+            .values_list("id", "borrowing__user_id", "money_to_pay")
+        )
+        updated = Payment.objects.filter(
+            id__in=[payment_id for payment_id, _, _ in paid]
+        ).update(status=Payment.StatusChoices.PAID)
+        record_outstanding((user_id, -amount) for _, user_id, amount in paid)
+    return updated
+
+
+def apply_stripe_events(events) -> int:
+    """Apply events that were not processed before, all status changes
+    are written with one UPDATE. Returns number of payments marked paid"""
+    events = {event["id"]: event for event in events}
+    with transaction.atomic():
+        processed = set(
+            StripeEvent.objects.filter(event_id__in=events).values_list(
+                "event_id", flat=True
+            )
+        )
+        new_events = [
+            event for event_id, event in events.items() if event_id not in processed
+        ]
+        StripeEvent.objects.bulk_create(
+            [
+                StripeEvent(event_id=event["id"], type=event["type"])
+                for event in new_events
+            ],
+            ignore_conflicts=True,
+        )
+        return mark_sessions_paid(
+            event["data"]["object"]["id"]
+            for event in new_events
+            if event["type"] in PAID_SESSION_EVENTS
+            and event["data"]["object"].get("payment_status") == "paid"
+        )
+
+
+def timed_pages(sessions):
+    """auto_paging_iter with every lazily fetched page timed as Stripe call"""
+    pages = sessions.auto_paging_iter()
+    while True:
+        with track_external("stripe"):
+            session = next(pages, None)
+        if session is None:
+            return
+        yield session
+
+
+@shared_task
+def reconcile_pending_payments():
+    """Catch payments whose webhook was lost: page through completed Stripe
+    sessions of the reconciliation window instead of retrieving pending
+    payments one by one"""
+    pending = Payment.objects.filter(
+        status=Payment.StatusChoices.PENDING,
+        session_status=Payment.SessionStatusChoices.CREATED,
+    )
+    if not pending.exists():
+        return 0
+
+    since = now() - settings.STRIPE_RECONCILE_WINDOW
+    with track_external("stripe"):
+        sessions = stripe.checkout.Session.list(
+            api_key=settings.STRIPE_SECRET_KEY,
+            created={"gte": int(since.timestamp())},
+            status="complete",
+            limit=100,
+        )
+    updated, paid = 0, []
+    for session in timed_pages(sessions):
+        if session.payment_status == "paid":
+            paid.append(session.id)
+        if len(paid) >= settings.STRIPE_RECONCILE_BATCH_SIZE:
+            updated += mark_sessions_paid(paid)
+            paid = []
+    return updated + mark_sessions_paid(paid)
+
+
+def calculate_fine(
+    expected_return_date: datetime.date,
+    actual_return_date: datetime.date | None,
+    daily_fee,
+    today: datetime.date,
+):
+    days_overdue = ((actual_return_date or today) - expected_return_date).days
+    return days_overdue * daily_fee * settings.FINE_MULTIPLIER
+
+
+def fine_candidates(today: datetime.date):
+    """Borrowings whose fine can differ from the stored one: still overdue,
+    or returned late and either without fine or returned recently"""
+    fines = Payment.objects.filter(
+        borrowing=OuterRef("pk"), type=Payment.TypeChoices.FINE
+    ).order_by("id")
+    recently = today - datetime.timedelta(days=settings.FINE_RECALCULATION_DAYS)
+    return (
+        Borrowing.objects.filter(
+            Borrowing.overdue_filter(today)
+            | Q(actual_return_date__gt=F("expected_return_date"))
+            & (~Exists(fines) | Q(actual_return_date__gte=recently))
+        )
+        .annotate(
+            fine_id=Subquery(fines.values("id")[:1]),
+            fine_amount=Subquery(fines.values("money_to_pay")[:1]),
+            fine_editable=Exists(
+                fines.filter(
+                    status=Payment.StatusChoices.PENDING, session_id__isnull=True
+                )
+            ),
+        )
+        .order_by("id")
+        .values_list(
+            "id",
+            "expected_return_date",
+            "actual_return_date",
+            "book__daily_fee",
+            "user_id",
+            "fine_id",
+            "fine_amount",
+            "fine_editable",
+        )
+    )
+
+
+def save_fines(
+    new_fines: list[Payment], changed_fines: list[Payment], outstanding: list
+):
+    """outstanding are (user id, amount change) pairs of the fines"""
+    with transaction.atomic():
+        Payment.objects.bulk_create(new_fines)
+        Payment.objects.bulk_update(changed_fines, ["money_to_pay"])
+        record_outstanding(outstanding)
+    for fine in new_fines + changed_fines:
+        if fine.borrowing.actual_return_date:
+            transaction.on_commit(
+                lambda fine_id=fine.id: create_checkout_session.delay(fine_id)
+            )
+
+
+@shared_task
+def generate_overdue_fines():
+    """Create or update FINE payments of overdue borrowings, only rows
+    whose fine amount changed are written. Checkout session is created
+    once the book is returned and the fine stops growing"""
+    today = now().date()
+    chunk_size = settings.FINE_CHUNK_SIZE
+    new_fines, changed_fines, outstanding = [], [], []
+    created = updated = 0
+
+    for (
+        borrowing_id,
+        expected_return_date,
+        actual_return_date,
+        daily_fee,
+        user_id,
+        fine_id,
+        fine_amount,
+        fine_editable,
+    ) in fine_candidates(today).iterator(chunk_size=chunk_size):
+        amount = calculate_fine(
+            expected_return_date, actual_return_date, daily_fee, today
+        )
+        borrowing = Borrowing(
+            id=borrowing_id,
+            expected_return_date=expected_return_date,
+            actual_return_date=actual_return_date,
+        )
+        if fine_id is None:
+            new_fines.append(
+                Payment(
+                    type=Payment.TypeChoices.FINE,
+                    borrowing=borrowing,
+                    money_to_pay=amount,
+                )
+            )
+            outstanding.append((user_id, amount))
+        elif fine_editable and fine_amount != amount:
+            changed_fines.append(
+                Payment(id=fine_id, borrowing=borrowing, money_to_pay=amount)
+            )
+            outstanding.append((user_id, amount - fine_amount))
+
+        if len(new_fines) + len(changed_fines) >= chunk_size:
+            save_fines(new_fines, changed_fines, outstanding)
+            created += len(new_fines)
+            updated += len(changed_fines)
+            new_fines, changed_fines, outstanding = [], [], []
+
+    save_fines(new_fines, changed_fines, outstanding)
+    return {
+        "created": created + len(new_fines),
+        "updated": updated + len(changed_fines),
+    }
@@ -1,18 +1,34 @@
 import datetime
+import hashlib
+import hmac
+import json
+import time
+from unittest.mock import patch
 
-from django.test import TestCase
+import stripe
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework.reverse import reverse
 
 from borrowings_service.tests import sample_user, sample_book, tomorrow, yesterday
 from borrowings_service.models import Borrowing
-from payment_service.models import Payment
+from payment_service.models import Payment, StripeEvent
 from payment_service.serializers import PaymentSerializer
+from payment_service.stripe_stand_in import StripeStandIn
+from payment_service.tasks import (
+    create_checkout_session,
+    generate_overdue_fines,
+    reconcile_pending_payments,
+)
 from payment_service.views import helper
 
-
 PAYMENT_LIST_URL = reverse("payment-service:payment-list")
+WEBHOOK_URL = reverse("payment-service:stripe-webhook")
+WEBHOOK_SECRET = "whsec_test"
 
 
 def detail_url(payment_id):
@@ -123,3 +139,295 @@ class AdminPaymentTests(TestCase):
         url = detail_url(payment.id)
         res = self.client.put(url, {})
         self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class CheckoutSessionTests(TestCase):
+
+    def setUp(self):
+        user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        self.borrowing = sample_borrowing(sample_book(), user)
+
+    def test_helper_create_pending_payment_without_stripe(self):
+        stand_in = StripeStandIn()
+        with stand_in.patch(), patch(
+            "payment_service.views.create_checkout_session.delay"
+        ) as mock_delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                payment = helper(self.borrowing)
+                mock_delay.assert_not_called()
+        mock_delay.assert_called_once_with(payment.id)
+        self.assertEqual(stand_in.calls, [])
+        self.assertEqual(payment.session_status, Payment.SessionStatusChoices.PENDING)
+        self.assertIsNone(payment.session_url)
+
+    def test_create_checkout_session(self):
+        payment = helper(self.borrowing)
+        stand_in = StripeStandIn()
+        with stand_in.patch():
+            session_id = create_checkout_session(payment.id)
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_id, session_id)
+        self.assertEqual(payment.session_status, Payment.SessionStatusChoices.CREATED)
+        self.assertTrue(payment.session_url)
+        unit_amount = stand_in.calls[0]["line_items"][0]["price_data"]["unit_amount"]
+        self.assertEqual(unit_amount, int(payment.money_to_pay * 100))
+
+    def test_create_checkout_session_only_once(self):
+        payment = helper(self.borrowing)
+        stand_in = StripeStandIn()
+        with stand_in.patch():
+            first = create_checkout_session(payment.id)
+            second = create_checkout_session(payment.id)
+        self.assertEqual(first, second)
+        self.assertEqual(len(stand_in.calls), 1)
+
+    def test_create_checkout_session_retry_keep_pending(self):
+        payment = helper(self.borrowing)
+        stand_in = StripeStandIn(failures=1)
+        with stand_in.patch():
+            with self.assertRaises(stripe.APIConnectionError):
+                create_checkout_session(payment.id)
+            payment.refresh_from_db()
+            self.assertEqual(
+                payment.session_status, Payment.SessionStatusChoices.PENDING
+            )
+            create_checkout_session(payment.id)
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_status, Payment.SessionStatusChoices.CREATED)
+
+    def test_create_checkout_session_auth_error_failed(self):
+        payment = helper(self.borrowing)
+        stand_in = StripeStandIn(failures=1, error=stripe.AuthenticationError)
+        with stand_in.patch():
+            with self.assertRaises(stripe.AuthenticationError):
+                create_checkout_session(payment.id)
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_status, Payment.SessionStatusChoices.FAILED)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class PaymentQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        self.client.force_authenticate(user=self.user)
+        book = sample_book()
+        for _ in range(12):
+            helper(sample_borrowing(book, self.user))
+
+    def count_queries(self, params):
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(PAYMENT_LIST_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return len(context)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        small_page = self.count_queries({"limit": 2})
+        large_page = self.count_queries({"limit": 12})
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, 2)
+
+    def test_cursor_pages_without_count_use_one_query(self):
+        res = self.client.get(PAYMENT_LIST_URL, {"limit": 5})
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(res.data["next"] + "&count=false")
+        self.assertEqual(len(context), 1)
+        ids = [payment["id"] for payment in res.data["results"]]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 5)
+
+
+class OverdueFineTests(TestCase):
+
+    def setUp(self):
+        self.user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        self.book = sample_book(daily_fee=1.5)
+
+    def overdue_borrowing(self, days, actual_return_date=None):
+        borrowing = sample_borrowing(self.book, self.user)
+        Borrowing.objects.filter(id=borrowing.id).update(
+            expected_return_date=datetime.date.today() - datetime.timedelta(days=days),
+            actual_return_date=actual_return_date,
+        )
+        return borrowing
+
+    def test_generate_fines_for_overdue_borrowings(self):
+        borrowing = self.overdue_borrowing(3)
+        sample_borrowing(self.book, self.user)
+
+        result = generate_overdue_fines()
+        self.assertEqual(result, {"created": 1, "updated": 0})
+        fine = Payment.objects.get(type=Payment.TypeChoices.FINE)
+        self.assertEqual(fine.borrowing_id, borrowing.id)
+        self.assertEqual(fine.money_to_pay, 3 * self.book.daily_fee * 2)
+
+    def test_generate_fines_rerun_touch_only_changed(self):
+        first = self.overdue_borrowing(3)
+        self.overdue_borrowing(5)
+        generate_overdue_fines()
+        self.assertEqual(generate_overdue_fines(), {"created": 0, "updated": 0})
+
+        Borrowing.objects.filter(id=first.id).update(
+            expected_return_date=datetime.date.today() - datetime.timedelta(days=4)
+        )
+        self.assertEqual(generate_overdue_fines(), {"created": 0, "updated": 1})
+        fine = Payment.objects.get(borrowing=first, type=Payment.TypeChoices.FINE)
+        self.assertEqual(fine.money_to_pay, 4 * self.book.daily_fee * 2)
+
+    def test_generate_fines_do_not_change_paid_fines(self):
+        borrowing = self.overdue_borrowing(3)
+        generate_overdue_fines()
+        Payment.objects.filter(borrowing=borrowing).update(
+            status=Payment.StatusChoices.PAID
+        )
+        Borrowing.objects.filter(id=borrowing.id).update(
+            expected_return_date=datetime.date.today() - datetime.timedelta(days=6)
+        )
+        self.assertEqual(generate_overdue_fines(), {"created": 0, "updated": 0})
+
+    def test_returned_late_fine_get_checkout_session(self):
+        self.overdue_borrowing(3, actual_return_date=datetime.date.today())
+        with patch("payment_service.tasks.create_checkout_session.delay") as mock_delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                generate_overdue_fines()
+        fine = Payment.objects.get(type=Payment.TypeChoices.FINE)
+        mock_delay.assert_called_once_with(fine.id)
+        self.assertEqual(fine.money_to_pay, 3 * self.book.daily_fee * 2)
+
+    def test_generate_fines_query_count_independent_of_rows(self):
+        for days in range(1, 11):
+            self.overdue_borrowing(days)
+        with CaptureQueriesContext(connection) as context:
+            generate_overdue_fines()
+        # one of them locks the users without summary, see record_outstanding
+        self.assertLessEqual(len(context), 6)
+
+
+def stripe_event(session_id, event_id="evt_1", payment_status="paid"):
+    return {
+        "id": event_id,
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {
+            "object": {
+                "id": session_id,
+                "object": "checkout.session",
+                "payment_status": payment_status,
+            }
+        },
+    }
+
+
+def signature(payload, secret=WEBHOOK_SECRET):
+    timestamp = int(time.time())
+    digest = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(TestCase):
+
+    def setUp(self):
+        user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        self.payment = helper(sample_borrowing(sample_book(), user))
+        self.stand_in = StripeStandIn()
+        with self.stand_in.patch():
+            self.session_id = create_checkout_session(self.payment.id)
+
+    def post_event(self, event, secret=WEBHOOK_SECRET):
+        payload = json.dumps(event)
+        return self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature(payload, secret),
+        )
+
+    def test_completed_session_mark_payment_paid(self):
+        res = self.post_event(stripe_event(self.session_id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.StatusChoices.PAID)
+
+    def test_unpaid_completed_session_keep_pending(self):
+        self.post_event(stripe_event(self.session_id, payment_status="unpaid"))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.StatusChoices.PENDING)
+
+    def test_invalid_signature_rejected(self):
+        res = self.post_event(stripe_event(self.session_id), secret="whsec_other")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.StatusChoices.PENDING)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_webhook_without_secret_unavailable(self):
+        res = self.post_event(stripe_event(self.session_id))
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.StatusChoices.PENDING)
+
+    def test_redelivered_event_applied_once(self):
+        event = stripe_event(self.session_id)
+        self.post_event(event)
+        with CaptureQueriesContext(connection) as context:
+            res = self.post_event(event)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(
+            any(query["sql"].startswith("UPDATE") for query in context.captured_queries)
+        )
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+
+class ReconcilePaymentsTests(TestCase):
+
+    def setUp(self):
+        user = sample_user(
+            email="user@gmail.com",
+            password="<PASSWORD>",
+        )
+        book = sample_book()
+        self.stand_in = StripeStandIn()
+        self.payments = [helper(sample_borrowing(book, user)) for _ in range(3)]
+        with self.stand_in.patch():
+            for payment in self.payments:
+                create_checkout_session(payment.id)
+
+    def test_reconcile_mark_paid_sessions(self):
+        paid = list(self.stand_in.sessions.values())[:2]
+        for session in paid:
+            self.stand_in.complete(session)
+        with self.stand_in.patch():
+            self.assertEqual(reconcile_pending_payments(), 2)
+            self.assertEqual(reconcile_pending_payments(), 0)
+        self.assertEqual(
+            set(
+                Payment.objects.filter(status=Payment.StatusChoices.PAID).values_list(
+                    "session_id", flat=True
+                )
+            ),
+            {session.id for session in paid},
+        )
+
+    def test_reconcile_skip_stripe_without_pending_payments(self):
+        Payment.objects.update(status=Payment.StatusChoices.PAID)
+        calls = len(self.stand_in.calls)
+        with self.stand_in.patch():
+            self.assertEqual(reconcile_pending_payments(), 0)
+        self.assertEqual(len(self.stand_in.calls), calls)
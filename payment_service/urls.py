@@ -1,12 +1,20 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from payment_service.views import PaymentViewSet
+from payment_service.views import (
+    PaymentViewSet,
+    payment_cancel,
+    payment_success,
+    stripe_webhook,
+)
 
 router = routers.DefaultRouter()
 router.register("payments", PaymentViewSet)
 
 urlpatterns = [
+    path("payments/webhook/", stripe_webhook, name="stripe-webhook"),
+    path("payment/success/", payment_success, name="payment-success"),
+    path("payment/cancel/", payment_cancel, name="payment-cancel"),
     path("", include(router.urls)),
 ]
 
@@ -1,20 +1,49 @@
+import logging
+
 import stripe
-from rest_framework import viewsets, mixins, permissions
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import viewsets, mixins, permissions, status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
 
+from borrowings_service.summary import borrowings_version_keys
+from library_service.conditional import ConditionalGetMixin
+from library_service.metrics import track_external
+from library_service.pagination import KeysetPagination
 from payment_service.models import Payment
 from borrowings_service.models import Borrowing
 from payment_service.serializers import PaymentSerializer
+from payment_service.tasks import (
+    apply_stripe_events,
+    create_checkout_session,
+    create_combined_checkout_session,
+    mark_sessions_paid,
+)
 from library_service.settings import STRIPE_SECRET_KEY
 
 stripe.api_key = STRIPE_SECRET_KEY
 
+logger = logging.getLogger(__name__)
+
 
 class PaymentViewSet(
-    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    ConditionalGetMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
 ):
     queryset = Payment.objects.select_related("borrowing")
     serializer_class = PaymentSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = KeysetPagination
+    keyset_ordering = ("id",)
+
+    def get_version_keys(self):
+        return borrowings_version_keys(self.request.user)
 
     def get_queryset(self):
         queryset = self.queryset
@@ -25,33 +54,85 @@ class PaymentViewSet(
             return queryset.filter(borrowing__user=self.request.user)
 
 
+def borrowing_fee(borrowing: Borrowing):
+    duration_of_borrowing = borrowing.expected_return_date - borrowing.borrow_date
+    return duration_of_borrowing.days * borrowing.book.daily_fee
+
+
 def helper(borrowing: Borrowing) -> Payment:
-    try:
-        product_name = f"Borrowed: {borrowing.book.title}"
-        duration_of_borrowing = borrowing.expected_return_date - borrowing.borrow_date
-        daily_fee = borrowing.book.daily_fee
-        amount = 100 * duration_of_borrowing.days * daily_fee
-        session = stripe.checkout.Session.create(
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": "USD",
-                        "product_data": {"name": product_name},
-                        "unit_amount": int(amount),
-                    },
-                    "quantity": 1,
-                }
-            ],
-            mode="payment",
-            success_url="http://127.0.0.1:8000/api/library/payment/success/",
-            cancel_url="http://127.0.0.1:8000/api/library/payment/cancel/",
-        )
-        return Payment.objects.create(
-            type="PAYMENT",
+    """Create pending payment for borrowing, Stripe checkout session is
+    created by celery worker after the borrowing transaction commits"""
+    payment = Payment.objects.create(
+        type=Payment.TypeChoices.PAYMENT,
+        borrowing=borrowing,
+        money_to_pay=borrowing_fee(borrowing),
+    )
+    transaction.on_commit(lambda: create_checkout_session.delay(payment.id))
+    return payment
+
+
+def create_payments(borrowings: list[Borrowing]) -> list[Payment]:
+    """Pending payments of borrowings taken together, they are paid with
+    one combined checkout session created after commit"""
+    payments = Payment.objects.bulk_create(
+        Payment(
+            type=Payment.TypeChoices.PAYMENT,
             borrowing=borrowing,
-            session_url=session.url,
-            session_id=session.id,
-            money_to_pay=amount / 100,
+            money_to_pay=borrowing_fee(borrowing),
         )
-    except Exception as e:
-        raise e
+        for borrowing in borrowings
+    )
+    payment_ids = [payment.id for payment in payments]
+    transaction.on_commit(lambda: create_combined_checkout_session.delay(payment_ids))
+    return payments
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        # Stripe retries deliveries for three days, reconcile_pending_payments
+        # picks up payments meanwhile
+        logger.error("Stripe webhook called but STRIPE_WEBHOOK_SECRET is not set")
+        return JsonResponse({"error": "webhook is not configured"}, status=503)
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body,
+            request.headers.get("Stripe-Signature", ""),
+            settings.STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.SignatureVerificationError):
+        logger.warning("Stripe webhook with invalid payload or signature")
+        return JsonResponse({"error": "invalid payload or signature"}, status=400)
+
+    apply_stripe_events([event])
+    return JsonResponse({"ok": True})
+
+
+@api_view(["GET"])
+def payment_success(request):
+    session_id = request.query_params.get("session_id")
+    if session_id:
+        try:
+            with track_external("stripe"):
+                session = stripe.checkout.Session.retrieve(session_id)
+        except stripe.StripeError:
+            logger.exception("Failed to retrieve Stripe session %s", session_id)
+        else:
+            if session.payment_status == "paid":
+                mark_sessions_paid([session.id])
+    return Response(
+        {"detail": "Thank you, your payment was successful"},
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(["GET"])
+def payment_cancel(request):
+    return Response(
+        {
+            "detail": "Payment was cancelled, you can pay later using "
+            "session_url of your payment (session is available for 24 hours)"
+        },
+        status=status.HTTP_200_OK,
+    )
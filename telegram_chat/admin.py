@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from telegram_chat.models import TelegramUser
+from telegram_chat.models import TelegramUser, OutboxMessage
 
 
 admin.site.register(TelegramUser)
+admin.site.register(OutboxMessage)
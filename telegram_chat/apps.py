@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TelegramChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "telegram_chat"
+
+    def ready(self):
+        from library_service.metrics import registry
+        from telegram_chat.client import prometheus_metrics
+
+        registry.register_collector(prometheus_metrics)
@@ -1,4 +1,3 @@
-from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from rest_framework.reverse import reverse
 from telegram import Update
@@ -33,10 +32,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-@sync_to_async
-def create_or_update_telegram_user(chat_id: int, user_id: int):
-    user = get_user_model().objects.get(id=user_id)
-    return TelegramUser.objects.update_or_create(
+async def create_or_update_telegram_user(chat_id: int, user_id: int):
+    user = await get_user_model().objects.aget(id=user_id)
+    return await TelegramUser.objects.aupdate_or_create(
         chat_id=chat_id, defaults={"user": user}
     )
 
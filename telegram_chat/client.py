@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from library_service.metrics import Counter, track_external
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Reserves send slots so calls stay under Telegram limits: about 30
+    messages per second overall, one per second in a private chat and 20
+    per minute in a group (negative chat id). reserve() only computes the
+    delay and never sleeps"""
+
+    max_tracked_chats = 10_000
+
+    def __init__(
+        self,
+        global_interval: float,
+        chat_interval: float,
+        group_interval: float,
+        clock=time.monotonic,
+    ):
+        self.global_interval = global_interval
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._global_next = 0.0
+        self._chat_next = {}
+
+    def interval(self, chat_id) -> float:
+        if str(chat_id).startswith("-"):
+            return self.group_interval
+        return self.chat_interval
+
+    def reserve(self, chat_id=None) -> float:
+        """Take the next free slot, returns seconds to wait for it"""
+        with self._lock:
+            current = self.clock()
+            if len(self._chat_next) > self.max_tracked_chats:
+                self._chat_next = {
+                    key: value
+                    for key, value in self._chat_next.items()
+                    if value > current
+                }
+            slot = max(current, self._global_next)
+            # a chat waiting for its own interval does not hold back others
+            self._global_next = slot + self.global_interval
+            if chat_id is not None:
+                chat_id = str(chat_id)
+                slot = max(slot, self._chat_next.get(chat_id, 0.0))
+                self._chat_next[chat_id] = slot + self.interval(chat_id)
+            return slot - current
+
+    def block(self, seconds: float, chat_id=None) -> None:
+        """Apply retry_after of 429 response to the chat or to all calls"""
+        with self._lock:
+            until = self.clock() + seconds
+            if chat_id is None:
+                self._global_next = max(self._global_next, until)
+            else:
+                chat_id = str(chat_id)
+                self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), until)
+
+
+class ClientMetrics:
+    """In-process counters of Telegram API calls per method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = defaultdict(self.empty)
+
+    @staticmethod
+    def empty():
+        return {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "latency_seconds_sum": 0.0,
+            "latency_seconds_max": 0.0,
+            "wait_seconds_sum": 0.0,
+        }
+
+    def increment(self, method: str, counter: str, value=1) -> None:
+        with self._lock:
+            self._methods[method][counter] += value
+
+    def observe_latency(self, method: str, seconds: float) -> None:
+        with self._lock:
+            values = self._methods[method]
+            values["latency_seconds_sum"] += seconds
+            values["latency_seconds_max"] = max(values["latency_seconds_max"], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {method: dict(values) for method, values in self._methods.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._methods.clear()
+
+
+metrics = ClientMetrics()
+
+PROMETHEUS_COUNTERS = {
+    "requests": "Telegram API calls",
+    "errors": "Failed Telegram API calls",
+    "retries": "Telegram API calls retried after 429",
+    "rate_limited": "Telegram API answers with 429",
+    "latency_seconds_sum": "Time spent in Telegram API calls",
+    "wait_seconds_sum": "Time spent waiting for rate limiter",
+}
+
+
+def prometheus_metrics() -> list[Counter]:
+    """Client counters as metrics for library_service.metrics registry"""
+    snapshot = metrics.snapshot()
+    counters = []
+    for name, documentation in PROMETHEUS_COUNTERS.items():
+        counter = Counter(
+            f"telegram_api_{name.removesuffix('_sum')}",
+            documentation,
+            labels=("method",),
+        )
+        for method, values in snapshot.items():
+            counter.inc(values[name], method=method)
+        counters.append(counter)
+    return counters
+
+
+def retry_after(response) -> float | None:
+    """Seconds Telegram asked to wait"""
+    if response.status_code != 429:
+        return None
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return 1.0
+
+
+class TelegramClient:
+    """Bot API client reusing keep-alive connections of one pooled session"""
+
+    def __init__(
+        self,
+        api_url: str,
+        limiter: RateLimiter,
+        max_retries: int = 3,
+        timeout: float = 5,
+        pool_size: int = 10,
+        sleep=time.sleep,
+    ):
+        self.api_url = api_url
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.timeout = timeout
+        self.sleep = sleep
+        self.session = requests.Session()
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        )
+
+    def should_retry(self, method, response, attempt, chat_id) -> float | None:
+        """Register the answer, returns delay before next attempt or None"""
+        self.metrics.increment(method, "requests")
+        delay = retry_after(response)
+        if delay is not None:
+            self.metrics.increment(method, "rate_limited")
+            self.limiter.block(delay, chat_id)
+            if (
+                attempt < self.max_retries
+                and delay <= settings.TELEGRAM_MAX_RETRY_AFTER
+            ):
+                self.metrics.increment(method, "retries")
+                logger.warning("Telegram %s rate limited for %s s", method, delay)
+                return delay
+        if response.status_code >= 400:
+            self.metrics.increment(method, "errors")
+        return None
+
+    @staticmethod
+    def message_payload(chat_id, text: str, parse_mode: str) -> dict:
+        return {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
+
+    def wait(self, method: str, chat_id) -> None:
+        delay = self.limiter.reserve(chat_id)
+        if delay > 0:
+            self.metrics.increment(method, "wait_seconds_sum", delay)
+            self.sleep(delay)
+
+    def call(self, method: str, payload=None, chat_id=None) -> requests.Response:
+        attempt = 0
+        while True:
+            self.wait(method, chat_id)
+            started = time.perf_counter()
+            try:
+                with track_external("telegram"):
+                    response = self.session.post(
+                        self.api_url + method, data=payload, timeout=self.timeout
+                    )
+            except requests.RequestException:
+                self.metrics.increment(method, "errors")
+                raise
+            finally:
+                self.metrics.observe_latency(method, time.perf_counter() - started)
+
+            delay = self.should_retry(method, response, attempt, chat_id)
+            if delay is None:
+                return response
+            attempt += 1
+
+    def send_message(self, chat_id, text: str, parse_mode: str = "HTML"):
+        return self.call(
+            "sendMessage", self.message_payload(chat_id, text, parse_mode), chat_id
+        )
+
+
+@lru_cache
+def get_rate_limiter() -> RateLimiter:
+    return RateLimiter(
+        global_interval=1 / settings.TELEGRAM_GLOBAL_RATE,
+        chat_interval=settings.TELEGRAM_CHAT_INTERVAL,
+        group_interval=settings.TELEGRAM_GROUP_INTERVAL,
+    )
+
+
+def client_options() -> dict:
+    return {
+        "api_url": settings.TELEGRAM_API_URL,
+        "limiter": get_rate_limiter(),
+        "max_retries": settings.TELEGRAM_MAX_RETRIES,
+        "timeout": settings.TELEGRAM_API_TIMEOUT,
+        "pool_size": settings.TELEGRAM_POOL_SIZE,
+    }
+
+
+@lru_cache
+def get_client() -> TelegramClient:
+    return TelegramClient(**client_options())
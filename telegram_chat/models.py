@@ -12,3 +12,21 @@ class TelegramUser(models.Model):
         on_delete=models.SET_NULL,
         related_name="telegram",
     )
+
+
+class OutboxMessage(models.Model):
+    """Telegram message waiting to be delivered by the outbox dispatcher."""
+
+    chat_id = models.CharField(max_length=64)
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["sent_at", "id"])]
+
+    def __str__(self):
+        return f"To {self.chat_id}: {self.text[:50]}"
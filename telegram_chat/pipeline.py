@@ -0,0 +1,141 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from telegram import Update
+
+from telegram_chat.bot import application
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatePipeline:
+    """Webhook updates are acknowledged at once and handled by a worker
+    draining an asyncio.Queue with bounded concurrency. The worker lives in
+    the loop of the ASGI server, started at lifespan startup. Without it
+    (WSGI, test client) every request runs in its own loop, so updates are
+    handled inline"""
+
+    def __init__(
+        self,
+        bot_application,
+        concurrency: int,
+        queue_size: int,
+        dedupe_timeout: int,
+    ):
+        self.application = bot_application
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.dedupe_timeout = dedupe_timeout
+        self.queue = None
+        self.worker = None
+        self.loop = None
+        self.tasks = set()
+
+    @property
+    def running(self) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return self.worker is not None and self.loop is loop
+
+    async def ensure_initialized(self) -> None:
+        if not self.application._initialized:
+            await self.application.initialize()
+
+    async def start(self) -> None:
+        try:
+            await self.ensure_initialized()
+        except Exception:
+            # Telegram may be unreachable at startup, the worker retries
+            # initialization before processing the first update
+            logger.exception("Failed to initialize telegram application")
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.worker = asyncio.create_task(self.work())
+
+    async def stop(self, timeout: float = 10) -> None:
+        if self.worker is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Telegram pipeline stopped with %s queued updates", self.queue.qsize()
+            )
+        self.worker.cancel()
+        for task in [self.worker, *self.tasks]:
+            task.cancel()
+        await asyncio.gather(self.worker, *self.tasks, return_exceptions=True)
+        self.worker = self.queue = self.loop = None
+        if self.application._initialized:
+            await self.application.shutdown()
+
+    async def work(self) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        def done(task):
+            self.tasks.discard(task)
+            semaphore.release()
+            self.queue.task_done()
+
+        while True:
+            # updates wait in the queue, not in the worker, so a busy
+            # worker makes the queue fill up and push back on Telegram
+            await semaphore.acquire()
+            data = await self.queue.get()
+            task = asyncio.create_task(self.process(data))
+            self.tasks.add(task)
+            task.add_done_callback(done)
+
+    async def process(self, data: dict) -> bool:
+        """Returns False when the update failed and was only logged"""
+        try:
+            await self.ensure_initialized()
+            update = Update.de_json(data, self.application.bot)
+            await self.application.process_update(update)
+        except Exception:
+            logger.exception("Failed to process telegram update %s", data)
+            return False
+        return True
+
+    @staticmethod
+    def dedupe_key(update_id) -> str:
+        return f"telegram:update:{update_id}"
+
+    async def submit(self, data: dict) -> bool:
+        """Accept update, returns False when the queue is full (or inline
+        processing failed) so Telegram redelivers it later. Redelivered
+        update ids are ignored"""
+        update_id = data.get("update_id")
+        if update_id is not None and not await cache.aadd(
+            self.dedupe_key(update_id), True, timeout=self.dedupe_timeout
+        ):
+            logger.info("Duplicate telegram update %s ignored", update_id)
+            return True
+
+        if not self.running:
+            if await self.process(data):
+                return True
+            if update_id is not None:
+                await cache.adelete(self.dedupe_key(update_id))
+            return False
+
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            if update_id is not None:
+                await cache.adelete(self.dedupe_key(update_id))
+            logger.warning("Telegram update queue is full")
+            return False
+        return True
+
+
+pipeline = UpdatePipeline(
+    application,
+    concurrency=settings.TELEGRAM_UPDATE_CONCURRENCY,
+    queue_size=settings.TELEGRAM_UPDATE_QUEUE_SIZE,
+    dedupe_timeout=settings.TELEGRAM_UPDATE_DEDUPE_TIMEOUT,
+)
@@ -0,0 +1,133 @@
+import logging
+from collections import defaultdict
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from library_service.database import write_transaction
+from telegram_chat.models import OutboxMessage
+from telegram_chat.views import send_private_message
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+MESSAGE_SEPARATOR = "\n\n"
+
+
+def queue_message(message: str, chat_id) -> OutboxMessage | None:
+    """Store message in the outbox, it is sent after the current transaction
+    commits so callers never wait for Telegram"""
+    if not chat_id:
+        logger.warning("Telegram chat id is not set, message dropped")
+        return None
+    outbox_message = OutboxMessage.objects.create(chat_id=str(chat_id), text=message)
+    transaction.on_commit(dispatch_outbox.delay)
+    return outbox_message
+
+
+def queue_messages(messages: list[tuple[int | str, str]]) -> int:
+    """Store many (chat_id, text) pairs with one query and start a
+    dispatcher for them"""
+    outbox_messages = OutboxMessage.objects.bulk_create(
+        OutboxMessage(chat_id=str(chat_id), text=text)
+        for chat_id, text in messages
+        if chat_id
+    )
+    if outbox_messages:
+        transaction.on_commit(dispatch_outbox.delay)
+    return len(outbox_messages)
+
+
+def split_message(lines: list[str]) -> list[str]:
+    """Join lines into texts that fit into one Telegram message"""
+    texts, text = [], ""
+    for line in lines:
+        line = line[:TELEGRAM_MESSAGE_LIMIT]
+        if text and len(text) + len(line) + 1 > TELEGRAM_MESSAGE_LIMIT:
+            texts.append(text)
+            text = line
+        else:
+            text = f"{text}\n{line}" if text else line
+    if text:
+        texts.append(text)
+    return texts
+
+
+def queue_message_to_chat(message: str) -> OutboxMessage | None:
+    return queue_message(message, settings.BASE_CHAT_ID)
+
+
+def queue_private_message(message: str, chat_id: int) -> OutboxMessage | None:
+    return queue_message(message, chat_id)
+
+
+def coalesce_messages(messages: list[OutboxMessage]) -> list[tuple[str, list[int]]]:
+    """Join texts of one chat into as few Telegram messages as possible,
+    returns (text, outbox ids) pairs"""
+    batches = []
+    text, ids = "", []
+    for message in messages:
+        candidate = f"{text}{MESSAGE_SEPARATOR}{message.text}" if text else message.text
+        if text and len(candidate) > TELEGRAM_MESSAGE_LIMIT:
+            batches.append((text, ids))
+            text, ids = message.text, [message.id]
+        else:
+            text = candidate
+            ids.append(message.id)
+    if text:
+        batches.append((text, ids))
+    return batches
+
+
+def claim_outbox_messages(batch_size: int) -> list[OutboxMessage]:
+    """Mark a batch of pending messages as taken by this worker, so
+    concurrent dispatchers never send the same row twice"""
+    stale = now() - settings.TELEGRAM_OUTBOX_CLAIM_TIMEOUT
+    # reads before it writes, on SQLite it has to wait for the write lock
+    with write_transaction():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale),
+                sent_at__isnull=True,
+                attempts__lt=settings.TELEGRAM_OUTBOX_MAX_ATTEMPTS,
+            )
+            .order_by("id")[:batch_size]
+        )
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages]).update(
+            claimed_at=now(), attempts=F("attempts") + 1
+        )
+    return messages
+
+
+def flush_outbox(batch_size: int | None = None) -> int:
+    """Send pending outbox messages grouped by chat, returns number of
+    delivered outbox rows"""
+    messages = claim_outbox_messages(batch_size or settings.TELEGRAM_OUTBOX_BATCH_SIZE)
+    by_chat = defaultdict(list)
+    for message in messages:
+        by_chat[message.chat_id].append(message)
+
+    sent_ids, failed_ids = [], []
+    for chat_id, chat_messages in by_chat.items():
+        for text, ids in coalesce_messages(chat_messages):
+            try:
+                res = send_private_message(text, chat_id)
+                res.raise_for_status()
+            except Exception:
+                logger.exception("Failed to send outbox messages to %s", chat_id)
+                failed_ids.extend(ids)
+            else:
+                sent_ids.extend(ids)
+
+    OutboxMessage.objects.filter(id__in=sent_ids).update(sent_at=now())
+    OutboxMessage.objects.filter(id__in=failed_ids).update(claimed_at=None)
+    return len(sent_ids)
+
+
+@shared_task
+def dispatch_outbox():
+    return flush_outbox()
@@ -0,0 +1,25 @@
+import time
+from unittest.mock import patch
+
+import requests
+
+
+class TelegramStandIn:
+    """Local replacement of Telegram Bot API calls for tests and
+    benchmarks, answers every call with ok after optional latency"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = []
+
+    def call(self, method: str, payload=None, chat_id=None):
+        self.calls.append((method, payload))
+        if self.latency:
+            time.sleep(self.latency)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"ok": true, "result": {}}'
+        return response
+
+    def patch(self):
+        return patch("telegram_chat.client.TelegramClient.call", side_effect=self.call)
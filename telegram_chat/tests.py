@@ -1,14 +1,31 @@
+import asyncio
 import json
-from unittest.mock import patch
+from unittest.mock import AsyncMock, Mock, patch
+
+import requests
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 from telegram import Update
 
 from library_service.settings import BASE_CHAT_ID
 from telegram_chat.bot import application
+from telegram_chat.client import (
+    RateLimiter,
+    TelegramClient,
+    metrics,
+)
+from library_service.lifespan import LifespanMiddleware
+from telegram_chat.models import OutboxMessage
+from telegram_chat.pipeline import UpdatePipeline
+from telegram_chat.tasks import (
+    flush_outbox,
+    queue_message_to_chat,
+    queue_private_message,
+)
 from telegram_chat.views import send_message_to_chat, send_private_message
 
 GETPOST_URL = reverse("telegram-chat:telegram_bot")
@@ -18,6 +35,7 @@ TELEGRAM_LINK_URL = reverse("telegram-chat:telegram_links")
 class TelegramWebhookTest(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.mock_update = {
             "update_id": 123456789,
@@ -51,6 +69,42 @@ class TelegramWebhookTest(TestCase):
         mock_process_update.assert_awaited_once_with(expected_update)
         mock_initialize.assert_awaited()
 
+    @patch("telegram_chat.views.application.process_update")
+    @patch("telegram_chat.views.application.initialize")
+    def test_telegram_webhook_redelivery_ignored(
+        self, mock_initialize, mock_process_update
+    ):
+        for _ in range(2):
+            res = self.client.post(
+                GETPOST_URL,
+                data=json.dumps(self.mock_update),
+                content_type="application/json",
+            )
+            self.assertEqual(res.json(), {"ok": True})
+        mock_process_update.assert_awaited_once()
+
+    @patch("telegram_chat.views.application.process_update")
+    @patch("telegram_chat.views.application.initialize")
+    def test_telegram_webhook_failed_update_redelivered(
+        self, mock_initialize, mock_process_update
+    ):
+        mock_process_update.side_effect = [RuntimeError("handler failed"), None]
+        for expected in (503, 200):
+            res = self.client.post(
+                GETPOST_URL,
+                data=json.dumps(self.mock_update),
+                content_type="application/json",
+            )
+            self.assertEqual(res.status_code, expected)
+        self.assertEqual(mock_process_update.await_count, 2)
+
+    def test_telegram_webhook_body_not_an_object(self):
+        for body in ("[]", "1", "not json"):
+            res = self.client.post(
+                GETPOST_URL, data=body, content_type="application/json"
+            )
+            self.assertEqual(res.status_code, 400)
+
     def test_telegram_webhook_get(self):
 
         res = self.client.get(GETPOST_URL)
@@ -101,3 +155,275 @@ class TestTelegramLinkPrivate(TestCase):
             "Send command to private chat with bot to get  personal notification",
             res.data,
         )
+
+
+@override_settings(BASE_CHAT_ID="-100123")
+class TestNotificationOutbox(TestCase):
+
+    @patch("telegram_chat.tasks.dispatch_outbox.delay")
+    def test_queue_message_dispatch_after_commit(self, mock_delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_message_to_chat("hello")
+            mock_delay.assert_not_called()
+        mock_delay.assert_called_once()
+        self.assertEqual(OutboxMessage.objects.get().chat_id, "-100123")
+
+    @override_settings(BASE_CHAT_ID=None)
+    def test_queue_message_without_chat_id(self):
+        self.assertIsNone(queue_message_to_chat("hello"))
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    @patch("telegram_chat.tasks.send_private_message")
+    def test_flush_outbox_coalesce_messages_per_chat(self, mock_send):
+        queue_message_to_chat("first")
+        queue_message_to_chat("second")
+        queue_private_message("private", 42)
+
+        self.assertEqual(flush_outbox(), 3)
+        self.assertEqual(mock_send.call_count, 2)
+        texts = {call.args[1]: call.args[0] for call in mock_send.call_args_list}
+        self.assertEqual(texts["-100123"], "first\n\nsecond")
+        self.assertEqual(texts["42"], "private")
+        self.assertFalse(OutboxMessage.objects.filter(sent_at__isnull=True).exists())
+
+    @patch("telegram_chat.tasks.send_private_message")
+    def test_flush_outbox_split_long_messages(self, mock_send):
+        queue_message_to_chat("a" * 3000)
+        queue_message_to_chat("b" * 3000)
+
+        flush_outbox()
+        self.assertEqual(mock_send.call_count, 2)
+
+    @patch("telegram_chat.tasks.send_private_message")
+    def test_flush_outbox_keep_failed_messages(self, mock_send):
+        mock_send.side_effect = Exception("telegram is down")
+        queue_message_to_chat("hello")
+
+        self.assertEqual(flush_outbox(), 0)
+        message = OutboxMessage.objects.get()
+        self.assertIsNone(message.sent_at)
+        self.assertIsNone(message.claimed_at)
+        self.assertEqual(message.attempts, 1)
+
+        mock_send.side_effect = None
+        self.assertEqual(flush_outbox(), 1)
+
+
+def telegram_response(status_code=200, body=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body or {"ok": status_code == 200}).encode()
+    return response
+
+
+RATE_LIMITED = {"ok": False, "parameters": {"retry_after": 2}}
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(
+            global_interval=0.1, chat_interval=1, group_interval=3, clock=self.clock
+        )
+
+    def test_same_chat_waits_chat_interval(self):
+        self.assertEqual(self.limiter.reserve(42), 0)
+        self.assertAlmostEqual(self.limiter.reserve(42), 1)
+        self.assertAlmostEqual(self.limiter.reserve("-100"), 0.2)
+        self.assertAlmostEqual(self.limiter.reserve("-100"), 3.2)
+
+    def test_block_chat_after_retry_after(self):
+        self.limiter.block(5, 42)
+        self.assertAlmostEqual(self.limiter.reserve(42), 5)
+        self.assertAlmostEqual(self.limiter.reserve(7), 0.1)
+
+
+@override_settings(TELEGRAM_MAX_RETRY_AFTER=10)
+class TestTelegramClient(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.limiter = RateLimiter(
+            global_interval=0, chat_interval=0, group_interval=0, clock=FakeClock()
+        )
+        self.sleep = Mock()
+        self.client = TelegramClient(
+            "https://telegram.test/bot123/", self.limiter, sleep=self.sleep
+        )
+
+    def test_session_reused_between_messages(self):
+        with patch.object(
+            self.client.session, "post", return_value=telegram_response()
+        ) as mock_post:
+            self.client.send_message(42, "first")
+            self.client.send_message(42, "second")
+        self.assertEqual(mock_post.call_count, 2)
+        adapter = self.client.session.get_adapter("https://api.telegram.org/")
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertEqual(metrics.snapshot()["sendMessage"]["requests"], 2)
+
+    def test_rate_limited_call_retried_after_delay(self):
+        with patch.object(
+            self.client.session,
+            "post",
+            side_effect=[telegram_response(429, RATE_LIMITED), telegram_response()],
+        ):
+            res = self.client.send_message(42, "hello")
+        self.assertEqual(res.status_code, 200)
+        self.sleep.assert_called_once_with(2)
+        stats = metrics.snapshot()["sendMessage"]
+        self.assertEqual(stats["rate_limited"], 1)
+        self.assertEqual(stats["retries"], 1)
+        self.assertEqual(stats["errors"], 0)
+
+    def test_rate_limited_call_give_up_after_max_retries(self):
+        self.client.max_retries = 1
+        with patch.object(
+            self.client.session,
+            "post",
+            return_value=telegram_response(429, RATE_LIMITED),
+        ) as mock_post:
+            res = self.client.send_message(42, "hello")
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(metrics.snapshot()["sendMessage"]["errors"], 1)
+
+    @override_settings(TELEGRAM_MAX_RETRY_AFTER=1)
+    def test_long_retry_after_not_waited(self):
+        with patch.object(
+            self.client.session,
+            "post",
+            return_value=telegram_response(429, RATE_LIMITED),
+        ) as mock_post:
+            res = self.client.send_message(42, "hello")
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(mock_post.call_count, 1)
+        self.sleep.assert_not_called()
+
+
+def bot_application():
+    bot_application = Mock(_initialized=True)
+    bot_application.process_update = AsyncMock()
+    bot_application.shutdown = AsyncMock()
+    return bot_application
+
+
+@patch("telegram_chat.pipeline.Update.de_json", new=lambda data, bot: data)
+class TestUpdatePipeline(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.application = bot_application()
+
+    def pipeline(self, concurrency=2, queue_size=10):
+        return UpdatePipeline(
+            self.application,
+            concurrency=concurrency,
+            queue_size=queue_size,
+            dedupe_timeout=60,
+        )
+
+    def test_updates_processed_by_worker(self):
+        pipeline = self.pipeline()
+
+        async def run():
+            release = asyncio.Event()
+
+            async def process_update(update):
+                await release.wait()
+
+            self.application.process_update.side_effect = process_update
+            await pipeline.start()
+            # submit returns while handlers are still blocked
+            for update_id in (1, 2, 3, 2):
+                self.assertTrue(await pipeline.submit({"update_id": update_id}))
+            release.set()
+            await pipeline.stop()
+
+        asyncio.run(run())
+        processed = [
+            call.args[0]["update_id"]
+            for call in self.application.process_update.await_args_list
+        ]
+        self.assertEqual(sorted(processed), [1, 2, 3])
+        self.application.shutdown.assert_awaited_once()
+
+    def test_concurrency_is_bounded(self):
+        pipeline = self.pipeline(concurrency=2)
+        active, peak = 0, 0
+
+        async def process_update(update):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        self.application.process_update.side_effect = process_update
+
+        async def run():
+            await pipeline.start()
+            for update_id in range(6):
+                await pipeline.submit({"update_id": update_id})
+            await pipeline.stop()
+
+        asyncio.run(run())
+        self.assertEqual(self.application.process_update.await_count, 6)
+        self.assertEqual(peak, 2)
+
+    def test_full_queue_reject_update_for_redelivery(self):
+        pipeline = self.pipeline(concurrency=1, queue_size=1)
+
+        async def run():
+            release = asyncio.Event()
+
+            async def process_update(update):
+                await release.wait()
+
+            self.application.process_update.side_effect = process_update
+            await pipeline.start()
+            self.assertTrue(await pipeline.submit({"update_id": 1}))
+            await asyncio.sleep(0)
+            self.assertTrue(await pipeline.submit({"update_id": 2}))
+            self.assertFalse(await pipeline.submit({"update_id": 3}))
+            release.set()
+            await pipeline.queue.join()
+            self.assertTrue(await pipeline.submit({"update_id": 3}))
+            await pipeline.stop()
+
+        asyncio.run(run())
+        self.assertEqual(self.application.process_update.await_count, 3)
+
+
+class TestLifespanMiddleware(TestCase):
+
+    def test_startup_and_shutdown_handlers_called(self):
+        startup, shutdown = AsyncMock(), AsyncMock()
+        app = LifespanMiddleware(
+            AsyncMock(), on_startup=[startup], on_shutdown=[shutdown]
+        )
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        asyncio.run(app({"type": "lifespan"}, receive, send))
+        startup.assert_awaited_once()
+        shutdown.assert_awaited_once()
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
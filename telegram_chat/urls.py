@@ -5,6 +5,7 @@ from telegram_chat.views import (
     telegram_bot,
     get_telegram_link,
     delete_webhook,
+    client_metrics,
 )
 
 urlpatterns = [
@@ -12,6 +13,7 @@ urlpatterns = [
     path("getpost/", telegram_bot, name="telegram_bot"),
     path("links/", get_telegram_link, name="telegram_links"),
     path("delete/webhook/", delete_webhook, name="delete_webhook"),
+    path("metrics/", client_metrics, name="client_metrics"),
 ]
 
 app_name = "telegram-chat"
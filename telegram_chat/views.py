@@ -1,4 +1,3 @@
-import requests
 import json
 import logging
 
@@ -8,11 +7,9 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from telegram import Update
 from telegram.ext import CommandHandler, MessageHandler, filters
 
 from library_service.settings import (
-    TELEGRAM_API_URL,
     BASE_CHAT_ID,
     NGROK_URL,
     signer,
@@ -24,6 +21,8 @@ from telegram_chat.bot import (
     start_command,
     text_handler,
 )
+from telegram_chat.client import get_client, metrics
+from telegram_chat.pipeline import pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -33,29 +32,22 @@ if not application.handlers:
         MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler)
     )
 
-application_initialized = False
-
 
 @csrf_exempt
 async def telegram_bot(request):
-    global application_initialized
-    if request.method == "POST":
-        try:
-            data = json.loads(request.body)
-            update = Update.de_json(data, application.bot)
-
-            if not application_initialized:
-                await application.initialize()
-                application_initialized = True
-
-            await application.process_update(update)
-
-            return JsonResponse({"ok": True})
-        except Exception as e:
-            logger.exception("Webhook error")
-            return JsonResponse({"error": str(e)}, status=500)
-    else:
+    if request.method != "POST":
         return JsonResponse({"GET not allowed": "Bad Request"}, status=400)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        logger.warning("Webhook with invalid update body")
+        return JsonResponse({"error": "invalid update"}, status=400)
+
+    if not await pipeline.submit(data):
+        return JsonResponse({"error": "update not accepted, retry later"}, status=503)
+    return JsonResponse({"ok": True})
 
 
 @api_view(["GET"])
@@ -78,36 +70,26 @@ def get_telegram_link(request):
 @api_view(["GET"])
 @permission_classes([IsAdminUser])
 def setwebhook(request):
-    response = requests.post(
-        TELEGRAM_API_URL + "setWebhook?url=" + NGROK_URL, timeout=5
-    ).json()
+    response = get_client().call("setWebhook", {"url": NGROK_URL}).json()
     return Response(response, status=status.HTTP_200_OK)
 
 
 @api_view(["GET"])
 @permission_classes([IsAdminUser])
 def delete_webhook(request):
-    response = requests.post(TELEGRAM_API_URL + "setWebhook?url=", timeout=5).json()
+    response = get_client().call("setWebhook", {"url": ""}).json()
     return Response(response, status=status.HTTP_200_OK)
 
 
-def send_message_to_chat(message: str):
-    payload = {
-        "chat_id": BASE_CHAT_ID,
-        "text": message,
-        "parse_mode": "HTML",
-    }
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def client_metrics(request):
+    return Response(metrics.snapshot(), status=status.HTTP_200_OK)
 
-    res = requests.post(TELEGRAM_API_URL + "sendMessage", data=payload, timeout=5)
-    return res
 
+def send_message_to_chat(message: str):
+    return get_client().send_message(BASE_CHAT_ID, message)
 
-def send_private_message(message: str, chat_id: int):
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "HTML",
-    }
 
-    res = requests.post(TELEGRAM_API_URL + "sendMessage", data=payload, timeout=5)
-    return res
+def send_private_message(message: str, chat_id: int):
+    return get_client().send_message(chat_id, message)
@@ -0,0 +1,63 @@
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from users_service.cache import aget_cached_user, get_cached_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that reads the user from cache instead of running
+    a primary key query on every request"""
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as exc:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from exc
+
+    @staticmethod
+    def check_user(user) -> None:
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+    def get_user(self, validated_token):
+        user = get_cached_user(self.get_user_id(validated_token))
+        self.check_user(user)
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # password is deferred in cache, loaded only for this check
+            return super().get_user(validated_token)
+        return user
+
+    async def aget_user(self, validated_token):
+        user = await aget_cached_user(self.get_user_id(validated_token))
+        self.check_user(user)
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(super().get_user)(validated_token)
+        return user
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views, token checks do no I/O"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """Same security scheme in the API schema as JWTAuthentication"""
+
+    target_class = CachedJWTAuthentication
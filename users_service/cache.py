@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from library_service.conditional import initial_version, versions_shared
+
+# a process-local cache (the LocMemCache default) would only learn about
+# password changes and deactivations made in its own process, other
+# processes would accept a revoked user until USER_CACHE_TIMEOUT ends, so
+# users are only cached when every process shares the cache
+
+
+def user_version_key(user_id) -> str:
+    return f"users:{user_id}:version"
+
+
+def user_version(user_id) -> int:
+    version = cache.get(user_version_key(user_id))
+    if version is None:
+        version = initial_version()
+        cache.add(user_version_key(user_id), version, timeout=None)
+    return version
+
+
+async def auser_version(user_id) -> int:
+    version = await cache.aget(user_version_key(user_id))
+    if version is None:
+        version = initial_version()
+        await cache.aadd(user_version_key(user_id), version, timeout=None)
+    return version
+
+
+def bump_user_version(user_id) -> None:
+    """Invalidate the cached user, again after commit so a request that
+    read the old row meanwhile does not keep it cached"""
+
+    def bump():
+        try:
+            cache.incr(user_version_key(user_id))
+        except ValueError:
+            cache.set(user_version_key(user_id), initial_version(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_cached_user(user_id):
+    """User by id from a short lived cache entry keyed by user version,
+    None when the user does not exist. Password hash is not cached"""
+    users = get_user_model().objects.defer("password")
+    if not versions_shared():
+        return users.filter(id=user_id).first()
+    key = f"users:{user_id}:v{user_version(user_id)}"
+    user = cache.get(key)
+    if user is None:
+        user = users.filter(id=user_id).first()
+        if user is not None:
+            cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+    return user
+
+
+async def aget_cached_user(user_id):
+    users = get_user_model().objects.defer("password")
+    if not versions_shared():
+        return await users.filter(id=user_id).afirst()
+    key = f"users:{user_id}:v{await auser_version(user_id)}"
+    user = await cache.aget(key)
+    if user is None:
+        user = await users.filter(id=user_id).afirst()
+        if user is not None:
+            await cache.aset(key, user, settings.USER_CACHE_TIMEOUT)
+    return user
@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users_service.cache import bump_user_version
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Covers profile changes, password change and deactivation, bulk
+    QuerySet.update() is only caught by USER_CACHE_TIMEOUT"""
+    bump_user_version(instance.pk)
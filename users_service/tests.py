@@ -1,12 +1,17 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from library_service.tests import SHARED_CACHE
 
 CREATE_USER_URL = reverse("users-service:register")
 USER_TOKEN_URL = reverse("users-service:token_obtain_pair")
 USER_ME_URL = reverse("users-service:manage-user")
+USER_SUMMARY_URL = reverse("users-service:user-summary")
 
 
 def sample_user(**params):
@@ -92,6 +97,10 @@ class PublicUserServiceTests(TestCase):
         res = self.client.post(USER_TOKEN_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_user_summary_unauthorized(self):
+        res = self.client.get(USER_SUMMARY_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def test_user_me_unauthorized(self):
         res = self.client.get(USER_ME_URL)
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -125,3 +134,77 @@ class PrivateUserServiceTests(TestCase):
         self.assertEqual(res.data["first_name"], self.user.first_name)
         self.assertEqual(res.data["last_name"], self.user.last_name)
         self.assertTrue(self.user.check_password(payload["password"]))
+
+    def test_user_summary(self):
+        res = self.client.get(USER_SUMMARY_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["active_count"], 0)
+        self.assertEqual(res.data["overdue_count"], 0)
+        self.assertEqual(res.data["outstanding"], "0.00")
+
+        with self.assertNumQueries(1):
+            self.client.get(USER_SUMMARY_URL)
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = sample_user(email="user@gmail.com", password="<PASSWORD>")
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZE=f"Bearer {AccessToken.for_user(self.user)}"
+        )
+
+    def test_user_resolved_from_cache(self):
+        with self.assertNumQueries(1):
+            self.client.get(USER_ME_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(USER_ME_URL)
+        self.assertEqual(res.data["email"], self.user.email)
+
+        self.client.get(USER_SUMMARY_URL)
+        with self.assertNumQueries(1):
+            res = self.client.get(USER_SUMMARY_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_not_cached_in_process_local_cache(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.client.get(USER_ME_URL)
+
+    def test_profile_change_invalidates_cache(self):
+        self.client.get(USER_ME_URL)
+        self.user.first_name = "Lucy"
+        self.user.save()
+
+        res = self.client.get(USER_ME_URL)
+        self.assertEqual(res.data["first_name"], "Lucy")
+
+    def test_deactivated_user_rejected(self):
+        self.client.get(USER_ME_URL)
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(USER_ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_rejected(self):
+        self.client.get(USER_ME_URL)
+        self.user.delete()
+
+        res = self.client.get(USER_ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_update_through_cached_user(self):
+        self.client.get(USER_ME_URL)
+        res = self.client.patch(USER_ME_URL, {"password": "newpassword"})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("newpassword"))
+        self.assertEqual(self.user.email, "user@gmail.com")
@@ -5,7 +5,7 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView,
 )
 
-from users_service.views import CreateUserView, ManageUserView
+from users_service.views import CreateUserView, ManageUserView, UserSummaryView
 
 urlpatterns = [
     path("token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
@@ -17,6 +17,7 @@ urlpatterns = [
     ),
     path("", CreateUserView.as_view(), name="register"),
     path("me/", ManageUserView.as_view(), name="manage-user"),
+    path("me/summary/", UserSummaryView.as_view(), name="user-summary"),
 ]
 
 app_name = "users-service"
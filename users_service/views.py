@@ -1,6 +1,8 @@
 from rest_framework import generics, permissions
-from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from borrowings_service.serializers import BorrowingSummarySerializer
+from borrowings_service.summary import get_summary
+from users_service.authentication import CachedJWTAuthentication
 from users_service.serializers import UserSerializer
 
 
@@ -10,8 +12,19 @@ class CreateUserView(generics.CreateAPIView):
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         return self.request.user
+
+
+class UserSummaryView(generics.RetrieveAPIView):
+    """Active and overdue borrowings and unpaid amount of the current user"""
+
+    serializer_class = BorrowingSummarySerializer
+    authentication_classes = (CachedJWTAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_object(self):
+        return get_summary(self.request.user.id)